@@ -0,0 +1,49 @@
+"""Compares two load test result files.
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import json
+
+
+def change(old, new):
+    if old and new is not None:
+        text = '{0} -> {1} ({2:+.1f}%)'.format(
+            old, new, (new - old) * 100.0 / old)
+    else:
+        text = '{0} -> {1}'.format(old, new)
+    return '{0:>30}'.format(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print('{0} ({1}) -> {2} ({3})'.format(
+        old['commit'], old['timestamp'], new['commit'], new['timestamp']))
+    print('{0:>10} {1:>30} {2:>30} {3:>30} {4:>30}'.format(
+        'route', 'req/s', 'p50 ms', 'p99 ms', 'queries'))
+    for route in sorted(set(old['routes']) | set(new['routes'])):
+        a = old['routes'].get(route, {})
+        b = new['routes'].get(route, {})
+        print('{0:>10} {1} {2} {3} {4}'.format(
+            route,
+            change(a.get('throughput'), b.get('throughput')),
+            change(a.get('p50_ms'), b.get('p50_ms')),
+            change(a.get('p99_ms'), b.get('p99_ms')),
+            change(a.get('queries_mean'), b.get('queries_mean'))))
+    print('{0:>10} {1} {2} {3}'.format(
+        'total',
+        change(old['throughput'], new['throughput']),
+        change(old['p50_ms'], new['p50_ms']),
+        change(old['p99_ms'], new['p99_ms'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""Load test driving the real routes against a seeded social graph.
+
+    python -m benchmarks.loadtest --users 1000 --concurrency 8 --seconds 20
+    python -m benchmarks.loadtest --mode http --workers 4 --concurrency 32
+
+Seeds a throwaway SQLite database (see benchmarks.seed), then runs
+--concurrency virtual users. Each logs in as a random seeded user and
+issues a weighted mix of timeline, user list, post, follow, unfollow and
+login requests. In `client` mode requests go through the Flask test client
+in this process, in `http` mode through a multi-worker server started with
+benchmarks.serve.
+
+Responses other than 2xx count as errors, except the redirects the write
+routes answer with; one to the login form means the session was lost.
+Prints p50/p99 latency, throughput and SQL queries per route and saves
+them as JSON under benchmarks/results, named after the current commit, so
+runs can be compared with benchmarks.compare.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from timeit import default_timer
+
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlencode, urlparse
+except ImportError:  # python 2
+    from httplib import HTTPConnection
+    from urllib import urlencode
+    from urlparse import urlparse
+
+from benchmarks.seed import PASSWORD, seed, user_name
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'results')
+
+# (route name, weight)
+MIX = [
+    ('timeline', 60),
+    ('users', 15),
+    ('post', 10),
+    ('follow', 5),
+    ('unfollow', 5),
+    ('login', 5),
+]
+
+
+class ClientSession(object):
+    """Requests through the Flask test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return (response.status_code, response.headers.get('Location'),
+                response.headers.get('X-SQL-Queries'))
+
+
+class HTTPSession(object):
+    """Requests over HTTP keeping the session cookie."""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookie = None
+
+    def request(self, method, path, data=None):
+        conn = HTTPConnection('127.0.0.1', self.port, timeout=30)
+        headers = {}
+        body = None
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        conn.close()
+        return (response.status, response.getheader('Location'),
+                response.getheader('X-SQL-Queries'))
+
+
+class VirtualUser(object):
+
+    def __init__(self, session, users, rng):
+        self.session = session
+        self.users = users
+        self.rng = rng
+        self.user_id = rng.randint(1, users)
+
+    def login(self):
+        return self.session.request('POST', '/', dict(
+            name=user_name(self.user_id), password=PASSWORD))
+
+    def run(self, route):
+        other = self.rng.randint(1, self.users)
+        if route == 'timeline':
+            return self.session.request('GET', '/tweets/')
+        if route == 'users':
+            return self.session.request('GET', '/users/')
+        if route == 'post':
+            return self.session.request('POST', '/tweets/post/', dict(
+                tweet='load test tweet {0}'.format(self.rng.random())))
+        if route == 'follow':
+            return self.session.request('GET', '/tweets/follow/{0}/'.format(other))
+        if route == 'unfollow':
+            return self.session.request('GET', '/tweets/unfollow/{0}/'.format(other))
+        if route == 'login':
+            return self.login()
+        raise ValueError(route)
+
+
+def succeeded(status, location):
+    """2xx, or a redirect the way the write routes answer. A redirect to
+    the login form means the session was lost and counts as an error."""
+    if 200 <= status < 300:
+        return True
+    return (300 <= status < 400 and location is not None
+            and urlparse(location).path not in ('', '/'))
+
+
+def pick(rng):
+    point = rng.uniform(0, sum(weight for _, weight in MIX))
+    for route, weight in MIX:
+        point -= weight
+        if point <= 0:
+            return route
+    return MIX[-1][0]
+
+
+def drive(make_session, users, deadline, samples, seed_value):
+    rng = random.Random(seed_value)
+    user = VirtualUser(make_session(), users, rng)
+    user.login()
+    while default_timer() < deadline:
+        route = pick(rng)
+        started = default_timer()
+        status, location, queries = user.run(route)
+        samples.append((route, default_timer() - started,
+                        succeeded(status, location),
+                        None if queries is None else int(queries)))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(samples, seconds):
+    routes = {}
+    for route in sorted(set(s[0] for s in samples)):
+        timings = [s[1] for s in samples if s[0] == route]
+        queries = [s[3] for s in samples if s[0] == route and s[3] is not None]
+        routes[route] = dict(
+            count=len(timings),
+            errors=len([s for s in samples if s[0] == route and not s[2]]),
+            throughput=round(len(timings) / seconds, 2),
+            p50_ms=round(percentile(timings, 0.5) * 1000, 3),
+            p99_ms=round(percentile(timings, 0.99) * 1000, 3),
+            mean_ms=round(sum(timings) / len(timings) * 1000, 3),
+            queries_mean=round(sum(queries) / float(len(queries)), 2)
+                if queries else None,
+            queries_max=max(queries) if queries else None,
+        )
+    timings = [s[1] for s in samples]
+    return dict(
+        requests=len(samples),
+        throughput=round(len(samples) / seconds, 2),
+        p50_ms=round(percentile(timings, 0.5) * 1000, 3),
+        p99_ms=round(percentile(timings, 0.99) * 1000, 3),
+        routes=routes,
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD']).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def wait_for_server(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            HTTPSession(port).request('GET', '/register/')
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError('server on port {0} did not come up'.format(port))
+
+
+def print_report(report):
+    print('{0:>10} {1:>7} {2:>9} {3:>9} {4:>9} {5:>8} {6:>7}'.format(
+        'route', 'count', 'req/s', 'p50 ms', 'p99 ms', 'queries', 'errors'))
+    for route, stats in sorted(report['routes'].items()):
+        print('{0:>10} {1:>7} {2:>9} {3:>9} {4:>9} {5:>8} {6:>7}'.format(
+            route, stats['count'], stats['throughput'], stats['p50_ms'],
+            stats['p99_ms'], stats['queries_mean'], stats['errors']))
+    print('{0:>10} {1:>7} {2:>9} {3:>9} {4:>9}'.format(
+        'total', report['requests'], report['throughput'],
+        report['p50_ms'], report['p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--tweets', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=20)
+    parser.add_argument('--alpha', type=float, default=1.1)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=4,
+                        help='server processes in http mode')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--rounds', type=int, default=4,
+                        help='bcrypt cost of the seeded passwords')
+    parser.add_argument('--output', help='where to save the JSON results')
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    # must be set before the app is imported, the config reads it once
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    from project import app
+    app.config.update(
+        TESTING=True,
+        DEBUG=False,
+        WTF_CSRF_ENABLED=False,
+        METRICS_QUERY_HEADER=True,
+        BCRYPT_LOG_ROUNDS=args.rounds,
+    )
+    server = None
+    try:
+        graph = seed(args.users, args.tweets, args.follows, args.alpha,
+                     args.rounds)
+        print('seeded {0}'.format(graph))
+        if args.mode == 'http':
+            server = subprocess.Popen([
+                sys.executable, '-m', 'benchmarks.serve',
+                '--port', str(args.port), '--workers', str(args.workers),
+                '--rounds', str(args.rounds)])
+            wait_for_server(args.port)
+            make_session = lambda: HTTPSession(args.port)
+        else:
+            make_session = lambda: ClientSession(app)
+
+        samples = []
+        started = default_timer()
+        deadline = started + args.seconds
+        threads = [
+            threading.Thread(target=drive, args=(
+                make_session, args.users, deadline, samples, i))
+            for i in range(args.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report = summarize(samples, default_timer() - started)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        os.remove(path)
+
+    commit = git_commit()
+    report.update(
+        commit=commit,
+        timestamp=datetime.datetime.utcnow().isoformat() + 'Z',
+        mode=args.mode,
+        graph=graph,
+        concurrency=args.concurrency,
+        workers=args.workers if args.mode == 'http' else 1,
+    )
+    print_report(report)
+    output = args.output or os.path.join(RESULTS_DIR, '{0}-{1}-{2}.json'.format(
+        commit, args.mode, datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')))
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('saved {0}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
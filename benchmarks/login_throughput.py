@@ -0,0 +1,131 @@
+"""Login throughput under concurrency.
+
+    python -m benchmarks.login_throughput --concurrency 1 2 4 8 16
+    python -m benchmarks.login_throughput --mode http --workers 2 --threads 1 8
+
+Each level runs that many client threads posting logins for a fixed time,
+while one more thread requests the register page to show how much the
+logins slow down routes that do no hashing. In `client` mode requests go
+through the Flask test client, every client on its own thread of this
+process. In `http` mode they go to a benchmarks.serve server started once
+per --threads value, sync workers for 1 and threaded workers above, since
+a login holds a sync worker for its whole hash. Prints logins per second,
+login and bystander latency percentiles and how many logins were refused
+with a 503.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from timeit import default_timer
+
+from benchmarks.loadtest import ClientSession, HTTPSession, wait_for_server
+from project import app, db, passwords
+from project.models import User
+
+
+def percentile(timings, fraction):
+    if not timings:
+        return 0.0
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1000
+
+
+def client_loop(make_session, path, data, deadline, timings, statuses):
+    session = make_session()
+    while default_timer() < deadline:
+        started = default_timer()
+        status, _, _ = session.request(
+            'GET' if data is None else 'POST', path, data)
+        timings.append(default_timer() - started)
+        statuses.append(status)
+
+
+def run_level(make_session, concurrency, seconds):
+    deadline = default_timer() + seconds
+    logins, login_statuses = [], []
+    bystander, bystander_statuses = [], []
+    threads = [
+        threading.Thread(target=client_loop, args=(
+            make_session, '/', dict(name='benchmark', password='benchmark'),
+            deadline, logins, login_statuses))
+        for _ in range(concurrency)
+    ]
+    threads.append(threading.Thread(target=client_loop, args=(
+        make_session, '/register/', None, deadline, bystander,
+        bystander_statuses)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print('{0:>4} clients: {1:7.1f} logins/s  p50 {2:7.1f} ms  p99 {3:7.1f} ms'
+          '  refused {4:4}  | other route p50 {5:6.1f} ms  p99 {6:6.1f} ms'.format(
+              concurrency, login_statuses.count(302) / float(seconds),
+              percentile(logins, 0.5), percentile(logins, 0.99),
+              login_statuses.count(503),
+              percentile(bystander, 0.5), percentile(bystander, 0.99)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rounds', type=int,
+                        default=app.config['BCRYPT_LOG_ROUNDS'])
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='server processes in http mode')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8],
+                        help='request threads per server process to compare '
+                             'in http mode')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app.config.update(
+        TESTING=True,
+        WTF_CSRF_ENABLED=False,
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + path,
+        BCRYPT_LOG_ROUNDS=args.rounds,
+    )
+    try:
+        db.create_all()
+        db.session.add(User('benchmark', 'benchmark@example.com',
+                            passwords.hash('benchmark')))
+        db.session.commit()
+        db.session.remove()
+        print('bcrypt cost {0}, {1} hashing threads, queue of {2}'.format(
+            args.rounds, app.config['PASSWORD_HASH_WORKERS'],
+            app.config['PASSWORD_HASH_QUEUE_SIZE']))
+        if args.mode == 'client':
+            for concurrency in args.concurrency:
+                run_level(lambda: ClientSession(app), concurrency,
+                          args.seconds)
+            return
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + path)
+        for threads in args.threads:
+            print('{0} workers, {1}'.format(args.workers, 'sync' if threads == 1
+                  else '{0} threads each'.format(threads)))
+            server = subprocess.Popen([
+                sys.executable, '-m', 'benchmarks.serve',
+                '--port', str(args.port), '--workers', str(args.workers),
+                '--threads', str(threads), '--rounds', str(args.rounds)],
+                env=env)
+            try:
+                wait_for_server(args.port)
+                for concurrency in args.concurrency:
+                    run_level(lambda: HTTPSession(args.port), concurrency,
+                              args.seconds)
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
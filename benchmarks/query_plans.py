@@ -0,0 +1,101 @@
+"""Query plans and timings of the hot lookups before and after the
+lookup indexes migration.
+
+    python -m benchmarks.query_plans --users 2000 --tweets 100000
+
+Builds a throwaway SQLite database at schema version 2, seeds it, then
+prints EXPLAIN QUERY PLAN output and the median time of each query at
+version 2 and again after upgrading to version 3.
+"""
+import argparse
+import datetime
+import os
+import random
+import tempfile
+from timeit import default_timer
+
+from sqlalchemy import create_engine
+
+from project.migrations import upgrade
+
+QUERIES = [
+    ('tweets by user, newest first',
+     'SELECT tweet_id FROM tweets WHERE user_id = :user_id '
+     'ORDER BY posted DESC, tweet_id DESC LIMIT 21'),
+    ('followers of a user (fan-out)',
+     'SELECT who_id FROM follower WHERE whom_id = :user_id'),
+    ('followee follower counts (hybrid timelines)',
+     'SELECT whom_id FROM follower WHERE whom_id IN '
+     '(SELECT whom_id FROM follower WHERE who_id = :user_id) '
+     'GROUP BY whom_id HAVING count(*) > 100'),
+    ('home timeline page',
+     'SELECT tweet_id FROM timeline WHERE user_id = :user_id '
+     'ORDER BY posted DESC, tweet_id DESC LIMIT 21'),
+]
+
+
+def seed(engine, users, tweets, follows):
+    random.seed(0)
+    start = datetime.datetime(2016, 7, 7)
+    with engine.begin() as conn:
+        conn.execute(
+            'INSERT INTO users (id, name, email, password) VALUES (?, ?, ?, ?)',
+            [(i, 'user{0}'.format(i), 'user{0}@example.com'.format(i), 'x')
+             for i in range(1, users + 1)])
+        conn.execute(
+            'INSERT INTO tweets (user_id, tweet, posted) VALUES (?, ?, ?)',
+            [(random.randint(1, users), 'tweet {0}'.format(i),
+              start + datetime.timedelta(seconds=i)) for i in range(tweets)])
+        edges = set()
+        while len(edges) < follows:
+            who, whom = random.randint(1, users), random.randint(1, users)
+            if who != whom:
+                edges.add((who, whom))
+        conn.execute(
+            'INSERT INTO follower (who_id, whom_id) VALUES (?, ?)', list(edges))
+
+
+def measure(engine, users, runs):
+    user_ids = [random.randint(1, users) for _ in range(runs)]
+    with engine.connect() as conn:
+        conn.execute('ANALYZE')
+        for name, sql in QUERIES:
+            plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, user_id=1)
+            timings = []
+            for user_id in user_ids:
+                started = default_timer()
+                conn.execute(sql, user_id=user_id).fetchall()
+                timings.append(default_timer() - started)
+            timings.sort()
+            print('  {0}: {1:.3f} ms median'.format(
+                name, timings[len(timings) // 2] * 1000))
+            for row in plan:
+                print('      ' + row[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--tweets', type=int, default=100000)
+    parser.add_argument('--follows', type=int, default=50000)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        engine = create_engine('sqlite:///' + path)
+        upgrade(engine, target=1)
+        seed(engine, args.users, args.tweets, args.follows)
+        upgrade(engine, target=2)
+        print('schema version 2 (before lookup indexes)')
+        measure(engine, args.users, args.runs)
+        upgrade(engine, target=3)
+        print('schema version 3 (after lookup indexes)')
+        measure(engine, args.users, args.runs)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
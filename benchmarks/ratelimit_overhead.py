@@ -0,0 +1,92 @@
+"""Rate limiter overhead per request.
+
+    python -m benchmarks.ratelimit_overhead --iterations 20000
+
+Times `limiter.check` inside a request context for an endpoint without
+limits, and for one with a per-user and a per-address limit on each store,
+then a request through the test client with the limiter off and on. Limits
+are set high enough that nothing is refused. The check should stay well
+under a millisecond on every store.
+"""
+import argparse
+import os
+import tempfile
+from timeit import default_timer
+
+from flask import session
+
+from project import app, db, limiter
+from project.models import RateLimit
+from project.ratelimit import (LocalRateLimitStore, RateLimited,
+    SQLRateLimitStore)
+
+LIMITS = {
+    'benchmark-user': ('user', 10 ** 9, 1, ('users.login',)),
+    'benchmark-ip': ('ip', 10 ** 9, 1, ('users.login',)),
+}
+
+
+def time_checks(path, iterations, user_id=1):
+    with app.test_request_context(path):
+        session['user_id'] = user_id
+        started = default_timer()
+        for _ in range(iterations):
+            limiter.check()
+        return (default_timer() - started) / iterations
+
+
+def time_requests(path, iterations):
+    client = app.test_client()
+    started = default_timer()
+    for _ in range(iterations):
+        client.get(path)
+    return (default_timer() - started) / iterations
+
+
+def report(name, seconds):
+    print('{0:<28} {1:9.1f} us'.format(name, seconds * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + path,
+        RATELIMIT_ENABLED=True,
+        RATE_LIMITS=LIMITS,
+    )
+    store = limiter.store
+    try:
+        db.create_all()
+        report('check, no limits', time_checks('/register/', args.iterations))
+        limiter.store = LocalRateLimitStore(
+            app.config['RATELIMIT_MAX_ENTRIES'])
+        report('check, local store', time_checks('/', args.iterations))
+        limiter.store = SQLRateLimitStore(db, RateLimit.__table__)
+        report('check, sql store', time_checks(
+            '/', max(1, args.iterations // 10)))
+
+        limiter.store = LocalRateLimitStore(
+            app.config['RATELIMIT_MAX_ENTRIES'])
+        requests = max(1, args.iterations // 10)
+        app.config['RATELIMIT_ENABLED'] = False
+        off = time_requests('/', requests)
+        app.config['RATELIMIT_ENABLED'] = True
+        on = time_requests('/', requests)
+        report('GET /, limiter off', off)
+        report('GET /, limiter on', on)
+        report('difference', on - off)
+    except RateLimited:
+        parser.error('a benchmark request was rate limited')
+    finally:
+        limiter.store = store
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
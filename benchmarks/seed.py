@@ -0,0 +1,132 @@
+"""Seeds a database with a synthetic social graph.
+
+    python -m benchmarks.seed --database /tmp/tweepy.db --users 10000
+
+Follower counts follow a power law: a few accounts are followed by a large
+share of users and most have a handful of followers, and how much users
+tweet is skewed the same way. Every user is called user<id> and has the
+password 'password'. The database is created with the current models and
+the counters, home timelines and search indexes are built afterwards.
+"""
+import argparse
+import bisect
+import datetime
+import os
+import random
+
+PASSWORD = 'password'
+
+# out-degrees are pareto distributed with this shape, scaled to the median
+FOLLOW_SHAPE = 1.5
+
+# tweets are drawn from this vocabulary with the same skew as the graph, so
+# search sees both common and rare terms
+WORDS = (
+    'hello world flask python coffee morning night weekend music movie '
+    'game team work code deploy bug release travel city train rain sun '
+    'snow lunch dinner pizza book news today tomorrow friends family happy '
+    'tired great again finally really maybe never always'
+).split()
+TWEET_WORDS = 8
+
+
+def user_name(user_id):
+    return 'user{0:06d}'.format(user_id)
+
+
+class WeightedSampler(object):
+    """Samples ids 1..n with probability proportional to rank ** -alpha."""
+
+    def __init__(self, n, alpha, rng):
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, n + 1):
+            total += rank ** -alpha
+            self.cumulative.append(total)
+        # ranks are shuffled onto ids so popularity is not ordered by id
+        self.ids = list(range(1, n + 1))
+        rng.shuffle(self.ids)
+
+    def sample(self):
+        point = self.rng.random() * self.cumulative[-1]
+        return self.ids[bisect.bisect_left(self.cumulative, point)]
+
+
+def insert_chunked(table, rows, chunk=5000):
+    from project import db
+    for start in range(0, len(rows), chunk):
+        db.session.execute(table.insert(), rows[start:start + chunk])
+    db.session.commit()
+
+
+def seed(users, tweets, follows_per_user, alpha=1.1, rounds=4, seed_value=0):
+    """Creates the schema and fills it, returns a summary dict."""
+    from project import (counters, db, passwords, search, suggestions,
+                         timelines)
+    from project.models import Follower, Tweet, User
+
+    rng = random.Random(seed_value)
+    db.create_all()
+    pw_hash = passwords.bcrypt.generate_password_hash(PASSWORD, rounds)
+    insert_chunked(User.__table__, [
+        dict(id=i, name=user_name(i), email=user_name(i) + '@example.com',
+             password=pw_hash, role='user')
+        for i in range(1, users + 1)
+    ])
+
+    popularity = WeightedSampler(users, alpha, rng)
+    edges = set()
+    for who_id in range(1, users + 1):
+        wanted = min(users - 1, int(follows_per_user *
+            rng.paretovariate(FOLLOW_SHAPE) / 2 ** (1 / FOLLOW_SHAPE)))
+        attempts = 0
+        followees = set()
+        while len(followees) < wanted and attempts < wanted * 5:
+            whom_id = popularity.sample()
+            if whom_id != who_id:
+                followees.add(whom_id)
+            attempts += 1
+        edges.update((who_id, whom_id) for whom_id in followees)
+    insert_chunked(Follower.__table__, [
+        dict(who_id=who_id, whom_id=whom_id) for who_id, whom_id in edges])
+
+    activity = WeightedSampler(users, alpha, rng)
+    vocabulary = WeightedSampler(
+        len(WORDS), alpha, random.Random(seed_value + 1))
+    start = datetime.datetime.now() - datetime.timedelta(seconds=tweets)
+    insert_chunked(Tweet.__table__, [
+        dict(user_id=activity.sample(),
+             tweet=' '.join(WORDS[vocabulary.sample() - 1]
+                            for _ in range(TWEET_WORDS)),
+             posted=start + datetime.timedelta(seconds=i))
+        for i in range(tweets)
+    ])
+
+    counters.reconcile()
+    timelines.rebuild_all()
+    search.reindex()
+    suggestions.rebuild_all()
+    return dict(users=users, tweets=tweets, follows=len(edges), alpha=alpha)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database', required=True,
+                        help='sqlite file to create')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--tweets', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=20,
+                        help='median number of accounts a user follows')
+    parser.add_argument('--alpha', type=float, default=1.1,
+                        help='power law exponent of account popularity')
+    parser.add_argument('--rounds', type=int, default=4,
+                        help='bcrypt cost of the seeded passwords')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.database)
+    print(seed(args.users, args.tweets, args.follows, args.alpha, args.rounds))
+
+
+if __name__ == '__main__':
+    main()
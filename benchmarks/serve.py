@@ -0,0 +1,69 @@
+"""Serves the app with several worker processes for HTTP load tests.
+
+    DATABASE_URL=sqlite:////tmp/tweepy.db python -m benchmarks.serve --workers 4
+
+Runs under gunicorn when it is installed, with gthread workers when
+--threads is above 1, otherwise under werkzeug's forking server, or its
+threading one in a single process when --threads is above 1. CSRF checks are off and every response reports its SQL
+query count so the load test can collect it. Sessions are kept in the
+sessions table, since the forked processes cannot share the local store.
+"""
+import argparse
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=1,
+                        help='request threads per worker')
+    parser.add_argument('--rounds', type=int, default=4,
+                        help='bcrypt cost, must match the seeded passwords')
+    args = parser.parse_args()
+
+    # read by the config on import, the forking server runs every request
+    # in a new process, so a per process store would lose each login
+    os.environ['SESSION_TYPE'] = 'sql'
+    from project import app, db
+    db.create_all()
+    app.config.update(
+        DEBUG=False,
+        WTF_CSRF_ENABLED=False,
+        METRICS_QUERY_HEADER=True,
+        BCRYPT_LOG_ROUNDS=args.rounds,
+    )
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        from werkzeug.serving import WSGIRequestHandler, run_simple
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        if args.threads > 1:
+            run_simple('127.0.0.1', args.port, app, threaded=True,
+                       request_handler=QuietHandler)
+        else:
+            run_simple('127.0.0.1', args.port, app, processes=args.workers,
+                       request_handler=QuietHandler)
+        return
+
+    class Server(BaseApplication):
+
+        def load_config(self):
+            self.cfg.set('bind', '127.0.0.1:{0}'.format(args.port))
+            self.cfg.set('workers', args.workers)
+            if args.threads > 1:
+                self.cfg.set('worker_class', 'gthread')
+                self.cfg.set('threads', args.threads)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+if __name__ == '__main__':
+    main()
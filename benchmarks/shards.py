@@ -0,0 +1,88 @@
+"""Home timeline reads from the inbox and scatter-gather over SQLite shards.
+
+    python -m benchmarks.shards --users 2000 --tweets 50000 --shards 1 2 4 8
+
+Seeds a throwaway main database with benchmarks.seed, copies its tweets and
+follows onto each number of shards with the reshard copy, then reads the
+first timeline page of --reads users picked at random, from the inbox of
+the main database and from the shards with SHARD_WORKERS threads and with
+one. Prints the median and 95th percentile milliseconds of each.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+from timeit import default_timer
+
+from benchmarks.seed import seed
+from project import app, db, shards, timelines
+from project.shards import connect, reshard
+
+
+def percentiles(values):
+    values = sorted(values)
+    return (values[len(values) // 2] * 1000,
+            values[int(len(values) * 0.95)] * 1000)
+
+
+def measure(read, user_ids):
+    times = []
+    for user_id in user_ids:
+        started = default_timer()
+        read(user_id)
+        times.append(default_timer() - started)
+        db.session.remove()
+    return percentiles(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--tweets', type=int, default=50000)
+    parser.add_argument('--follows', type=int, default=50)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--reads', type=int, default=200)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(
+            directory, 'main.db'),
+    )
+    per_page = app.config['TWEETS_PER_PAGE']
+    try:
+        seed(args.users, args.tweets, args.follows)
+        db.session.remove()
+        rng = random.Random(0)
+        user_ids = [rng.randint(1, args.users) for _ in range(args.reads)]
+        print('{0:<16} {1:>9} {2:>9}'.format('source', 'p50 ms', 'p95 ms'))
+        print('{0:<16} {1:9.2f} {2:9.2f}'.format('inbox', *measure(
+            timelines.home_timeline, user_ids)))
+        workers = app.config['SHARD_WORKERS']
+        for count in args.shards:
+            urls = ['sqlite:///' + os.path.join(
+                directory, 'shard-{0}-{1}.db'.format(count, i))
+                for i in range(count)]
+            targets = [connect(url) for url in urls]
+            reshard([db.engine], targets, app.config['BULK_CHUNK_SIZE'])
+            for target in targets:
+                target.dispose()
+            app.config['SHARDS'] = urls
+            for threads in (workers, 1):
+                app.config['SHARD_WORKERS'] = threads
+                shards._pool = None
+                print('{0:<16} {1:9.2f} {2:9.2f}'.format(
+                    '{0} shards, {1} thr'.format(count, threads), *measure(
+                        lambda user_id: shards.home_timeline(
+                            user_id, None, per_page), user_ids)))
+            shards.dispose()
+    finally:
+        app.config['SHARDS'] = []
+        db.session.remove()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
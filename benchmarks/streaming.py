@@ -0,0 +1,95 @@
+"""Time to first byte and bytes on the wire for a long timeline page.
+
+    python -m benchmarks.streaming --tweets 200 --requests 50
+
+Seeds a throwaway SQLite database with one user whose timeline holds
+--tweets tweets, shows them all on one page and requests /tweets/ through
+the Flask test client with streaming off and on, uncompressed and with
+each encoding the server supports. The page cache is cleared before every
+request so the timeline is rendered each time. Prints median time to the
+first body byte, median time to the last one, and the body size.
+"""
+import argparse
+import datetime
+import os
+import tempfile
+from timeit import default_timer
+
+from project import app, bcrypt, cache, compress, db, timelines
+from project.models import Tweet, User
+
+
+def seed(tweets):
+    db.create_all()
+    db.session.add(User('benchmark', 'benchmark@example.com',
+                        bcrypt.generate_password_hash('benchmark')))
+    db.session.commit()
+    start = datetime.datetime(2016, 7, 7)
+    db.session.add_all([
+        Tweet('benchmark tweet number {0} with a few words of text'.format(i),
+              start + datetime.timedelta(minutes=i), 1)
+        for i in range(tweets)
+    ])
+    db.session.commit()
+    timelines.rebuild(1)
+    db.session.commit()
+    db.session.remove()
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure(client, encoding, requests):
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    first, last, size = [], [], 0
+    for _ in range(requests):
+        cache.clear()
+        started = default_timer()
+        response = client.get('/tweets/', headers=headers)
+        size = 0
+        for chunk in response.response:
+            if chunk and not size:
+                first.append(default_timer() - started)
+            size += len(chunk)
+        last.append(default_timer() - started)
+        response.close()
+    return median(first), median(last), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tweets', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app.config.update(
+        TESTING=True,
+        WTF_CSRF_ENABLED=False,
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + path,
+        TWEETS_PER_PAGE=args.tweets,
+        BCRYPT_LOG_ROUNDS=4,
+    )
+    try:
+        seed(args.tweets)
+        client = app.test_client()
+        client.post('/', data=dict(name='benchmark', password='benchmark'))
+        print('{0:<10} {1:<10} {2:>10} {3:>10} {4:>9}'.format(
+            'streaming', 'encoding', 'first ms', 'last ms', 'bytes'))
+        for streamed in (False, True):
+            app.config['STREAM_TEMPLATES'] = streamed
+            for encoding in [None] + compress.encodings[::-1]:
+                first, last, size = measure(client, encoding, args.requests)
+                print('{0:<10} {1:<10} {2:10.2f} {3:10.2f} {4:9}'.format(
+                    'on' if streamed else 'off', encoding or 'identity',
+                    first * 1000, last * 1000, size))
+    finally:
+        db.session.remove()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 from project import db
+from project.migrations import current_version, upgrade
 
-db.create_all()
-db.session.commit()
+applied = upgrade(db.engine)
+print('Applied migrations {0}, schema is at version {1}.'.format(
+    applied, current_version(db.engine)))
@@ -1,42 +1,71 @@
-import datetime
-
-from flask import Flask, request, render_template
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, render_template
 from flask_bcrypt import Bcrypt
 
+from project.assets import Assets
+from project.cache import Cache
+from project.compress import Compress
+from project.database import set_sqlite_pragmas
+from project.logs import init_error_log, request_fields
+from project.passwords import PasswordHasher
+from project.push import Push
+from project.ratelimit import RateLimited, RateLimiter
+from project.replicas import RoutedSQLAlchemy
+from project.sessions import ServerSessions
+from project.shards import Shards
+
 app = Flask(__name__)
 app.config.from_pyfile('_config.py')
 bcrypt = Bcrypt(app)
-db = SQLAlchemy(app)
+db = RoutedSQLAlchemy(app)
+set_sqlite_pragmas(app.config['SQLITE_PRAGMAS'])
+cache = Cache(app)
+push = Push(app)
+assets = Assets(app)
+compress = Compress(app)
+sessions = ServerSessions(app)
+shards = Shards(app)
+passwords = PasswordHasher(bcrypt, app)
+error_log = init_error_log(app)
+
+from project import metrics
+metrics.init_app(app, cache, push)
+# after metrics, so refused requests are still timed
+limiter = RateLimiter(app)
 
 from project.users.views import users_blueprint
 from project.tweets.views import tweets_blueprint
+from project.metrics.views import metrics_blueprint
+from project.api.views import api_blueprint
+from project.search.views import search_blueprint
 
 # registering blueprints
 app.register_blueprint(users_blueprint)
 app.register_blueprint(tweets_blueprint)
+app.register_blueprint(metrics_blueprint)
+app.register_blueprint(api_blueprint)
+app.register_blueprint(search_blueprint)
+
+from project import commands
 
 
 # error handlers
 @app.errorhandler(404)
 def not_found(e):
     if app.debug is not True:
-        now = datetime.datetime.now()
-        r = request.url
-        with open('error.log', 'a') as f:
-            current_timestamp = now.strftime("%d-%m-%Y %H:%M:%S")
-            f.write("\n404 error at {}: {}".format(current_timestamp, r))
+        error_log.warning('404 error', extra=request_fields(404))
     return render_template('404.html'), 404
 
 
+@app.errorhandler(RateLimited)
+def rate_limited(e):
+    return (render_template('429.html', retry_after=e.retry_after), 429,
+            {'Retry-After': str(e.retry_after)})
+
+
 # cannot test this in development
 @app.errorhandler(500) # pragma: no cover
 def internal_error(e):
     db.session.rollback()
     if app.debug is not True:
-        now = datetime.datetime.now()
-        r = request.url
-        with open('error.log', 'a') as f:
-            current_timestamp = now.strftime("%d-%m-%Y %H:%M:%S")
-            f.write("\n500 error at {}: {}".format(current_timestamp, r))
+        error_log.error('500 error', extra=request_fields(500))
     return render_template('500.html'), 500
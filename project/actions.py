@@ -0,0 +1,335 @@
+# imports
+import datetime
+
+from project import app, cache, db, jobs, push, search, shards, timelines
+from project.database import insert_ignore
+from project.models import User, Tweet, Follower
+
+follower = Follower.__table__
+
+
+# errors
+
+class ActionError(Exception):
+    """A write the current user is not allowed to make."""
+    status = 400
+
+
+class NotFound(ActionError):
+    status = 404
+
+
+class Forbidden(ActionError):
+    status = 403
+
+
+class Conflict(ActionError):
+    status = 409
+
+
+# helper functions
+
+def find_user(user_id):
+    whom = db.session.query(User).filter_by(id=user_id).first()
+    if whom is None:
+        raise NotFound('That user does not exist.')
+    return whom
+
+
+def batch_ids(who_id, whom_ids):
+    whom_ids = set(whom_ids)
+    whom_ids.discard(who_id)
+    limit = app.config['BATCH_FOLLOW_LIMIT']
+    if len(whom_ids) > limit:
+        raise ActionError(
+            'You can follow or unfollow at most {0} users at once.'.format(
+                limit))
+    return sorted(whom_ids)
+
+
+def following_among(who_id, whom_ids):
+    rows = db.session.query(Follower.whom_id).filter(
+        Follower.who_id == who_id, Follower.whom_id.in_(whom_ids))
+    return set(row[0] for row in rows)
+
+
+def insert_follows(who_id, whom_ids):
+    """Inserts the follows of `whom_ids` by `who_id`, returns the ids this
+    transaction inserted. A concurrent follow of one of them makes the
+    multi-row insert skip it, then the inserts are redone one at a time so
+    only the edges written here are counted."""
+    statement = insert_ignore(follower, db.engine.dialect)
+    rows = [dict(who_id=who_id, whom_id=whom_id) for whom_id in whom_ids]
+    if db.session.execute(statement, rows).rowcount == len(rows):
+        return whom_ids
+    db.session.rollback()
+    return [row['whom_id'] for row in rows
+            if db.session.execute(statement, row).rowcount]
+
+
+def delete_follows(who_id, whom_ids):
+    """Deletes the follows of `whom_ids` by `who_id`, returns the ids this
+    transaction deleted, see insert_follows."""
+    edges = db.session.query(Follower).filter(Follower.who_id == who_id)
+    deleted = edges.filter(Follower.whom_id.in_(whom_ids)).delete(
+        synchronize_session=False)
+    if deleted == len(whom_ids):
+        return whom_ids
+    db.session.rollback()
+    return [whom_id for whom_id in whom_ids
+            if edges.filter(Follower.whom_id == whom_id).delete(
+                synchronize_session=False)]
+
+
+def queue_refans(whom_ids):
+    """Queues a refan of each of `whom_ids` an unfollow brought back under
+    the fan-out limit, returns the job ids."""
+    if shards.enabled:
+        return []
+    return [jobs.enqueue('refan', author_id=whom_id)
+            for whom_id in timelines.fell_to_limit(whom_ids)]
+
+
+def queue_shard_sync(user_id, tweet_ids=(), whom_ids=()):
+    """Queues the copy of the written rows onto the shards, if there are
+    any, and returns the job id for `jobs.run`."""
+    if not shards.enabled:
+        return None
+    return jobs.enqueue('shard-sync', user_id=user_id,
+                        tweet_ids=list(tweet_ids), whom_ids=list(whom_ids))
+
+
+def queue_follow_jobs(kind, who_id, whom_ids):
+    """Queues what brings the home timeline of `who_id` in line after their
+    follows of `whom_ids` changed, the inbox job `kind` (backfill or prune)
+    or, while SHARDS is set, a shard sync. Returns (job id, sync id)."""
+    if shards.enabled:
+        return None, queue_shard_sync(who_id, whom_ids=whom_ids)
+    return jobs.enqueue(kind, who_id=who_id, whom_ids=list(whom_ids)), None
+
+
+# actions
+#
+# Shared by the HTML and JSON views so fan-out and cache invalidation
+# happen in exactly one place. Work that grows with the follow graph is
+# queued as a background job, see the handlers at the end. While SHARDS is
+# set home timelines are read from the shards, so the inboxes are left
+# alone and the single row write to the writer's shard is run in the
+# request, which makes it show on their own timeline at once.
+
+def post_tweet(user_id, text):
+    new_tweet = Tweet(text, datetime.datetime.now(), user_id)
+    db.session.add(new_tweet)
+    db.session.flush()
+    search.index_tweet(new_tweet)
+    User.adjust_counts(user_id, tweets_count=1)
+    job_id = sync_id = None
+    if shards.enabled:
+        sync_id = queue_shard_sync(user_id, tweet_ids=[new_tweet.tweet_id])
+    else:
+        timelines.deliver(new_tweet, [user_id])
+        job_id = jobs.enqueue('fan-out', tweet_id=new_tweet.tweet_id)
+    db.session.commit()
+    cache.delete(User.counts_key(user_id))
+    jobs.run(sync_id)
+    timelines.invalidate([user_id], author_id=user_id)
+    push.publish_tweet(new_tweet, [user_id])
+    jobs.dispatch(job_id)
+    return new_tweet
+
+
+def delete_tweet(user_id, tweet_id):
+    tweet = db.session.query(Tweet).filter_by(tweet_id=tweet_id)
+    found = tweet.first()
+    if found is None:
+        raise NotFound(
+            'That tweet does not exists. Saw what you did there, Hacker!')
+    if found.user_id != user_id:
+        raise Forbidden('You can only delete tasks that belong to you.')
+    search.unindex_tweet(found)
+    if tweet.delete():
+        User.adjust_counts(user_id, tweets_count=-1)
+    recipients = []
+    if shards.enabled:
+        sync_id = queue_shard_sync(user_id, tweet_ids=[tweet_id])
+    else:
+        sync_id = None
+        recipients = timelines.remove_tweet(tweet_id)
+    db.session.commit()
+    cache.delete(User.counts_key(user_id))
+    jobs.run(sync_id)
+    timelines.invalidate(recipients, author_id=user_id)
+
+
+def follow(who_id, whom_id):
+    whom = find_user(whom_id)
+    if who_id == whom_id:
+        raise ActionError('No use following yourself. '
+                          'You will still see your tweets anyway. :)')
+    inserted = db.session.execute(
+        insert_ignore(follower, db.engine.dialect),
+        dict(who_id=who_id, whom_id=whom_id)).rowcount
+    if not inserted:
+        # the skipped insert still opened a write transaction, which would
+        # block the session store until the request is torn down
+        db.session.rollback()
+        raise Conflict('You are already following {}'.format(whom.name))
+    User.adjust_counts(who_id, following_count=1)
+    User.adjust_counts(whom_id, followers_count=1)
+    job_id, sync_id = queue_follow_jobs('backfill', who_id, [whom_id])
+    db.session.commit()
+    cache.delete(User.following_key(who_id), User.counts_key(who_id),
+                 User.counts_key(whom_id))
+    jobs.run(sync_id)
+    timelines.invalidate([who_id])
+    jobs.dispatch(job_id)
+    return whom
+
+
+def unfollow(who_id, whom_id):
+    whom = find_user(whom_id)
+    if who_id == whom_id:
+        raise ActionError('No use unfollowing yourself. '
+                          'You will still see your tweets anyway. :)')
+    following = db.session.query(Follower).filter_by(
+        who_id=who_id, whom_id=whom_id)
+    if not following.first():
+        raise Conflict(
+            'You are not following {} to unfollow.'.format(whom.name))
+    refan_ids = []
+    if following.delete():
+        User.adjust_counts(who_id, following_count=-1)
+        User.adjust_counts(whom_id, followers_count=-1)
+        refan_ids = queue_refans([whom_id])
+    job_id, sync_id = queue_follow_jobs('prune', who_id, [whom_id])
+    db.session.commit()
+    cache.delete(User.following_key(who_id), User.counts_key(who_id),
+                 User.counts_key(whom_id))
+    jobs.run(sync_id)
+    timelines.invalidate([who_id])
+    jobs.dispatch(job_id, *refan_ids)
+    return whom
+
+
+# batch actions
+#
+# One transaction and a fixed number of statements however many accounts
+# are named, unless a concurrent write to the same edges makes the counts
+# come out short (see insert_follows). follow_many returns the ids (followed, already followed,
+# unknown) and unfollow_many the ids (unfollowed, not followed).
+
+def follow_many(who_id, whom_ids):
+    whom_ids = batch_ids(who_id, whom_ids)
+    if not whom_ids:
+        return [], [], []
+    existing = set(row[0] for row in db.session.query(User.id).filter(
+        User.id.in_(whom_ids)))
+    new = sorted(existing - following_among(who_id, existing))
+    if new:
+        new = insert_follows(who_id, new)
+    if new:
+        User.adjust_counts(who_id, following_count=len(new))
+        User.adjust_counts(new, followers_count=1)
+        job_id, sync_id = queue_follow_jobs('backfill', who_id, new)
+    db.session.commit()
+    if new:
+        cache.delete(User.following_key(who_id), User.counts_key(who_id),
+                     *[User.counts_key(whom_id) for whom_id in new])
+        jobs.run(sync_id)
+        timelines.invalidate([who_id])
+        jobs.dispatch(job_id)
+    missing = [i for i in whom_ids if i not in existing]
+    return new, sorted(existing - set(new)), missing
+
+
+def unfollow_many(who_id, whom_ids):
+    whom_ids = batch_ids(who_id, whom_ids)
+    if not whom_ids:
+        return [], []
+    following = sorted(following_among(who_id, whom_ids))
+    if following:
+        following = delete_follows(who_id, following)
+    if following:
+        User.adjust_counts(who_id, following_count=-len(following))
+        User.adjust_counts(following, followers_count=-1)
+        refan_ids = queue_refans(following)
+        job_id, sync_id = queue_follow_jobs('prune', who_id, following)
+    db.session.commit()
+    if following:
+        cache.delete(User.following_key(who_id), User.counts_key(who_id),
+                     *[User.counts_key(whom_id) for whom_id in following])
+        jobs.run(sync_id)
+        timelines.invalidate([who_id])
+        jobs.dispatch(job_id, *refan_ids)
+    return following, [i for i in whom_ids if i not in following]
+
+
+# background jobs
+#
+# Each may run more than once, and after later writes to the same
+# accounts, so they recheck the follow graph and only insert what is
+# missing.
+
+@jobs.handler('fan-out')
+def fan_out_tweet(tweet_id):
+    tweet = db.session.query(Tweet).get(tweet_id)
+    if tweet is None:
+        # deleted before it reached the followers
+        return None
+    followers = timelines.fan_out(tweet)
+
+    def committed():
+        timelines.invalidate(followers)
+        push.publish_tweet(tweet, followers, to_author=False)
+    return committed
+
+
+@jobs.handler('backfill')
+def backfill_timeline(who_id, whom_ids):
+    timelines.backfill(who_id, following_among(who_id, whom_ids))
+    return lambda: timelines.invalidate([who_id])
+
+
+@jobs.handler('prune')
+def prune_timeline(who_id, whom_ids):
+    unfollowed = set(whom_ids) - following_among(who_id, whom_ids)
+    if unfollowed:
+        timelines.prune(who_id, unfollowed)
+    return lambda: timelines.invalidate([who_id])
+
+
+@jobs.handler('refan')
+def refan_author(author_id):
+    followers = timelines.refan(author_id)
+    return lambda: timelines.invalidate(followers)
+
+
+@jobs.handler('shard-sync')
+def sync_shards(user_id, tweet_ids=(), whom_ids=()):
+    """Makes the shard of `user_id` match the main database for the tweets
+    and follows named, whichever order the syncs of one row run in."""
+    if not shards.enabled:
+        return None
+    followers = []
+    posted = []
+    if tweet_ids:
+        posted = db.session.query(Tweet).filter(
+            Tweet.user_id == user_id, Tweet.tweet_id.in_(tweet_ids)).all()
+        shards.sync_tweets(user_id, tweet_ids, [
+            dict(tweet_id=t.tweet_id, user_id=t.user_id, tweet=t.tweet,
+                 posted=t.posted) for t in posted])
+        # exempt accounts reach their followers through the author
+        # generation and channel, as when fanning out
+        if not timelines.is_fanout_exempt(user_id):
+            followers = timelines.follower_ids(user_id)
+    if whom_ids:
+        shards.sync_follows(user_id, whom_ids,
+                            following_among(user_id, whom_ids))
+
+    def committed():
+        timelines.invalidate([user_id] + followers,
+                             author_id=user_id if tweet_ids else None)
+        # what the fan-out job pushes when the inboxes are in use
+        for tweet in posted:
+            push.publish_tweet(tweet, followers, to_author=False)
+    return committed
@@ -0,0 +1,254 @@
+# imports
+import hashlib
+import json
+from functools import wraps
+from flask import (current_app, jsonify, request, session, Blueprint,
+    Response)
+from werkzeug.datastructures import MultiDict
+
+from project import actions, push, search, timelines
+from project.models import User
+from project.pagination import decode_cursor, decode_rank_cursor
+from project.push import GAP
+from project.ratelimit import RateLimited
+from project.tweets.forms import PostTweetForm
+from project.users.views import user_page
+
+# config
+api_blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# helper functions
+#
+# The API shares the session cookie with the HTML views. Writes only accept
+# JSON bodies (or PUT/DELETE), which a cross-site form cannot send, so they
+# need no CSRF token.
+
+def api_error(message, status, **fields):
+    response = jsonify(error=message, **fields)
+    response.status_code = status
+    return response
+
+def login_required(test):
+    @wraps(test)
+    def wrap(*args, **kwargs):
+        if 'user_id' in session:
+            return test(*args, **kwargs)
+        return api_error('You need to login first', 401)
+    return wrap
+
+def etag_for(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+def conditional(etag, render):
+    """Returns a bodiless 304 when the client already holds `etag`, so an
+    unchanged resource is never serialized."""
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = render()
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def request_ids():
+    """The `ids` list of a JSON body, or None when it is not one."""
+    payload = request.get_json(silent=True)
+    ids = payload.get('ids') if isinstance(payload, dict) else None
+    if not isinstance(ids, list) or not all(
+            isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return None
+    return ids
+
+def tweet_dict(tweet):
+    return dict(tweet.to_dict(), name=tweet.poster.name)
+
+def format_event(message):
+    return 'event: tweet\nid: {0}\ndata: {1}\n\n'.format(
+        message['tweet_id'], json.dumps(message))
+
+def event_stream(subscription, backlog, heartbeat):
+    # runs after the request has finished, so it must not touch the
+    # database session; an idle client only costs its subscription
+    try:
+        yield 'retry: 5000\n\n'
+        for event in backlog:
+            yield event
+        while True:
+            message = subscription.get(heartbeat)
+            if message is None:
+                yield ': keepalive\n\n'
+            elif message == GAP:
+                # the client reconnects with Last-Event-ID and gets the
+                # tweets it missed replayed
+                return
+            else:
+                yield format_event(message)
+    finally:
+        subscription.close()
+
+@api_blueprint.errorhandler(RateLimited)
+def rate_limited(error):
+    response = api_error('Too many requests', 429,
+                         retry_after=error.retry_after)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+# routes
+
+@api_blueprint.route('/timeline')
+@login_required
+def timeline():
+    cursor = request.args.get('before')
+    try:
+        cursor = cursor and decode_cursor(cursor)
+    except ValueError:
+        return api_error('Invalid cursor', 400)
+    since_id = request.args.get('since_id', type=int)
+    user_id = session['user_id']
+    exempt = timelines.fanout_exempt_followees(user_id)
+    # the version changes with every write the page could show, so a
+    # matching client gets its 304 without the page being read at all
+    etag = etag_for('timeline', user_id,
+                    timelines.timeline_version(user_id, exempt),
+                    request.args.get('before'), since_id)
+
+    def render():
+        page = timelines.home_timeline(
+            user_id, cursor, exempt=exempt, since_id=since_id)
+        return jsonify(
+            tweets=[tweet_dict(t) for t in page.items],
+            next_cursor=page.next_cursor,
+        )
+    return conditional(etag, render)
+
+@api_blueprint.route('/stream')
+@login_required
+def stream():
+    user_id = session['user_id']
+    exempt = timelines.fanout_exempt_followees(user_id)
+    subscription = push.subscribe(user_id, exempt)
+    backlog = []
+    # a reconnecting EventSource sends the id of the last tweet it saw,
+    # replay what it missed or tell it to reload if that is too much
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is not None:
+        try:
+            page = timelines.home_timeline(
+                user_id, exempt=exempt, since_id=last_id)
+        except Exception:
+            subscription.close()
+            raise
+        if page.next_cursor:
+            backlog.append('event: reload\ndata: {}\n\n')
+        else:
+            backlog.extend(format_event(tweet_dict(t))
+                           for t in reversed(page.items))
+    response = Response(
+        event_stream(subscription, backlog,
+                     current_app.config['PUSH_HEARTBEAT']),
+        mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@api_blueprint.route('/users')
+@login_required
+def users():
+    page = user_page(request.args.get('q', '')[:25], request.args.get('after'))
+    following = User.following_ids(session['user_id'])
+    ids = [user.id for user in page.items]
+    etag = etag_for('users', ids, page.next_cursor,
+                    [i for i in ids if i in following])
+    return conditional(etag, lambda: jsonify(
+        users=[dict(id=user.id, name=user.name,
+                    following=user.id in following)
+               for user in page.items],
+        next_cursor=page.next_cursor,
+    ))
+
+@api_blueprint.route('/search/<any(tweets, users):kind>')
+@login_required
+def search_results(kind):
+    cursor = request.args.get('cursor')
+    try:
+        cursor = cursor and decode_rank_cursor(cursor)
+    except ValueError:
+        return api_error('Invalid cursor', 400)
+    query = request.args.get('q', '')
+    if kind == 'users':
+        page = search.search_users(query, cursor)
+        results = [dict(id=u.id, name=u.name) for u in page.items]
+    else:
+        page = search.search_tweets(query, cursor)
+        results = [tweet_dict(t) for t in page.items]
+    return jsonify(results=results, next_cursor=page.next_cursor)
+
+@api_blueprint.route('/tweets', methods=['POST'])
+@login_required
+def post_tweet():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return api_error('Expected a JSON object', 400)
+    form = PostTweetForm(MultiDict(payload), csrf_enabled=False)
+    if not form.validate():
+        return api_error('Invalid tweet', 400, fields=form.errors)
+    tweet = actions.post_tweet(session['user_id'], form.tweet.data)
+    response = jsonify(tweet_dict(tweet))
+    response.status_code = 201
+    return response
+
+@api_blueprint.route('/tweets/<int:tweet_id>', methods=['DELETE'])
+@login_required
+def delete_tweet(tweet_id):
+    try:
+        actions.delete_tweet(session['user_id'], tweet_id)
+    except actions.ActionError as error:
+        return api_error(str(error), error.status)
+    return '', 204
+
+@api_blueprint.route('/following/<int:user_id>', methods=['PUT'])
+@login_required
+def follow_user(user_id):
+    try:
+        whom = actions.follow(session['user_id'], user_id)
+    except actions.ActionError as error:
+        return api_error(str(error), error.status)
+    return jsonify(id=whom.id, name=whom.name, following=True)
+
+@api_blueprint.route('/following/<int:user_id>', methods=['DELETE'])
+@login_required
+def unfollow_user(user_id):
+    try:
+        whom = actions.unfollow(session['user_id'], user_id)
+    except actions.ActionError as error:
+        return api_error(str(error), error.status)
+    return jsonify(id=whom.id, name=whom.name, following=False)
+
+@api_blueprint.route('/following', methods=['POST'])
+@login_required
+def follow_users():
+    ids = request_ids()
+    if ids is None:
+        return api_error('Expected a JSON object with a list of ids', 400)
+    try:
+        followed, already, missing = actions.follow_many(
+            session['user_id'], ids)
+    except actions.ActionError as error:
+        return api_error(str(error), error.status)
+    return jsonify(followed=followed, already_following=already,
+                   not_found=missing)
+
+@api_blueprint.route('/following', methods=['DELETE'])
+@login_required
+def unfollow_users():
+    ids = request_ids()
+    if ids is None:
+        return api_error('Expected a JSON object with a list of ids', 400)
+    try:
+        unfollowed, not_following = actions.unfollow_many(
+            session['user_id'], ids)
+    except actions.ActionError as error:
+        return api_error(str(error), error.status)
+    return jsonify(unfollowed=unfollowed, not_following=not_following)
@@ -0,0 +1,173 @@
+"""Fingerprinted static assets.
+
+`build` copies every file under the static folder to ASSETS_DIR with a
+hash of its content in the name, writes gzip (and, when the brotli module
+is installed, brotli) compressed copies next to the compressible ones and
+records the names in a manifest. Stylesheets are rewritten to point at the
+fingerprinted fonts and images they use.
+
+`asset_url` links the fingerprinted copy when the manifest lists the file,
+and plain /static/ otherwise, e.g. in debug mode or before a build. A
+fingerprinted name never changes content, so the assets view marks them
+immutable for a year and browsers stop asking for them at all. The view
+picks the smallest encoding the client accepts and hands the file to
+send_file, which lets the server stream it with sendfile.
+
+Old builds are not deleted, pages cached with earlier names keep working.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import abort, request, safe_join, send_file, url_for
+
+from project.compress import gzip_bytes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+# already compressed formats are only fingerprinted
+COMPRESSIBLE = ('.css', '.js', '.svg', '.eot', '.ttf', '.ico', '.json', '.txt')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def fingerprint(name, content):
+    root, ext = posixpath.splitext(name)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return '{0}.{1}{2}'.format(root, digest, ext)
+
+
+def rewrite_css(name, content, manifest):
+    """Points the url()s of stylesheet `name` at fingerprinted names."""
+    directory = posixpath.dirname(name)
+
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(('data:', 'http:', 'https:', '//', '/')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = manifest.get(posixpath.normpath(
+            posixpath.join(directory, path)))
+        if target is None:
+            return match.group(0)
+        return 'url({0}{1}{2}{0})'.format(
+            quote, posixpath.relpath(target, directory or '.'), suffix)
+
+    return CSS_URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def source_files(static_dir, skip):
+    """Names of the files under `static_dir`, relative and with forward
+    slashes, stylesheets last so they can refer to the others."""
+    names = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and
+                         os.path.join(root, d) != skip)
+        for filename in files:
+            if filename.startswith('.'):
+                continue
+            path = os.path.relpath(os.path.join(root, filename), static_dir)
+            names.append(path.replace(os.sep, '/'))
+    return sorted(names, key=lambda n: (n.endswith('.css'), n))
+
+
+def write(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as stream:
+        stream.write(content)
+
+
+def build(static_dir, assets_dir):
+    """Fingerprints and compresses everything in `static_dir` into
+    `assets_dir`, returns the manifest of logical to fingerprinted names."""
+    manifest = {}
+    static_dir, assets_dir = map(os.path.abspath, (static_dir, assets_dir))
+    for name in source_files(static_dir, assets_dir):
+        with open(os.path.join(static_dir, *name.split('/')), 'rb') as stream:
+            content = stream.read()
+        if name.endswith('.css'):
+            content = rewrite_css(name, content, manifest)
+        hashed = manifest[name] = fingerprint(name, content)
+        path = os.path.join(assets_dir, *hashed.split('/'))
+        write(path, content)
+        if not name.endswith(COMPRESSIBLE):
+            continue
+        variants = [('.gz', gzip_bytes(content, 9))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content)))
+        for suffix, compressed in variants:
+            # tiny files can come out larger than they went in
+            if len(compressed) < len(content):
+                write(path + suffix, compressed)
+    manifest_path = os.path.join(assets_dir, MANIFEST)
+    with open(manifest_path, 'w') as stream:
+        json.dump(manifest, stream, indent=2, sort_keys=True)
+    return manifest
+
+
+def accepted_encodings():
+    accepted = request.accept_encodings
+    return [(encoding, suffix) for encoding, suffix in ENCODINGS
+            if accepted[encoding]]
+
+
+class Assets(object):
+
+    def __init__(self, app=None):
+        self.app = None
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.load()
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.send)
+        app.add_template_global(self.url, 'asset_url')
+
+    def load(self):
+        """Reads the manifest of the last build, if there is one."""
+        path = os.path.join(self.app.config['ASSETS_DIR'], MANIFEST)
+        self.manifest = {}
+        if os.path.exists(path):
+            with open(path) as stream:
+                self.manifest = json.load(stream)
+
+    def build(self):
+        self.manifest = build(self.app.static_folder,
+                              self.app.config['ASSETS_DIR'])
+        return self.manifest
+
+    def url(self, filename):
+        hashed = None if self.app.debug else self.manifest.get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('assets', filename=hashed)
+
+    def send(self, filename):
+        path = safe_join(self.app.config['ASSETS_DIR'], filename)
+        if filename.endswith(('.gz', '.br')) or not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or \
+            'application/octet-stream'
+        encoding = None
+        for candidate, suffix in accepted_encodings():
+            if os.path.isfile(path + suffix):
+                encoding, path = candidate, path + suffix
+                break
+        response = send_file(path, mimetype=mimetype, conditional=True)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = 'public, max-age={0}, immutable' \
+            .format(self.app.config['ASSETS_MAX_AGE'])
+        return response
@@ -0,0 +1,172 @@
+"""Bulk writes.
+
+`load` executes an ``INSERT ... ON CONFLICT DO NOTHING`` (``INSERT OR IGNORE``
+on SQLite) with a whole chunk of rows at once, so rows that already exist
+are skipped by the database instead of aborting the transaction with an
+IntegrityError.
+
+`import_files` is the offline importer behind the bulk-import command. It
+loads users, tweets and follow edges from CSV files in BULK_CHUNK_SIZE row
+transactions without touching timelines, counters, the search index or the
+shards, then rebuilds those once at the end. That is only safe while the
+site is not taking writes.
+"""
+import csv
+import datetime
+from collections import OrderedDict, namedtuple
+from timeit import default_timer
+
+from project import app, cache, counters, db, search, shards, timelines
+from project.database import insert_ignore
+from project.models import Follower, Tweet, User
+
+Step = namedtuple('Step', ['name', 'rows', 'inserted', 'seconds'])
+
+TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load(table, rows, chunk_size=None):
+    """Inserts the `rows` dicts into `table`, committing every `chunk_size`
+    rows. Returns how many rows were read and how many were new."""
+    if chunk_size is None:
+        chunk_size = app.config['BULK_CHUNK_SIZE']
+    statement = insert_ignore(table, db.engine.dialect)
+    read = inserted = 0
+    for chunk in chunked(rows, chunk_size):
+        # an executemany needs the same keys in every row, and rows that
+        # leave their id to the database have one key fewer
+        groups = OrderedDict()
+        for row in chunk:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for group in groups.values():
+            result = db.session.execute(statement, group)
+            inserted += max(result.rowcount, 0)
+        db.session.commit()
+        read += len(chunk)
+    return read, inserted
+
+
+def sync_sequence(column):
+    """Moves a postgres serial past the explicit ids an import wrote."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    table = column.table.name
+    db.session.execute(
+        "SELECT setval(pg_get_serial_sequence('{0}', '{1}'), "
+        "coalesce(max({1}), 1)) FROM {0}".format(table, column.name))
+    db.session.commit()
+
+
+# csv files
+
+def open_csv(path):
+    if str is bytes:
+        return open(path, 'rb')
+    return open(path, newline='', encoding='utf-8')
+
+
+def read_csv(path, convert):
+    """Yields the rows of a CSV file with a header line as dicts, passing
+    each through `convert`, which may return None to skip it."""
+    with open_csv(path) as stream:
+        for row in csv.DictReader(stream):
+            row = dict(
+                (key, value.decode('utf-8') if str is bytes else value)
+                for key, value in row.items())
+            row = convert(row)
+            if row is not None:
+                yield row
+
+
+def parse_time(value):
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise ValueError('Unrecognised time {0!r}'.format(value))
+
+
+def user_row(row):
+    # passwords are imported as bcrypt hashes, never as plain text
+    user = dict(name=row['name'], email=row['email'],
+                password=row['password'], role=row.get('role') or 'user')
+    # an empty id leaves it to the database
+    if row.get('id'):
+        user['id'] = int(row['id'])
+    return user
+
+
+def tweet_row(row):
+    tweet = dict(user_id=int(row['user_id']), tweet=row['tweet'],
+                 posted=parse_time(row['posted']))
+    if row.get('tweet_id'):
+        tweet['tweet_id'] = int(row['tweet_id'])
+    return tweet
+
+
+def follow_row(row):
+    who_id, whom_id = int(row['who_id']), int(row['whom_id'])
+    if who_id == whom_id:
+        return None
+    return dict(who_id=who_id, whom_id=whom_id)
+
+
+def timed(name, work):
+    started = default_timer()
+    rows, inserted = work()
+    return Step(name, rows, inserted, default_timer() - started)
+
+
+def import_files(users=None, tweets=None, follows=None, chunk_size=None,
+                 rebuild=True):
+    """Loads whichever CSV files are given, in dependency order, and
+    returns a Step per load and one for the rebuild.
+
+    users.csv has name, email, password (a bcrypt hash) and optionally id
+    and role columns; tweets.csv has user_id, tweet, posted and optionally
+    tweet_id; follows.csv has who_id and whom_id.
+    """
+    steps = []
+    sources = (
+        ('users', users, User.__table__, user_row, User.id),
+        ('tweets', tweets, Tweet.__table__, tweet_row, Tweet.tweet_id),
+        ('follows', follows, Follower.__table__, follow_row, None),
+    )
+    for name, path, table, convert, serial in sources:
+        if path is None:
+            continue
+        steps.append(timed(name, lambda: load(
+            table, read_csv(path, convert), chunk_size)))
+        if serial is not None:
+            sync_sequence(serial)
+    if rebuild and steps:
+        steps.append(timed('rebuild', rebuild_derived))
+    return steps
+
+
+def rebuild_derived():
+    """Recomputes everything the importer skipped maintaining."""
+    repaired = counters.reconcile()
+    inboxes = 0
+    if not shards.enabled:
+        inboxes = timelines.rebuild_all()
+    search.reindex()
+    if shards.enabled:
+        # home timelines are read from the shards, not the inboxes
+        db.session.commit()
+        shards.sync_from(db.engine, app.config['BULK_CHUNK_SIZE'])
+    cache.clear()
+    return inboxes, repaired
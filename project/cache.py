@@ -0,0 +1,174 @@
+"""Cache for query results and rendered fragments.
+
+`Cache` picks a backend from CACHE_TYPE and counts hits and misses. Entries
+are invalidated by the write paths that change them, the timeout is only a
+safety net. Timeline pages and their ETags are keyed on generation tokens
+kept here, so every worker must see the same ones: the local backend lives
+inside one process and is refused when WEB_CONCURRENCY says there are
+several, use the redis backend there.
+"""
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import g, has_request_context
+
+
+class NullCache(object):
+
+    def get_many(self, keys):
+        return [None] * len(keys)
+
+    def set(self, key, value, timeout):
+        pass
+
+    def delete_many(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LocalCache(object):
+    """Thread safe in-process LRU cache with per entry expiry."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is None or entry[0] <= now:
+                    values.append(None)
+                else:
+                    self._entries[key] = entry
+                    values.append(entry[1])
+        return values
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + timeout, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache(object):
+    """Backend for any client speaking the redis-py API."""
+
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        values = self.client.mget([self.prefix + key for key in keys])
+        return [None if v is None else pickle.loads(v) for v in values]
+
+    def set(self, key, value, timeout):
+        self.client.set(self.prefix + key, pickle.dumps(value, -1), ex=timeout)
+
+    def delete_many(self, keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def make_backend(config):
+    kind = config['CACHE_TYPE']
+    if kind == 'local':
+        if config.get('WEB_CONCURRENCY', 1) > 1:
+            raise ValueError(
+                'CACHE_TYPE local is per process, use redis with {0} '
+                'workers'.format(config['WEB_CONCURRENCY']))
+        return LocalCache(config['CACHE_MAX_ENTRIES'])
+    if kind == 'redis':
+        import redis
+        client = redis.StrictRedis.from_url(config['CACHE_REDIS_URL'])
+        return RedisCache(client, config['CACHE_KEY_PREFIX'])
+    if kind == 'null':
+        return NullCache()
+    raise ValueError('Unknown CACHE_TYPE {0!r}'.format(kind))
+
+
+class Cache(object):
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.default_timeout = 300
+        self.replica_timeout = 300
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = make_backend(app.config)
+        self.default_timeout = app.config['CACHE_DEFAULT_TIMEOUT']
+        self.replica_timeout = app.config['CACHE_REPLICA_TIMEOUT']
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        values = self.backend.get_many(keys)
+        misses = values.count(None)
+        self.misses += misses
+        self.hits += len(values) - misses
+        return values
+
+    def set(self, key, value, timeout=None):
+        timeout = timeout or self.default_timeout
+        if has_request_context() and g.get('replica_read'):
+            timeout = min(timeout, self.replica_timeout)
+        self.backend.set(key, value, timeout)
+
+    def get_or_set(self, key, func, timeout=None):
+        value = self.get(key)
+        if value is None:
+            value = func()
+            self.set(key, value, timeout)
+        return value
+
+    def delete(self, *keys):
+        self.backend.delete_many(list(keys))
+
+    def generation(self, keys):
+        """Digest of the generation tokens under `keys`, missing ones are
+        created. Entries cached under a key built from it are orphaned as
+        soon as any of the tokens is deleted."""
+        tokens = self.get_many(keys)
+        for i, token in enumerate(tokens):
+            if token is None:
+                tokens[i] = uuid.uuid4().hex
+                # not read from the database, so never capped like set
+                self.backend.set(keys[i], tokens[i], self.default_timeout)
+        return hashlib.sha1(':'.join(tokens).encode('ascii')).hexdigest()
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,170 @@
+import click
+
+from project import (app, assets, bulk, counters, db, jobs, limiter,
+    migrations, search, sessions, shards, suggestions, timelines)
+from project.shards import (connect, prune, remove_missing,
+    reshard as copy_to_shards)
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Recompute every materialized home timeline from the follow graph."""
+    count = timelines.rebuild_all()
+    click.echo('Rebuilt {} timelines.'.format(count))
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recount followers, following and tweets and repair any drift."""
+    repaired = counters.reconcile()
+    click.echo('Repaired counters of {} users.'.format(repaired))
+
+
+@app.cli.command('compute-suggestions')
+def compute_suggestions():
+    """Recompute who to follow suggestions for every user."""
+    count = suggestions.rebuild_all()
+    click.echo('Computed suggestions for {} users.'.format(count))
+
+
+@app.cli.command('reindex-search')
+def reindex_search():
+    """Rebuild the full-text search indexes from the tweets and users."""
+    tweets, users = search.reindex()
+    click.echo('Reindexed {0} tweets and {1} users.'.format(tweets, users))
+
+
+@app.cli.command('bulk-import')
+@click.option('--users', type=click.Path(exists=True, dir_okay=False),
+              help='CSV of name, email, password hash[, id, role].')
+@click.option('--tweets', type=click.Path(exists=True, dir_okay=False),
+              help='CSV of user_id, tweet, posted[, tweet_id].')
+@click.option('--follows', type=click.Path(exists=True, dir_okay=False),
+              help='CSV of who_id, whom_id.')
+@click.option('--chunk-size', type=int, default=None,
+              help='Rows per transaction, BULK_CHUNK_SIZE by default.')
+@click.option('--no-rebuild', is_flag=True,
+              help='Leave timelines, counters, search and shards to be '
+                   'rebuilt later.')
+def bulk_import(users, tweets, follows, chunk_size, no_rebuild):
+    """Load users, tweets and follows from CSV files, skipping duplicates.
+
+    Run it while the site is not taking writes: the loaded rows bypass
+    timelines, counters, the search index and the shards, which are rebuilt
+    at the end.
+    """
+    steps = bulk.import_files(users, tweets, follows, chunk_size,
+                              rebuild=not no_rebuild)
+    for step in steps:
+        rate = step.rows / step.seconds if step.seconds else 0
+        if step.name == 'rebuild':
+            click.echo('Rebuilt {0} timelines and repaired {1} counters in '
+                       '{2:.2f}s ({3:.0f} users/s).'.format(
+                           step.rows, step.inserted, step.seconds, rate))
+        else:
+            click.echo('Loaded {0} {1}, {2} new, in {3:.2f}s '
+                       '({4:.0f} rows/s).'.format(
+                           step.rows, step.name, step.inserted,
+                           step.seconds, rate))
+
+
+@app.cli.command('run-worker')
+@click.option('--burst', is_flag=True,
+              help='Exit once the queue is empty instead of waiting.')
+def run_worker(burst):
+    """Run background jobs, start as many of these as the queue needs."""
+    count = jobs.run_worker(burst)
+    click.echo('Ran {} jobs.'.format(count))
+
+
+@app.cli.command('requeue-jobs')
+def requeue_jobs():
+    """Retry the jobs that failed too often."""
+    count = jobs.requeue_failed()
+    click.echo('Requeued {} jobs.'.format(count))
+
+
+@app.cli.command('revoke-sessions')
+@click.argument('user_id', type=int)
+def revoke_sessions(user_id):
+    """Sign a user out on every device."""
+    count = sessions.revoke(user_id)
+    click.echo('Revoked {} sessions.'.format(count))
+
+
+@app.cli.command('purge-sessions')
+def purge_sessions():
+    """Delete expired sessions, run it periodically with the sql store."""
+    count = sessions.store.purge()
+    click.echo('Purged {} expired sessions.'.format(count))
+
+
+@app.cli.command('purge-rate-limits')
+def purge_rate_limits():
+    """Delete full rate limit buckets, run it periodically with the sql
+    store."""
+    count = limiter.store.purge()
+    click.echo('Purged {} rate limit buckets.'.format(count))
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint and compress the static files into ASSETS_DIR, run it
+    on every deploy that changes them."""
+    manifest = assets.build()
+    click.echo('Built {} assets into {}.'.format(
+        len(manifest), app.config['ASSETS_DIR']))
+
+
+@app.cli.command('reshard')
+@click.argument('urls', nargs=-1, required=True)
+@click.option('--from-main', is_flag=True,
+              help='Copy from the main database even when SHARDS is set.')
+@click.option('--chunk-size', type=int, default=None,
+              help='Rows per transaction, BULK_CHUNK_SIZE by default.')
+def reshard(urls, from_main, chunk_size):
+    """Copy tweets and follows onto the shards at URLS.
+
+    Rows come from the current SHARDS, or the main database when it is empty
+    or --from-main is given, and rows already copied are skipped. Copying
+    from the main database also deletes the rows it no longer has. Point
+    SHARDS at URLS once it is done, catch up on the writes made meanwhile
+    with --from-main, then run prune-shards.
+    """
+    chunk_size = chunk_size or app.config['BULK_CHUNK_SIZE']
+    from_main = from_main or not shards.enabled
+    sources = [db.engine] if from_main else shards.engines()
+    targets = [connect(url) for url in urls]
+    try:
+        copied = copy_to_shards(sources, targets, chunk_size)
+        removed = []
+        if from_main:
+            removed = remove_missing(db.engine, targets, chunk_size)
+    finally:
+        for target in targets:
+            target.dispose()
+    for table, read, inserted in copied:
+        click.echo('Copied {0} of {1} {2} rows onto {3} shards.'.format(
+            inserted, read, table, len(targets)))
+    for table, read, deleted in removed:
+        click.echo('Deleted {0} of {1} {2} rows gone from the main '
+                   'database.'.format(deleted, read, table))
+
+
+@app.cli.command('prune-shards')
+def prune_shards():
+    """Delete the rows each shard holds for users another shard owns, run
+    it after switching SHARDS to a new layout."""
+    for table, read, deleted in prune(shards.engines()):
+        click.echo('Deleted {0} of {1} {2} rows.'.format(
+            deleted, read, table))
+
+
+@app.cli.command('db-upgrade')
+@click.option('--to', 'target', type=int, default=None,
+              help='Stop at this schema version.')
+def db_upgrade(target):
+    """Apply pending schema migrations."""
+    applied = migrations.upgrade(db.engine, target)
+    click.echo('Applied migrations {0}, schema is at version {1}.'.format(
+        applied, migrations.current_version(db.engine)))
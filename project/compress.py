@@ -0,0 +1,120 @@
+"""Response compression.
+
+Responses of the types in COMPRESS_MIMETYPES are gzip encoded, or brotli
+encoded when the brotli module is installed and the client prefers it.
+Buffered responses under COMPRESS_MIN_SIZE bytes are sent as they are,
+the encoding would cost more than it saves. Streamed responses are
+compressed chunk by chunk, each flushed so it still goes out at once.
+
+Files from send_file, already encoded responses (the prebuilt assets) and
+event streams are left alone. ETags of compressed responses are made weak,
+since the bytes differ from the uncompressed ones the tag was made for.
+"""
+import gzip
+import io
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def gzip_bytes(data, level):
+    buffer = io.BytesIO()
+    # a fixed mtime makes the output depend on `data` alone
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level,
+                       mtime=0) as stream:
+        stream.write(data)
+    return buffer.getvalue()
+
+
+def encoded(chunk, charset):
+    if isinstance(chunk, bytes):
+        return chunk
+    return chunk.encode(charset)
+
+
+def gzip_stream(chunks, level, charset):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(encoded(chunk, charset))
+        yield data + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def brotli_stream(chunks, quality, charset):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in chunks:
+        data = compressor.process(encoded(chunk, charset))
+        yield data + compressor.flush()
+    yield compressor.finish()
+
+
+def closing(stream, iterable):
+    """`stream`, closing `iterable` when it is closed, which ends the
+    request context of a stream_with_context body."""
+    try:
+        for chunk in stream:
+            yield chunk
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+class Compress(object):
+
+    def __init__(self, app=None):
+        self.app = None
+        self.encodings = ['gzip']
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        if brotli is not None:
+            self.encodings.insert(0, 'br')
+        app.after_request(self.compress)
+
+    def compressible(self, response):
+        return (response.status_code == 200
+                and not response.direct_passthrough
+                and 'Content-Encoding' not in response.headers
+                and response.mimetype in self.app.config['COMPRESS_MIMETYPES'])
+
+    def compress(self, response):
+        if not self.compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+        config = self.app.config
+        if response.is_streamed:
+            if encoding == 'br':
+                stream = brotli_stream(response.response,
+                                       config['COMPRESS_BROTLI_QUALITY'],
+                                       response.charset)
+            else:
+                stream = gzip_stream(response.response,
+                                     config['COMPRESS_LEVEL'],
+                                     response.charset)
+            response.response = closing(stream, response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_SIZE']:
+                return response
+            if encoding == 'br':
+                data = brotli.compress(
+                    data, quality=config['COMPRESS_BROTLI_QUALITY'])
+            else:
+                data = gzip_bytes(data, config['COMPRESS_LEVEL'])
+            response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
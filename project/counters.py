@@ -0,0 +1,57 @@
+"""Denormalized per user counters.
+
+`followers_count`, `following_count` and `tweets_count` on users are bumped
+with atomic UPDATEs in the same transactions that add or remove the rows
+they count, so showing them never needs a COUNT(*). `reconcile` recomputes
+them from the follower and tweets tables in id ranges and repairs any
+drift, e.g. after rows were written around the app. An account a repair
+brings back under TIMELINE_FANOUT_LIMIT gets its tweets fanned out again,
+as after an unfollow.
+"""
+from sqlalchemy import func, or_, select
+
+from project import cache, db, jobs, shards, timelines
+from project.models import Follower, Tweet, User
+
+RECONCILE_BATCH = 10000
+
+
+def true_counts():
+    users = User.__table__
+    return {
+        User.followers_count: select([func.count()]).where(
+            Follower.whom_id == users.c.id).correlate(users).as_scalar(),
+        User.following_count: select([func.count()]).where(
+            Follower.who_id == users.c.id).correlate(users).as_scalar(),
+        User.tweets_count: select([func.count()]).where(
+            Tweet.user_id == users.c.id).correlate(users).as_scalar(),
+    }
+
+
+def reconcile(batch=RECONCILE_BATCH):
+    """Repairs every drifted counter, returns how many users were fixed."""
+    counts = true_counts()
+    drifted = or_(*[column != value for column, value in counts.items()])
+    last_id = db.session.query(func.max(User.id)).scalar() or 0
+    repaired = 0
+    for start in range(0, last_id, batch):
+        in_batch = (User.id > start, User.id <= start + batch, drifted)
+        # read first so their cached counters can be dropped after the fix
+        rows = db.session.query(User.id, User.followers_count).filter(
+            *in_batch).all()
+        if not rows:
+            continue
+        ids = [row[0] for row in rows]
+        # the inboxes are not kept up while the shards serve timelines
+        limit = 0 if shards.enabled else timelines.fanout_limit()
+        exempt = [user_id for user_id, followers in rows
+                  if limit and followers > limit]
+        repaired += db.session.query(User).filter(*in_batch).update(
+            counts, synchronize_session=False)
+        refan_ids = [jobs.enqueue('refan', author_id=user_id)
+                     for user_id in exempt
+                     if not timelines.is_fanout_exempt(user_id)]
+        db.session.commit()
+        cache.delete(*[User.counts_key(user_id) for user_id in ids])
+        jobs.dispatch(*refan_ids)
+    return repaired
@@ -0,0 +1,34 @@
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+
+
+def set_sqlite_pragmas(pragmas):
+    """Runs `pragmas` on every sqlite connection any engine opens."""
+
+    @event.listens_for(Engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+        cursor.close()
+
+    return on_connect
+
+
+def insert_ignore(table, dialect):
+    """An INSERT into `table` that skips rows clashing with existing ones,
+    ``ON CONFLICT DO NOTHING`` (``INSERT OR IGNORE`` on SQLite), so a
+    duplicate never aborts the transaction."""
+    if dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect.name == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if dialect.name == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    raise NotImplementedError(
+        'No conflict-skipping insert for {0}'.format(dialect.name))
@@ -0,0 +1,177 @@
+"""Background jobs kept in the database.
+
+Writes that would make a request wait on work proportional to the follow
+graph queue a job in the same transaction instead, so the job exists if
+and only if the write committed. Worker processes (the run-worker command)
+claim ready jobs by taking a JOBS_LEASE long lock on them and run their
+handler. Handlers make their writes without committing and may return a
+function to call once those are committed, e.g. to drop cached pages; the
+job row is deleted in the same transaction as the writes.
+
+A handler that raises is retried after an exponential backoff, up to
+JOBS_MAX_ATTEMPTS times, after which the job is kept with its last error
+and a NULL run_at until it is requeued. A worker that dies mid-job leaves
+its lock to expire and the job runs again, so handlers must be idempotent.
+
+With JOBS_EAGER set, `dispatch` runs freshly committed jobs in the process
+that queued them, which tests and single process setups rely on. `run`
+does so whatever the setting, for the few jobs whose writes the request
+should see; one that fails there is left to the workers to retry.
+"""
+import datetime
+import json
+import os
+import socket
+import time
+import traceback
+
+from sqlalchemy import select
+
+from project import app, db
+from project.models import Job
+
+HANDLERS = {}
+
+jobs = Job.__table__
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, **payload):
+    """Adds a job to the current transaction and returns its id, pass that
+    to `dispatch` after committing."""
+    job = Job(kind, json.dumps(payload, sort_keys=True),
+              datetime.datetime.now())
+    db.session.add(job)
+    db.session.flush()
+    return job.id
+
+
+def dispatch(*job_ids):
+    """Runs the jobs `job_ids` now under JOBS_EAGER, None ids are skipped
+    so callers can pass the result of an optional enqueue."""
+    if app.config['JOBS_EAGER']:
+        run(*job_ids)
+
+
+def run(*job_ids):
+    """Runs the committed jobs `job_ids` now, skipping None ids."""
+    job_ids = [job_id for job_id in job_ids if job_id is not None]
+    if job_ids:
+        work('eager', ids=job_ids)
+
+
+def worker_name():
+    return '{0}:{1}'.format(socket.gethostname(), os.getpid())
+
+
+def backoff(attempts):
+    """Seconds to wait before another try of a job that failed `attempts`
+    times."""
+    delay = app.config['JOBS_RETRY_DELAY'] * 2 ** (attempts - 1)
+    return min(delay, app.config['JOBS_RETRY_MAX_DELAY'])
+
+
+def ready(now):
+    return (jobs.c.run_at <= now) & (
+        jobs.c.locked_until.is_(None) | (jobs.c.locked_until < now))
+
+
+def claim(worker, limit, ids=None):
+    """Locks up to `limit` ready jobs for `worker` and returns their
+    (id, kind, payload, attempts) rows, oldest first.
+
+    Each lock is a conditional UPDATE, so of several workers racing for a
+    job only the one whose UPDATE matched gets it.
+    """
+    now = datetime.datetime.now()
+    candidates = select([jobs.c.id]).where(ready(now)).order_by(
+        jobs.c.run_at, jobs.c.id).limit(limit)
+    if ids is not None:
+        candidates = candidates.where(jobs.c.id.in_(ids))
+    claimed = []
+    for job_id, in db.session.execute(candidates).fetchall():
+        taken = db.session.execute(jobs.update().where(
+            (jobs.c.id == job_id) & ready(now)
+        ).values(
+            locked_by=worker,
+            locked_until=now + datetime.timedelta(
+                seconds=app.config['JOBS_LEASE']),
+            attempts=jobs.c.attempts + 1,
+        )).rowcount
+        if taken:
+            claimed.append(job_id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return db.session.execute(select([
+        jobs.c.id, jobs.c.kind, jobs.c.payload, jobs.c.attempts,
+    ]).where(jobs.c.id.in_(claimed)).order_by(jobs.c.id)).fetchall()
+
+
+def perform(job_id, kind, payload, attempts):
+    """Runs one claimed job, returns whether it succeeded."""
+    try:
+        db.session.execute(jobs.delete().where(jobs.c.id == job_id))
+        committed = HANDLERS[kind](**json.loads(payload))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        retry = attempts < app.config['JOBS_MAX_ATTEMPTS']
+        run_at = None
+        if retry:
+            run_at = datetime.datetime.now() + datetime.timedelta(
+                seconds=backoff(attempts))
+        db.session.execute(jobs.update().where(jobs.c.id == job_id).values(
+            run_at=run_at, locked_by=None, locked_until=None,
+            last_error=traceback.format_exc()))
+        db.session.commit()
+        app.logger.exception('Job %s (%s) failed on attempt %s%s', job_id,
+                             kind, attempts, '' if retry else ', giving up')
+        return False
+    if committed is not None:
+        committed()
+    return True
+
+
+def work(worker, limit=None, ids=None):
+    """Claims and runs one batch of ready jobs, returns how many ran."""
+    if limit is None:
+        limit = app.config['JOBS_BATCH_SIZE']
+    claimed = claim(worker, limit, ids)
+    for row in claimed:
+        perform(*row)
+    return len(claimed)
+
+
+def run_worker(burst=False):
+    """Works through jobs until stopped, or until the queue is empty when
+    `burst` is set. Returns how many jobs ran."""
+    worker = worker_name()
+    done = 0
+    while True:
+        ran = work(worker)
+        done += ran
+        if ran:
+            continue
+        if burst:
+            return done
+        db.session.remove()
+        time.sleep(app.config['JOBS_POLL_INTERVAL'])
+
+
+def requeue_failed():
+    """Gives every job that ran out of attempts a fresh set of them."""
+    requeued = db.session.execute(jobs.update().where(
+        jobs.c.run_at.is_(None)
+    ).values(
+        run_at=datetime.datetime.now(), attempts=0,
+        locked_by=None, locked_until=None,
+    )).rowcount
+    db.session.commit()
+    return requeued
@@ -0,0 +1,231 @@
+"""Structured, buffered error log.
+
+Error handlers log through a QueueHandler that only puts the record on a
+bounded in-memory queue, a background thread formats the records as JSON
+lines and writes them in batches to a rotating file. When the queue is
+full records are dropped and counted rather than blocking the request.
+
+Records carrying an `aggregate_key` (404s and 500s by path) are collapsed:
+the first one in each AGGREGATE_WINDOW is written, the repeats are only
+counted and reported as a `suppressed` total.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from logging.handlers import RotatingFileHandler
+from timeit import default_timer
+
+from flask import g, request
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+FIELDS = ('request_id', 'method', 'path', 'status', 'latency_ms',
+          'remote_addr', 'suppressed')
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {
+            'time': datetime.datetime.utcfromtimestamp(
+                record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        for field in FIELDS:
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        return json.dumps(data, sort_keys=True)
+
+
+class BatchFileHandler(RotatingFileHandler):
+    """Rotating file handler that writes a batch of records per flush."""
+
+    def write_batch(self, records):
+        self.acquire()
+        try:
+            for record in records:
+                if self.shouldRollover(record):
+                    self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+                self.stream.write(self.format(record) + '\n')
+            if self.stream is not None:
+                self.stream.flush()
+        finally:
+            self.release()
+
+
+class Aggregator(logging.Filter):
+
+    def __init__(self, window):
+        logging.Filter.__init__(self)
+        self.window = window
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'aggregate_key', None)
+        if key is None:
+            return True
+        with self._lock:
+            state = self._windows.get(key)
+            if state is not None and record.created - state[0] < self.window:
+                state[1] += 1
+                return False
+            self._windows[key] = [record.created, 0, record]
+        if state is not None and state[1]:
+            record.suppressed = state[1]
+        return True
+
+    def drain(self, now):
+        """Forgets the windows that ended before `now`, returning summary
+        records for those that suppressed anything."""
+        summaries = []
+        with self._lock:
+            for key, (started, count, first) in list(self._windows.items()):
+                if now - started < self.window:
+                    continue
+                del self._windows[key]
+                if count:
+                    summary = logging.makeLogRecord(dict(first.__dict__))
+                    summary.msg = 'suppressed {0} repeats of: {1}'.format(
+                        count, first.getMessage())
+                    summary.args = ()
+                    summary.created = now
+                    summary.suppressed = count
+                    summaries.append(summary)
+        return summaries
+
+
+class QueueHandler(logging.Handler):
+
+    def __init__(self, target, capacity, batch_size, flush_interval,
+                 aggregator=None):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = queue.Queue(capacity)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.aggregator = aggregator
+        if aggregator is not None:
+            self.addFilter(aggregator)
+        self.dropped = 0
+        self._writer = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def emit(self, record):
+        self._ensure_writer()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_writer(self):
+        # started lazily and per process, threads do not survive a fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._writer = threading.Thread(target=self._write_forever)
+                self._writer.daemon = True
+                self._writer.start()
+                self._pid = os.getpid()
+
+    def _write_forever(self):
+        while not self._closed.is_set():
+            self.write_pending()
+
+    def write_pending(self):
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        records = list(batch)
+        if self.aggregator is not None:
+            records.extend(self.aggregator.drain(time.time()))
+        try:
+            if records:
+                self.target.write_batch(records)
+        except Exception:
+            self.handleError(records[0])
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self):
+        """Blocks until every queued record has been written."""
+        if self._pid == os.getpid():
+            self.queue.join()
+
+    def close(self):
+        # logging.shutdown calls this at exit, stop the writer before the
+        # interpreter starts tearing down the modules it uses
+        self._closed.set()
+        if self._pid == os.getpid() and self._writer.is_alive():
+            self._writer.join()
+        while not self.queue.empty():
+            self.write_pending()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+def init_error_log(app):
+    target = BatchFileHandler(
+        app.config['ERROR_LOG'],
+        maxBytes=app.config['ERROR_LOG_MAX_BYTES'],
+        backupCount=app.config['ERROR_LOG_BACKUP_COUNT'],
+        delay=True,
+    )
+    target.setFormatter(JSONFormatter())
+    handler = QueueHandler(
+        target,
+        capacity=app.config['ERROR_LOG_QUEUE_SIZE'],
+        batch_size=app.config['ERROR_LOG_BATCH_SIZE'],
+        flush_interval=app.config['ERROR_LOG_FLUSH_INTERVAL'],
+        aggregator=Aggregator(app.config['ERROR_LOG_AGGREGATE_WINDOW']),
+    )
+    logger = logging.getLogger('tweepy.errors')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    @app.before_request
+    def start_request():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.request_started = default_timer()
+
+    @app.after_request
+    def tag_response(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
+
+    return logger
+
+
+def request_fields(status):
+    """`extra` fields describing the current request for a log record."""
+    started = g.get('request_started')
+    return {
+        'request_id': g.get('request_id'),
+        'method': request.method,
+        'path': request.path,
+        'status': status,
+        'latency_ms': None if started is None else
+            round((default_timer() - started) * 1000, 3),
+        'remote_addr': request.remote_addr,
+        'aggregate_key': (status, request.path),
+    }
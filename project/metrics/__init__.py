@@ -0,0 +1,289 @@
+"""Request level performance metrics.
+
+Per endpoint histograms of request latency, SQL query count and time, and
+template render time, plus password hashing time and push deliveries,
+exposed in the Prometheus text format by the metrics blueprint. Metrics
+are kept per process; with several workers each scrape sees the worker
+that served it.
+
+With PROFILE_SAMPLE_RATE set to N, one in N requests to the blueprints in
+PROFILE_BLUEPRINTS runs under cProfile and its stats are dumped to
+PROFILE_DIR, where the metrics blueprint serves them.
+"""
+import cProfile
+import os
+import random
+import threading
+import time
+from timeit import default_timer
+
+from flask import g, has_request_context, request
+from flask.signals import (before_render_template, signals_available,
+    template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in pairs) + '}'
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [
+                    [0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, (counts, total, count) in series:
+            for bound, bucket in zip(self.buckets, counts):
+                yield '{0}_bucket{1} {2}'.format(self.name, format_labels(
+                    self.labels, label_values, [('le', bound)]), bucket)
+            yield '{0}_bucket{1} {2}'.format(self.name, format_labels(
+                self.labels, label_values, [('le', '+Inf')]), count)
+            labels = format_labels(self.labels, label_values)
+            yield '{0}_sum{1} {2}'.format(self.name, labels, total)
+            yield '{0}_count{1} {2}'.format(self.name, labels, count)
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = \
+                self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield '{0}{1} {2}'.format(
+                self.name, format_labels(self.labels, label_values), value)
+
+
+class CallbackCounter(object):
+    """Counter whose value is read from `func` at scrape time."""
+    kind = 'counter'
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def samples(self):
+        yield '{0} {1}'.format(self.name, self.func())
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_seconds = registry.register(Histogram(
+    'tweepy_request_duration_seconds', 'Request latency.',
+    ('endpoint', 'method', 'status')))
+request_queries = registry.register(Histogram(
+    'tweepy_request_sql_queries', 'SQL queries executed per request.',
+    ('endpoint',), COUNT_BUCKETS))
+request_sql_seconds = registry.register(Histogram(
+    'tweepy_request_sql_seconds', 'Time spent in SQL per request.',
+    ('endpoint',)))
+request_template_seconds = registry.register(Histogram(
+    'tweepy_request_template_seconds', 'Time spent rendering templates '
+    'per request.', ('endpoint',)))
+password_hash_seconds = registry.register(Histogram(
+    'tweepy_password_hash_seconds', 'Time spent waiting for bcrypt, '
+    'including the wait for a hashing thread.', ('operation',)))
+profiles_written = registry.register(Counter(
+    'tweepy_profiles_written_total', 'Sampled request profiles dumped.'))
+rate_limited = registry.register(Counter(
+    'tweepy_rate_limited_total', 'Requests refused by a rate limit.',
+    ('limit',)))
+
+
+class RequestMetrics(object):
+
+    def __init__(self):
+        self.started = default_timer()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_starts = []
+        self.profiler = None
+
+
+def current():
+    if has_request_context():
+        return g.get('metrics')
+
+
+def observe_password_hash(operation, seconds):
+    password_hash_seconds.observe(seconds, operation)
+
+
+def observe_rate_limited(limit):
+    rate_limited.inc(1, limit)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info['query_started'] = default_timer()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    elapsed = default_timer() - conn.info.pop('query_started')
+    metrics = current()
+    if metrics is not None:
+        metrics.queries += 1
+        metrics.sql_seconds += elapsed
+
+
+def on_before_render_template(app, template, context, **extra):
+    metrics = current()
+    if metrics is not None:
+        metrics.template_starts.append(default_timer())
+
+
+def on_template_rendered(app, template, context, **extra):
+    metrics = current()
+    if metrics is not None and metrics.template_starts:
+        elapsed = default_timer() - metrics.template_starts.pop()
+        # a template rendered while another one renders is counted once
+        if not metrics.template_starts:
+            metrics.template_seconds += elapsed
+
+
+def should_profile(app):
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    return (rate and request.blueprint in app.config['PROFILE_BLUEPRINTS']
+            and random.randint(1, rate) == 1)
+
+
+def dump_profile(app, metrics):
+    directory = app.config['PROFILE_DIR']
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    name = '{0}-{1}-{2}.prof'.format(
+        request.endpoint, int(time.time() * 1000), g.get('request_id', 'x'))
+    metrics.profiler.dump_stats(os.path.join(directory, name))
+    profiles_written.inc()
+    for stale in list_profiles(app)[app.config['PROFILE_KEEP']:]:
+        os.remove(os.path.join(directory, stale))
+
+
+def list_profiles(app):
+    """Names of the dumped profiles, newest first."""
+    directory = app.config['PROFILE_DIR']
+    if not os.path.isdir(directory):
+        return []
+    names = [n for n in os.listdir(directory) if n.endswith('.prof')]
+    return sorted(names, reverse=True,
+                  key=lambda n: os.path.getmtime(os.path.join(directory, n)))
+
+
+def init_app(app, cache=None, push=None):
+    if signals_available:
+        before_render_template.connect(on_before_render_template, app)
+        template_rendered.connect(on_template_rendered, app)
+    if cache is not None:
+        registry.register(CallbackCounter(
+            'tweepy_cache_hits_total', 'Cache lookups that hit.',
+            lambda: cache.hits))
+        registry.register(CallbackCounter(
+            'tweepy_cache_misses_total', 'Cache lookups that missed.',
+            lambda: cache.misses))
+    if push is not None:
+        registry.register(CallbackCounter(
+            'tweepy_push_delivered_total',
+            'Tweets queued for connected clients.',
+            lambda: push.broker.delivered))
+        registry.register(CallbackCounter(
+            'tweepy_push_dropped_total',
+            'Tweets dropped because a client was not reading.',
+            lambda: push.broker.dropped))
+
+    @app.before_request
+    def start_metrics():
+        g.metrics = metrics = RequestMetrics()
+        if should_profile(app):
+            metrics.profiler = cProfile.Profile()
+            metrics.profiler.enable()
+
+    @app.after_request
+    def record_metrics(response):
+        metrics = g.get('metrics')
+        if metrics is None:
+            return response
+        if metrics.profiler is not None:
+            metrics.profiler.disable()
+            dump_profile(app, metrics)
+            metrics.profiler = None
+        endpoint = request.endpoint or 'none'
+        request_seconds.observe(default_timer() - metrics.started,
+                                endpoint, request.method, response.status_code)
+        request_queries.observe(metrics.queries, endpoint)
+        request_sql_seconds.observe(metrics.sql_seconds, endpoint)
+        request_template_seconds.observe(metrics.template_seconds, endpoint)
+        if app.config['METRICS_QUERY_HEADER']:
+            response.headers['X-SQL-Queries'] = str(metrics.queries)
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        metrics = g.get('metrics')
+        if metrics is not None and metrics.profiler is not None:
+            metrics.profiler.disable()
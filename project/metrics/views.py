@@ -0,0 +1,46 @@
+# imports
+from flask import (abort, current_app, jsonify, request,
+    send_from_directory, url_for, Blueprint, Response)
+
+from project.metrics import list_profiles, registry
+from project.users.views import current_user
+
+# config
+metrics_blueprint = Blueprint('metrics', __name__)
+
+# helper functions
+
+def authorized(public=False):
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') == 'Bearer ' + token:
+        return True
+    user = current_user()
+    if user is not None and user.role == 'admin':
+        return True
+    return public and not token
+
+
+# routes
+
+@metrics_blueprint.route('/metrics')
+def metrics():
+    if not authorized(public=True):
+        abort(403)
+    return Response(registry.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+@metrics_blueprint.route('/metrics/profiles/')
+def profiles():
+    if not authorized():
+        abort(403)
+    return jsonify(profiles=[
+        dict(name=name, url=url_for('metrics.profile', name=name))
+        for name in list_profiles(current_app)
+    ])
+
+@metrics_blueprint.route('/metrics/profiles/<name>')
+def profile(name):
+    if not authorized():
+        abort(403)
+    return send_from_directory(
+        current_app.config['PROFILE_DIR'], name, as_attachment=True)
@@ -0,0 +1,262 @@
+"""Versioned schema migrations.
+
+Each migration is a function taking a connection, registered with the
+version it brings the schema to. `upgrade` applies the pending ones in
+order and records them in the `schema_version` table. Migrations describe
+the tables as they were at that version instead of importing the models,
+so they keep working as the models move on.
+"""
+import datetime
+
+from sqlalchemy import (Column, DateTime, Float, ForeignKey, Index,
+    Integer, MetaData, PrimaryKeyConstraint, String, Table, inspect, select)
+
+MIGRATIONS = []
+
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String, nullable=False),
+    Column('applied', DateTime, nullable=False),
+)
+
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def current_version(engine):
+    with engine.connect() as conn:
+        if not conn.dialect.has_table(conn, 'schema_version'):
+            return 0
+        version = conn.execute(
+            select([schema_version.c.version]).order_by(
+                schema_version.c.version.desc()).limit(1)).scalar()
+    return version or 0
+
+
+def upgrade(engine, target=None):
+    """Applies every migration above the current version up to `target`.
+
+    Returns the list of versions applied.
+    """
+    schema_version.create(engine, checkfirst=True)
+    applied = []
+    current = current_version(engine)
+    for version, description, func in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        with engine.begin() as conn:
+            func(conn)
+            conn.execute(schema_version.insert().values(
+                version=version, description=description,
+                applied=datetime.datetime.now()))
+        applied.append(version)
+    return applied
+
+
+def create_missing_indexes(conn, *indexes):
+    inspector = inspect(conn)
+    for index in indexes:
+        existing = [i['name'] for i in inspector.get_indexes(index.table.name)]
+        if index.name not in existing:
+            index.create(conn)
+
+
+# migrations
+
+@migration(1, 'initial schema')
+def initial_schema(conn):
+    metadata = MetaData()
+    Table(
+        'users', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('name', String, unique=True, nullable=False),
+        Column('email', String, unique=True, nullable=False),
+        Column('password', String, nullable=False),
+        Column('role', String),
+    )
+    Table(
+        'tweets', metadata,
+        Column('tweet_id', Integer, primary_key=True),
+        Column('user_id', Integer, ForeignKey('users.id')),
+        Column('tweet', String, nullable=False),
+        Column('posted', DateTime, nullable=False),
+    )
+    Table(
+        'follower', metadata,
+        Column('who_id', Integer),
+        Column('whom_id', Integer),
+        PrimaryKeyConstraint('who_id', 'whom_id'),
+    )
+    metadata.create_all(conn)
+
+
+@migration(2, 'materialized home timelines')
+def materialized_timelines(conn):
+    metadata = MetaData()
+    timeline = Table(
+        'timeline', metadata,
+        Column('user_id', Integer),
+        Column('tweet_id', Integer),
+        Column('author_id', Integer, nullable=False),
+        Column('posted', DateTime, nullable=False),
+        PrimaryKeyConstraint('user_id', 'tweet_id'),
+        Index('ix_timeline_user_id_posted', 'user_id', 'posted', 'tweet_id'),
+    )
+    if conn.dialect.has_table(conn, 'timeline'):
+        return
+    metadata.create_all(conn)
+    tweets = Table('tweets', metadata, autoload_with=conn)
+    follower = Table('follower', metadata, autoload_with=conn)
+    columns = ['user_id', 'tweet_id', 'author_id', 'posted']
+    conn.execute(timeline.insert().from_select(columns, select([
+        tweets.c.user_id, tweets.c.tweet_id,
+        tweets.c.user_id.label('author_id'), tweets.c.posted,
+    ])))
+    conn.execute(timeline.insert().from_select(columns, select([
+        follower.c.who_id, tweets.c.tweet_id, tweets.c.user_id, tweets.c.posted,
+    ]).where(follower.c.whom_id == tweets.c.user_id)))
+
+
+@migration(3, 'indexes and foreign keys for timeline and follower lookups')
+def lookup_indexes(conn):
+    metadata = MetaData()
+    users = Table('users', metadata, autoload_with=conn)
+    follower = Table('follower', metadata, autoload_with=conn)
+    if not inspect(conn).get_foreign_keys('follower'):
+        conn.execute(follower.delete().where(
+            ~follower.c.who_id.in_(select([users.c.id])) |
+            ~follower.c.whom_id.in_(select([users.c.id]))))
+        if conn.dialect.name == 'sqlite':
+            rebuilt = Table(
+                'follower_rebuilt', metadata,
+                Column('who_id', Integer, ForeignKey('users.id')),
+                Column('whom_id', Integer, ForeignKey('users.id')),
+                PrimaryKeyConstraint('who_id', 'whom_id'),
+            )
+            rebuilt.create(conn)
+            conn.execute(rebuilt.insert().from_select(
+                ['who_id', 'whom_id'],
+                select([follower.c.who_id, follower.c.whom_id])))
+            follower.drop(conn)
+            conn.execute('ALTER TABLE follower_rebuilt RENAME TO follower')
+            metadata = MetaData()
+            follower = Table('follower', metadata, autoload_with=conn)
+        else:
+            for column in ('who_id', 'whom_id'):
+                conn.execute(
+                    'ALTER TABLE follower ADD CONSTRAINT follower_{0}_fkey '
+                    'FOREIGN KEY ({0}) REFERENCES users (id)'.format(column))
+    tweets = Table('tweets', metadata, autoload_with=conn)
+    create_missing_indexes(
+        conn,
+        Index('ix_tweets_user_id_posted', tweets.c.user_id, tweets.c.posted),
+        Index('ix_follower_whom_id_who_id',
+              follower.c.whom_id, follower.c.who_id),
+    )
+
+
+@migration(4, 'full-text search indexes')
+def search_indexes(conn):
+    if conn.dialect.name == 'sqlite':
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts USING fts5("
+            "tweet, content='tweets', content_rowid='tweet_id', "
+            "tokenize='porter unicode61')")
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+            "name, content='users', content_rowid='id', prefix='2 3')")
+        conn.execute("INSERT INTO tweets_fts (tweets_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+    else:
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_tweets_tweet_fts ON tweets "
+            "USING gin (to_tsvector('english', tweet))")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_users_name_fts ON users "
+            "USING gin (to_tsvector('simple', name))")
+
+
+@migration(5, 'follower, following and tweet counters on users')
+def user_counters(conn):
+    columns = set(c['name'] for c in inspect(conn).get_columns('users'))
+    for name in ('followers_count', 'following_count', 'tweets_count'):
+        if name not in columns:
+            conn.execute('ALTER TABLE users ADD COLUMN {0} INTEGER '
+                         'NOT NULL DEFAULT 0'.format(name))
+    conn.execute(
+        'UPDATE users SET '
+        'followers_count = (SELECT count(*) FROM follower '
+        'WHERE follower.whom_id = users.id), '
+        'following_count = (SELECT count(*) FROM follower '
+        'WHERE follower.who_id = users.id), '
+        'tweets_count = (SELECT count(*) FROM tweets '
+        'WHERE tweets.user_id = users.id)')
+
+
+@migration(6, 'who to follow suggestions')
+def who_to_follow(conn):
+    metadata = MetaData()
+    Table(
+        'suggestions', metadata,
+        Column('user_id', Integer),
+        Column('suggested_id', Integer),
+        Column('score', Integer, nullable=False),
+        PrimaryKeyConstraint('user_id', 'suggested_id'),
+        Index('ix_suggestions_user_id_score', 'user_id', 'score'),
+    )
+    metadata.create_all(conn)
+
+
+@migration(7, 'background job queue')
+def job_queue(conn):
+    metadata = MetaData()
+    Table(
+        'jobs', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('kind', String, nullable=False),
+        Column('payload', String, nullable=False),
+        Column('attempts', Integer, nullable=False),
+        Column('run_at', DateTime),
+        Column('locked_by', String),
+        Column('locked_until', DateTime),
+        Column('last_error', String),
+        Index('ix_jobs_run_at', 'run_at'),
+    )
+    metadata.create_all(conn)
+
+
+@migration(8, 'server-side sessions')
+def server_sessions(conn):
+    metadata = MetaData()
+    Table(
+        'sessions', metadata,
+        Column('id', String, primary_key=True),
+        Column('user_id', Integer),
+        Column('data', String, nullable=False),
+        Column('expires', DateTime, nullable=False),
+        Index('ix_sessions_user_id', 'user_id'),
+        Index('ix_sessions_expires', 'expires'),
+    )
+    metadata.create_all(conn)
+
+
+@migration(9, 'shared rate limit buckets')
+def rate_limits(conn):
+    metadata = MetaData()
+    Table(
+        'rate_limits', metadata,
+        Column('bucket', String, primary_key=True),
+        Column('full_at', Float, nullable=False),
+        Index('ix_rate_limits_full_at', 'full_at'),
+    )
+    metadata.create_all(conn)
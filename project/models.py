@@ -1,10 +1,13 @@
 import datetime
 
-from project import db
+from project import cache, db
 
 
 class Tweet(db.Model):
     __tablename__ = 'tweets'
+    __table_args__ = (
+        db.Index('ix_tweets_user_id_posted', 'user_id', 'posted'),
+    )
 
     tweet_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
@@ -19,6 +22,13 @@ class Tweet(db.Model):
     def __repr__(self):
         return '<Id {0} - {1}>'.format(self.tweet_id, self.tweet)
 
+    def to_dict(self):
+        return {
+            'tweet_id': self.tweet_id,
+            'user_id': self.user_id,
+            'tweet': self.tweet,
+            'posted': self.posted.isoformat(),
+        }
 
     @classmethod
     def delta_time(cls, tweet_posted):
@@ -47,6 +57,13 @@ class User(db.Model):
     password = db.Column(db.String, nullable=False)
     tweets = db.relationship('Tweet', backref='poster')
     role = db.Column(db.String, default='user')
+    # denormalized, see project/counters.py
+    followers_count = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
+    tweets_count = db.Column(db.Integer, nullable=False, default=0,
+                             server_default='0')
 
     def __init__(self, name=None, email=None, password=None, role=None):
         self.name = name
@@ -59,22 +76,63 @@ class User(db.Model):
 
     @classmethod
     def is_following(cls, who_id, whom_id):
-        whom_ids = db.session.query(Follower.whom_id).filter_by(who_id=who_id).all()
-        whom_ids = [i[0] for i in whom_ids]
-        if whom_id in whom_ids:
-            return True
-        else:
-            return False
+        following = db.session.query(Follower).filter_by(
+            who_id=who_id, whom_id=whom_id)
+        return db.session.query(following.exists()).scalar()
+
+    @classmethod
+    def adjust_counts(cls, user_ids, **deltas):
+        """Adds `deltas` to the named counters of one user id, or of each of
+        a list of them, with one atomic UPDATE."""
+        if not isinstance(user_ids, (list, tuple, set, frozenset)):
+            user_ids = [user_ids]
+        db.session.query(cls).filter(cls.id.in_(user_ids)).update(dict(
+            (getattr(cls, name), getattr(cls, name) + delta)
+            for name, delta in deltas.items()
+        ), synchronize_session=False)
+
+    @classmethod
+    def counts_key(cls, user_id):
+        return 'user-counts:{0}'.format(user_id)
+
+    @classmethod
+    def counts_of(cls, user_ids):
+        """(followers_count, following_count, tweets_count) of each of
+        `user_ids`, from the cache where it has them and one query for the
+        rest."""
+        keys = [cls.counts_key(user_id) for user_id in user_ids]
+        counts = dict(zip(user_ids, cache.get_many(keys)))
+        missing = [user_id for user_id, value in counts.items() if value is None]
+        if missing:
+            for row in db.session.query(
+                cls.id, cls.followers_count, cls.following_count,
+                cls.tweets_count,
+            ).filter(cls.id.in_(missing)):
+                counts[row[0]] = tuple(row[1:])
+                cache.set(cls.counts_key(row[0]), counts[row[0]])
+        return counts
+
+    @classmethod
+    def following_key(cls, who_id):
+        return 'following:{0}'.format(who_id)
+
+    @classmethod
+    def following_ids(cls, who_id):
+        def load():
+            whom_ids = db.session.query(Follower.whom_id).filter_by(who_id=who_id)
+            return frozenset(i[0] for i in whom_ids)
+        return cache.get_or_set(cls.following_key(who_id), load)
 
 
 class Follower(db.Model):
     __tablename__ = 'follower'
     __table_args__ = (
         db.PrimaryKeyConstraint('who_id', 'whom_id'),
+        db.Index('ix_follower_whom_id_who_id', 'whom_id', 'who_id'),
     )
 
-    who_id = db.Column(db.Integer)
-    whom_id = db.Column(db.Integer)
+    who_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    whom_id = db.Column(db.Integer, db.ForeignKey('users.id'))
 
 
     def __init__(self, who_id, whom_id):
@@ -83,3 +141,100 @@ class Follower(db.Model):
 
     def __repr__(self):
         return '<User {0} follows {1}>'.format(self.who_id, self.whom_id)
+
+
+class TimelineEntry(db.Model):
+    __tablename__ = 'timeline'
+    __table_args__ = (
+        db.PrimaryKeyConstraint('user_id', 'tweet_id'),
+        db.Index('ix_timeline_user_id_posted', 'user_id', 'posted', 'tweet_id'),
+    )
+
+    user_id = db.Column(db.Integer)
+    tweet_id = db.Column(db.Integer)
+    author_id = db.Column(db.Integer, nullable=False)
+    posted = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, user_id, tweet_id, author_id, posted):
+        self.user_id = user_id
+        self.tweet_id = tweet_id
+        self.author_id = author_id
+        self.posted = posted
+
+    def __repr__(self):
+        return '<Tweet {0} in timeline of {1}>'.format(self.tweet_id, self.user_id)
+
+
+class Suggestion(db.Model):
+    __tablename__ = 'suggestions'
+    __table_args__ = (
+        db.PrimaryKeyConstraint('user_id', 'suggested_id'),
+        db.Index('ix_suggestions_user_id_score', 'user_id', 'score'),
+    )
+
+    user_id = db.Column(db.Integer)
+    suggested_id = db.Column(db.Integer)
+    score = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, user_id, suggested_id, score):
+        self.user_id = user_id
+        self.suggested_id = suggested_id
+        self.score = score
+
+    def __repr__(self):
+        return '<Suggest {0} to {1}>'.format(self.suggested_id, self.user_id)
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_run_at', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String, nullable=False)
+    payload = db.Column(db.String, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # NULL once the job has used up its attempts, see project/jobs.py
+    run_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.String)
+
+    def __init__(self, kind, payload, run_at):
+        self.kind = kind
+        self.payload = payload
+        self.run_at = run_at
+
+    def __repr__(self):
+        return '<Job {0} {1}>'.format(self.id, self.kind)
+
+
+class StoredSession(db.Model):
+    __tablename__ = 'sessions'
+    __table_args__ = (
+        db.Index('ix_sessions_user_id', 'user_id'),
+        db.Index('ix_sessions_expires', 'expires'),
+    )
+
+    id = db.Column(db.String, primary_key=True)
+    user_id = db.Column(db.Integer)
+    data = db.Column(db.String, nullable=False)
+    expires = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return '<Session of {0}>'.format(self.user_id)
+
+
+class RateLimit(db.Model):
+    __tablename__ = 'rate_limits'
+    __table_args__ = (
+        db.Index('ix_rate_limits_full_at', 'full_at'),
+    )
+
+    bucket = db.Column(db.String, primary_key=True)
+    # unix time at which the bucket is full again, see project/ratelimit.py
+    full_at = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return '<Rate limit {0}>'.format(self.bucket)
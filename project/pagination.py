@@ -0,0 +1,89 @@
+import datetime
+from collections import namedtuple
+
+from sqlalchemy import and_, or_
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(posted, item_id):
+    return '{0}-{1}'.format(posted.strftime(CURSOR_FORMAT), item_id)
+
+
+def decode_cursor(cursor):
+    """Returns the (posted, id) pair encoded in `cursor`.
+
+    Raises ValueError for anything that did not come from encode_cursor.
+    """
+    posted, _, item_id = cursor.partition('-')
+    return datetime.datetime.strptime(posted, CURSOR_FORMAT), int(item_id)
+
+
+def encode_rank_cursor(score, item_id):
+    return '{0!r}_{1}'.format(score, item_id)
+
+
+def decode_rank_cursor(cursor):
+    """Returns the (score, id) pair encoded in `cursor`.
+
+    Raises ValueError for anything that did not come from encode_rank_cursor.
+    """
+    score, _, item_id = cursor.rpartition('_')
+    return float(score), int(item_id)
+
+
+def keyset_page(query, posted_column, id_column, cursor, per_page,
+                key=None):
+    """Newest-first page of `query` starting strictly after `cursor`.
+
+    Seeks on (posted, id) instead of using OFFSET, so the cost of a page
+    does not depend on how deep into the history it is.
+    """
+    if cursor is not None:
+        posted, item_id = cursor
+        query = query.filter(or_(
+            posted_column < posted,
+            and_(posted_column == posted, id_column < item_id),
+        ))
+    rows = query.order_by(
+        posted_column.desc(), id_column.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        if key is None:
+            key = lambda row: (getattr(row, posted_column.key),
+                               getattr(row, id_column.key))
+        next_cursor = encode_cursor(*key(rows[-1]))
+    return Page(rows, next_cursor)
+
+
+def newer_than(query, posted_column, id_column, since):
+    """Restricts `query` to rows after the (posted, id) pair `since`.
+
+    The bound on `posted` lets the (.., posted, id) indexes stop the scan
+    at the last row a poller has already seen.
+    """
+    posted, item_id = since
+    if posted is not None:
+        query = query.filter(posted_column >= posted)
+    return query.filter(id_column > item_id)
+
+
+def merge_pages(pages, per_page):
+    """Merges newest-first pages of tweets read through different access
+    paths into a single page, dropping duplicates."""
+    seen = set()
+    merged = []
+    for item in sorted((item for page in pages for item in page.items),
+                       key=lambda t: (t.posted, t.tweet_id), reverse=True):
+        if item.tweet_id not in seen:
+            seen.add(item.tweet_id)
+            merged.append(item)
+    has_more = len(merged) > per_page or any(p.next_cursor for p in pages)
+    merged = merged[:per_page]
+    next_cursor = None
+    if has_more and merged:
+        next_cursor = encode_cursor(merged[-1].posted, merged[-1].tweet_id)
+    return Page(merged, next_cursor)
@@ -0,0 +1,96 @@
+"""Password hashing on a bounded pool of threads.
+
+The pool is back-pressure: at most PASSWORD_HASH_WORKERS hashes run at once
+per process and at most PASSWORD_HASH_QUEUE_SIZE more wait for a thread,
+anything beyond that is refused with HashingBusy, which the views answer
+with a 503 and Retry-After, instead of piling up behind the pool.
+
+The request still waits for its hash, so a sync worker is held for the
+whole of it. bcrypt runs in C with the GIL released, so under threaded
+workers (gunicorn -k gthread) the other threads of the process keep
+serving routes that do no hashing while it runs. Under gevent the pool
+threads are greenlets and a hash blocks the worker's other connections.
+"""
+import os
+import re
+import threading
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+
+from project.metrics import observe_password_hash
+
+BCRYPT_COST = re.compile(r'^\$2[abxy]?\$(\d\d)\$')
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class PasswordHasher(object):
+
+    def __init__(self, bcrypt, app=None):
+        self.bcrypt = bcrypt
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.config = app.config
+        self._slots = threading.BoundedSemaphore(
+            app.config['PASSWORD_HASH_WORKERS'] +
+            app.config['PASSWORD_HASH_QUEUE_SIZE'])
+
+    @property
+    def pool(self):
+        # the pool is created lazily and per process so that it does not
+        # survive a fork of the master into workers
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPool(self.config['PASSWORD_HASH_WORKERS'])
+                self._pid = os.getpid()
+            return self._pool
+
+    def _run(self, operation, func, *args):
+        if not self._slots.acquire(False):
+            raise HashingBusy()
+
+        # the slot is given back by the pool thread once the hash is done,
+        # so work we stopped waiting for still counts against the bound
+        def task():
+            try:
+                return func(*args)
+            finally:
+                self._slots.release()
+
+        started = default_timer()
+        try:
+            result = self.pool.apply_async(task)
+        except Exception:
+            self._slots.release()
+            raise
+        try:
+            return result.get(self.config['PASSWORD_HASH_TIMEOUT'])
+        except TimeoutError:
+            raise HashingBusy()
+        finally:
+            observe_password_hash(operation, default_timer() - started)
+
+    def rounds(self):
+        return self.config['BCRYPT_LOG_ROUNDS']
+
+    def hash(self, password):
+        return self._run('hash',
+            self.bcrypt.generate_password_hash, password, self.rounds())
+
+    def check(self, pw_hash, password):
+        return self._run('check',
+            self.bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        if isinstance(pw_hash, bytes):
+            pw_hash = pw_hash.decode('ascii')
+        match = BCRYPT_COST.match(pw_hash)
+        return match is None or int(match.group(1)) != self.rounds()
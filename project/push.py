@@ -0,0 +1,307 @@
+"""Pushes new tweets to connected clients.
+
+Every connected client holds a subscription to the channel of its own
+inbox, `user:<id>`, plus `author:<id>` for each fan-out exempt account it
+follows, mirroring how timelines are assembled. Posting publishes the
+tweet to the inbox channel of every fan-out recipient and to the author's
+channel.
+
+The local broker only reaches clients connected to the same process. The
+redis broker shares one pub/sub connection per process between all of its
+clients and subscribes to a channel only while somebody local listens to
+it, so deployments with several workers or nodes should use it. It
+reconnects when redis goes away, see RedisBroker. Each client has a
+bounded queue; a client that stops reading loses messages instead of
+slowing the publisher down.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+logger = logging.getLogger(__name__)
+
+# handed to every local client when the broker may have lost messages for
+# it, its stream then ends so the client reconnects and replays them
+GAP = 'gap'
+
+
+def inbox_channel(user_id):
+    return 'user:{0}'.format(user_id)
+
+
+def author_channel(user_id):
+    return 'author:{0}'.format(user_id)
+
+
+class Subscription(object):
+
+    def __init__(self, broker, channels, size):
+        self.broker = broker
+        self.channels = channels
+        self._queue = queue.Queue(size)
+
+    def put(self, message):
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            return False
+
+    def get(self, timeout):
+        """Next message, or None if nothing arrived within `timeout`."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class NullBroker(object):
+
+    delivered = dropped = 0
+
+    def publish(self, channels, message):
+        pass
+
+    def subscribe(self, channels):
+        return Subscription(self, channels, 1)
+
+    def unsubscribe(self, subscription):
+        pass
+
+
+class LocalBroker(object):
+    """Delivers messages to the subscriptions of this process."""
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.delivered = 0
+        self.dropped = 0
+        self._channels = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channels, message):
+        self.deliver(channels, message)
+
+    def deliver(self, channels, message):
+        with self._lock:
+            targets = set()
+            for channel in channels:
+                targets.update(self._channels.get(channel, ()))
+        for subscription in targets:
+            if subscription.put(message):
+                self.delivered += 1
+            else:
+                self.dropped += 1
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels, self.queue_size)
+        with self._lock:
+            added = [c for c in channels if c not in self._channels]
+            for channel in channels:
+                self._channels[channel].add(subscription)
+            if added:
+                self.channels_added(added)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        removed = []
+        with self._lock:
+            for channel in subscription.channels:
+                listeners = self._channels.get(channel)
+                if listeners is None:
+                    continue
+                listeners.discard(subscription)
+                if not listeners:
+                    del self._channels[channel]
+                    removed.append(channel)
+            if removed:
+                self.channels_removed(removed)
+
+    # hooks called, under the lock, when a channel gains its first local
+    # listener or loses its last one
+
+    def channels_added(self, channels):
+        pass
+
+    def channels_removed(self, channels):
+        pass
+
+
+class RedisBroker(LocalBroker):
+    """Relays messages between processes through redis pub/sub.
+
+    The pub/sub connection is only touched by the listener thread, which
+    redis-py needs since PubSub objects are not thread safe. Subscription
+    changes reach it through a queue and are applied between reads, so a
+    new client hears its channels within POLL_TIMEOUT seconds. When the
+    connection fails the listener reconnects with an exponential backoff,
+    subscribes again and hands every local client GAP, since messages
+    published meanwhile are lost.
+    """
+
+    POLL_TIMEOUT = 0.1
+    RECONNECT_DELAY = 0.5
+    RECONNECT_MAX_DELAY = 30
+
+    def __init__(self, client, prefix, queue_size):
+        super(RedisBroker, self).__init__(queue_size)
+        self.client = client
+        self.prefix = prefix
+        self._changes = None
+        self._pid = None
+        self._changes_lock = threading.Lock()
+
+    def publish(self, channels, message):
+        data = json.dumps(message)
+        pipe = self.client.pipeline(transaction=False)
+        for channel in channels:
+            pipe.publish(self.prefix + channel, data)
+        pipe.execute()
+
+    def changes(self):
+        # threads do not survive a fork, so every worker process starts
+        # its own listener with its own connection
+        with self._changes_lock:
+            if self._pid != os.getpid():
+                self._changes = queue.Queue()
+                self._pid = os.getpid()
+                listener = threading.Thread(
+                    target=self.listen, args=(self._changes,),
+                    name='tweepy-push-listener')
+                listener.daemon = True
+                listener.start()
+            return self._changes
+
+    def channels_added(self, channels):
+        self.changes().put((True, [self.prefix + c for c in channels]))
+
+    def channels_removed(self, channels):
+        self.changes().put((False, [self.prefix + c for c in channels]))
+
+    def stop(self):
+        """Ends the listener thread of this process, if there is one."""
+        with self._changes_lock:
+            if self._pid == os.getpid():
+                self._changes.put((None, None))
+                self._pid = None
+
+    def listen(self, changes):
+        subscribed = set()
+        pubsub = None
+        failures = 0
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self.client.pubsub(
+                        ignore_subscribe_messages=True)
+                    if subscribed:
+                        pubsub.subscribe(*subscribed)
+                        self.deliver(self.local_channels(), GAP)
+                if not self.apply_changes(pubsub, changes, subscribed):
+                    pubsub.close()
+                    return
+                if subscribed:
+                    self.receive(pubsub.get_message(
+                        timeout=self.POLL_TIMEOUT))
+                failures = 0
+            except Exception:
+                failures += 1
+                delay = min(self.RECONNECT_DELAY * 2 ** (failures - 1),
+                            self.RECONNECT_MAX_DELAY)
+                logger.exception('Push listener lost redis, reconnecting '
+                                 'in %.1fs', delay)
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+                    pubsub = None
+                time.sleep(delay)
+
+    def apply_changes(self, pubsub, changes, subscribed):
+        """Applies the queued subscription changes, waiting for one while
+        there is nothing to listen to, and returns False once told to stop.
+        `subscribed` is kept as the wanted set even if redis fails halfway,
+        the reconnect then catches up."""
+        timeout = None if subscribed else self.POLL_TIMEOUT
+        while True:
+            try:
+                if timeout is None:
+                    add, channels = changes.get_nowait()
+                else:
+                    add, channels = changes.get(timeout=timeout)
+                    timeout = None
+            except queue.Empty:
+                return True
+            if add is None:
+                return False
+            if add:
+                subscribed.update(channels)
+                pubsub.subscribe(*channels)
+            else:
+                subscribed.difference_update(channels)
+                pubsub.unsubscribe(*channels)
+
+    def local_channels(self):
+        with self._lock:
+            return list(self._channels)
+
+    def receive(self, message):
+        if message is None or message['type'] != 'message':
+            return
+        channel = message['channel']
+        if not isinstance(channel, str):
+            channel = channel.decode('utf-8')
+        data = message['data']
+        if not isinstance(data, str):
+            data = data.decode('utf-8')
+        self.deliver([channel[len(self.prefix):]], json.loads(data))
+
+
+def make_broker(config):
+    kind = config['PUSH_BROKER']
+    if kind == 'local':
+        return LocalBroker(config['PUSH_QUEUE_SIZE'])
+    if kind == 'redis':
+        import redis
+        client = redis.StrictRedis.from_url(config['PUSH_REDIS_URL'])
+        return RedisBroker(client, config['PUSH_CHANNEL_PREFIX'],
+                           config['PUSH_QUEUE_SIZE'])
+    if kind == 'null':
+        return NullBroker()
+    raise ValueError('Unknown PUSH_BROKER {0!r}'.format(kind))
+
+
+class Push(object):
+
+    def __init__(self, app=None):
+        self.broker = NullBroker()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.broker = make_broker(app.config)
+
+    def publish_tweet(self, tweet, recipients, to_author=True):
+        message = dict(tweet.to_dict(), name=tweet.poster.name)
+        channels = [inbox_channel(user_id) for user_id in recipients]
+        if to_author:
+            channels.append(author_channel(tweet.user_id))
+        self.broker.publish(channels, message)
+
+    def subscribe(self, user_id, exempt=()):
+        channels = [inbox_channel(user_id)]
+        channels.extend(author_channel(author_id) for author_id in exempt)
+        return self.broker.subscribe(channels)
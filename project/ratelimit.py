@@ -0,0 +1,206 @@
+"""Rate limits.
+
+Each limit in RATE_LIMITS is a token bucket, kept per user or per client
+address, that holds `requests` tokens and refills at `requests` per
+`seconds`. A request takes a token from every bucket of its endpoint and
+is refused with a 429 and a Retry-After header when one of them is empty.
+
+A bucket is stored as the time it will be full again (the generic cell
+rate algorithm), so checking it reads and writes a single number and a
+full bucket needs no entry at all. The local store keeps them in a dict
+without a lock: two threads taking from one bucket at the same moment may
+both get through, which is fine for throttling. It is per process, so
+deployments with several workers should use the sql store, which shares
+the buckets through the rate_limits table.
+"""
+import math
+import time
+from collections import namedtuple
+
+from flask import request, session
+from sqlalchemy import bindparam, case, create_engine, select
+from sqlalchemy.pool import QueuePool
+from werkzeug.exceptions import TooManyRequests
+
+from project.database import insert_ignore
+from project.metrics import observe_rate_limited
+
+SCOPES = ('user', 'ip')
+
+Rule = namedtuple('Rule', ['name', 'scope', 'interval', 'period'])
+
+
+class RateLimited(TooManyRequests):
+
+    def __init__(self, rule, retry_after):
+        TooManyRequests.__init__(self)
+        self.rule = rule
+        self.retry_after = retry_after
+
+
+class LocalRateLimitStore(object):
+    """In-process buckets, swept of full ones as the dict grows."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._full_at = {}
+        self._sweep_at = max_entries
+
+    def hit(self, key, interval, period, now):
+        """Takes a token from bucket `key`, returns 0 or the seconds until
+        one is available."""
+        full_at = max(self._full_at.get(key, now), now) + interval
+        if full_at - now > period:
+            return full_at - period - now
+        self._full_at[key] = full_at
+        if len(self._full_at) > self._sweep_at:
+            self.purge(now)
+        return 0
+
+    def purge(self, now=None):
+        if now is None:
+            now = time.time()
+        full = [key for key, full_at in list(self._full_at.items())
+                if full_at <= now]
+        for key in full:
+            self._full_at.pop(key, None)
+        self._sweep_at = max(self.max_entries, 2 * len(self._full_at))
+        return len(full)
+
+    def clear(self):
+        self._full_at.clear()
+
+
+class SQLRateLimitStore(object):
+    """Buckets in the `rate_limits` table, on connections of their own so
+    they never commit the request's database session.
+
+    Checks run on every limited request, so the statements are built and
+    compiled once, and on SQLite the store pools its connections instead
+    of opening a new one each time.
+    """
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self._engine = None
+        self._compiled = {}
+        now = bindparam('now')
+        full_at = case([(table.c.full_at > now, table.c.full_at)],
+                       else_=now) + bindparam('interval')
+        self._take = table.update().where(
+            (table.c.bucket == bindparam('key')) &
+            (full_at - now <= bindparam('period'))
+        ).values(full_at=full_at)
+        self._stored = select([table.c.full_at]).where(
+            table.c.bucket == bindparam('key'))
+
+    @property
+    def engine(self):
+        engine = self.db.engine
+        if engine.dialect.name != 'sqlite':
+            return engine
+        if self._engine is None or self._engine.url != engine.url:
+            self._engine = create_engine(
+                engine.url, poolclass=QueuePool,
+                connect_args={'check_same_thread': False})
+        return self._engine
+
+    def hit(self, key, interval, period, now):
+        engine = self.engine
+        with engine.begin() as conn:
+            conn = conn.execution_options(compiled_cache=self._compiled)
+            taken = conn.execute(self._take, key=key, interval=interval,
+                                 period=period, now=now).rowcount
+            if taken:
+                return 0
+            stored = conn.execute(self._stored, key=key).scalar()
+            if stored is None:
+                conn.execute(insert_ignore(self.table, engine.dialect).values(
+                    bucket=key, full_at=now + interval))
+                return 0
+        return max(stored, now) + interval - period - now
+
+    def purge(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.engine.begin() as conn:
+            return conn.execute(self.table.delete().where(
+                self.table.c.full_at <= now)).rowcount
+
+    def clear(self):
+        with self.engine.begin() as conn:
+            conn.execute(self.table.delete())
+
+
+def make_store(config):
+    kind = config['RATELIMIT_TYPE']
+    if kind == 'local':
+        return LocalRateLimitStore(config['RATELIMIT_MAX_ENTRIES'])
+    if kind == 'sql':
+        from project import db
+        from project.models import RateLimit
+        return SQLRateLimitStore(db, RateLimit.__table__)
+    raise ValueError('Unknown RATELIMIT_TYPE {0!r}'.format(kind))
+
+
+def index_rules(limits):
+    """Maps each endpoint, or (method, endpoint) pair, to its Rules."""
+    rules = {}
+    for name, (scope, requests, seconds, endpoints) in sorted(limits.items()):
+        if scope not in SCOPES:
+            raise ValueError('Unknown scope {0!r} for rate limit {1}'.format(
+                scope, name))
+        rule = Rule(name, scope, float(seconds) / requests, seconds)
+        for endpoint in endpoints:
+            method, _, endpoint = endpoint.rpartition(' ')
+            key = (method, endpoint) if method else endpoint
+            rules[key] = rules.get(key, ()) + (rule,)
+    return rules
+
+
+class RateLimiter(object):
+
+    def __init__(self, app=None):
+        self.app = None
+        self.store = None
+        self._limits = None
+        self._rules = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.store = make_store(app.config)
+        app.before_request(self.check)
+
+    def rules(self):
+        limits = self.app.config['RATE_LIMITS']
+        if limits is not self._limits:
+            self._rules = index_rules(limits)
+            self._limits = limits
+        return self._rules
+
+    def check(self):
+        """Takes the current request's tokens, raises RateLimited when one
+        of its buckets is empty."""
+        if not self.app.config['RATELIMIT_ENABLED'] or request.endpoint is None:
+            return
+        rules = self.rules()
+        matched = rules.get(request.endpoint, ()) + rules.get(
+            (request.method, request.endpoint), ())
+        if not matched:
+            return
+        now = time.time()
+        for rule in matched:
+            if rule.scope == 'user':
+                identity = session.get('user_id')
+                if identity is None:
+                    continue
+            else:
+                identity = request.remote_addr
+            key = '{0}:{1}:{2}'.format(rule.name, rule.scope, identity)
+            wait = self.store.hit(key, rule.interval, rule.period, now)
+            if wait > 0:
+                observe_rate_limited(rule.name)
+                raise RateLimited(rule, int(math.ceil(wait)))
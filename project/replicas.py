@@ -0,0 +1,79 @@
+"""Read replica routing.
+
+With a 'replica' entry in SQLALCHEMY_BINDS (set from DATABASE_REPLICA_URL)
+the reads of GET and HEAD requests go to the replica, everything else to
+the primary: other methods, views marked `uses_primary`, commands and
+workers, and any request once it has written. A statement counts as a
+write unless it is a plain SELECT, so flushes, inserts, updates, deletes,
+SELECT ... FOR UPDATE and raw statements all reach the primary.
+
+A replica lags behind, so a request that writes pins its session to the
+primary for REPLICA_PIN_SECONDS, and the user reads their own writes.
+Cache entries filled by a request that read the replica are kept for at
+most CACHE_REPLICA_TIMEOUT seconds (see Cache.set), since one filled just
+after an invalidation may hold rows the replica had not caught up on.
+"""
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy.sql.expression import SelectBase, TextClause
+
+REPLICA = 'replica'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def uses_primary(view):
+    """Marks a GET view that writes, its reads then see the primary too."""
+    view.uses_primary = True
+    return view
+
+
+def is_read(clause):
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() == 'SELECT'
+    return (isinstance(clause, SelectBase)
+            and getattr(clause, '_for_update_arg', None) is None)
+
+
+def pinned():
+    return session.get('primary_until', 0) > time.time()
+
+
+def has_replica(app):
+    return REPLICA in (app.config.get('SQLALCHEMY_BINDS') or ())
+
+
+def reads_replica(app):
+    if not has_replica(app) or request.method not in READ_METHODS:
+        return False
+    view = app.view_functions.get(request.endpoint)
+    if getattr(view, 'uses_primary', False):
+        return False
+    return not pinned()
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context():
+            if g.get('db_replica') is None:
+                g.db_replica = reads_replica(self.app)
+            if self._flushing or not is_read(clause):
+                if not g.get('db_wrote') and has_replica(self.app):
+                    g.db_replica = False
+                    g.db_wrote = True
+                    session['primary_until'] = (
+                        time.time() + self.app.config['REPLICA_PIN_SECONDS'])
+            elif g.db_replica:
+                g.replica_read = True
+                return get_state(self.app).db.get_engine(
+                    self.app, bind=REPLICA)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutedSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with sessions that send reads to a replica."""
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
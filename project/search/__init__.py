@@ -0,0 +1,183 @@
+"""Full-text search over tweets and user names.
+
+On SQLite the indexes are the FTS5 tables `tweets_fts` and `users_fts`.
+They are external content tables, which keep only the inverted index and
+read the text back from `tweets` and `users`, so the write paths update
+them in the same transaction through `index_tweet`, `unindex_tweet` and
+`index_user`. On postgres they are GIN indexes on `to_tsvector`
+expressions, which the database maintains by itself.
+
+Results are ordered by relevance and paged on (score, id). Queries are
+reduced to their words, all of which must match, so user input never
+reaches the query syntax of either engine.
+"""
+import re
+
+from sqlalchemy import (DDL, Float, Integer, and_, column, event, func,
+    literal_column, or_, select, text)
+
+from project import app, db
+from project.models import Tweet, User
+from project.pagination import Page, encode_rank_cursor
+
+WORD = re.compile(r'\w+', re.UNICODE)
+MAX_WORDS = 8
+
+# (create, drop) statements per table, run by create_all and drop_all.
+# Postgres drops the indexes together with their tables.
+SQLITE_DDL = {
+    'tweets': (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts USING fts5("
+        "tweet, content='tweets', content_rowid='tweet_id', "
+        "tokenize='porter unicode61')",
+        "DROP TABLE IF EXISTS tweets_fts",
+    ),
+    'users': (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+        "name, content='users', content_rowid='id', prefix='2 3')",
+        "DROP TABLE IF EXISTS users_fts",
+    ),
+}
+POSTGRES_DDL = {
+    'tweets': "CREATE INDEX IF NOT EXISTS ix_tweets_tweet_fts ON tweets "
+              "USING gin (to_tsvector('english', tweet))",
+    'users': "CREATE INDEX IF NOT EXISTS ix_users_name_fts ON users "
+             "USING gin (to_tsvector('simple', name))",
+}
+
+for table in (Tweet.__table__, User.__table__):
+    create, drop = SQLITE_DDL[table.name]
+    event.listen(table, 'after_create',
+                 DDL(create).execute_if(dialect='sqlite'))
+    event.listen(table, 'after_drop',
+                 DDL(drop).execute_if(dialect='sqlite'))
+    event.listen(table, 'after_create',
+                 DDL(POSTGRES_DDL[table.name]).execute_if(
+                     dialect='postgresql'))
+
+
+def dialect():
+    return db.engine.dialect.name
+
+
+def words(query):
+    return WORD.findall(query or '')[:MAX_WORDS]
+
+
+# index maintenance
+
+def index_tweet(tweet):
+    if dialect() == 'sqlite':
+        db.session.execute(
+            'INSERT INTO tweets_fts (rowid, tweet) VALUES (:id, :tweet)',
+            dict(id=tweet.tweet_id, tweet=tweet.tweet))
+
+
+def unindex_tweet(tweet):
+    # an external content index can only forget the exact text it was given
+    if dialect() == 'sqlite':
+        db.session.execute(
+            "INSERT INTO tweets_fts (tweets_fts, rowid, tweet) "
+            "VALUES ('delete', :id, :tweet)",
+            dict(id=tweet.tweet_id, tweet=tweet.tweet))
+
+
+def index_user(user):
+    if dialect() == 'sqlite':
+        db.session.execute(
+            'INSERT INTO users_fts (rowid, name) VALUES (:id, :name)',
+            dict(id=user.id, name=user.name))
+
+
+def reindex():
+    """Rebuilds both indexes from the tables they cover."""
+    if dialect() == 'sqlite':
+        for name in ('tweets_fts', 'users_fts'):
+            db.session.execute(
+                "INSERT INTO {0} ({0}) VALUES ('rebuild')".format(name))
+    else:
+        for name in ('ix_tweets_tweet_fts', 'ix_users_name_fts'):
+            db.session.execute('REINDEX INDEX {0}'.format(name))
+    db.session.commit()
+    return (db.session.query(func.count(Tweet.tweet_id)).scalar(),
+            db.session.query(func.count(User.id)).scalar())
+
+
+# queries
+
+def tweet_matches(terms):
+    if dialect() == 'sqlite':
+        return text(
+            'SELECT rowid AS id, bm25(tweets_fts) AS score '
+            'FROM tweets_fts WHERE tweets_fts MATCH :query'
+        ).bindparams(
+            query=u' '.join(u'"{0}"'.format(t) for t in terms)
+        ).columns(column('id', Integer), column('score', Float))
+    config = literal_column("'english'")
+    vector = func.to_tsvector(config, Tweet.tweet)
+    query = func.to_tsquery(config, ' & '.join(terms))
+    return select([
+        Tweet.tweet_id.label('id'),
+        (-func.ts_rank_cd(vector, query)).label('score'),
+    ]).where(vector.op('@@')(query))
+
+
+def user_matches(terms):
+    # names are matched as you type, every word is a prefix
+    if dialect() == 'sqlite':
+        return text(
+            'SELECT rowid AS id, bm25(users_fts) AS score '
+            'FROM users_fts WHERE users_fts MATCH :query'
+        ).bindparams(
+            query=u' '.join(u'"{0}"*'.format(t) for t in terms)
+        ).columns(column('id', Integer), column('score', Float))
+    config = literal_column("'simple'")
+    vector = func.to_tsvector(config, User.name)
+    query = func.to_tsquery(config, ' & '.join(t + ':*' for t in terms))
+    return select([
+        User.id.label('id'),
+        (-func.ts_rank_cd(vector, query)).label('score'),
+    ]).where(vector.op('@@')(query))
+
+
+def ranked_page(query, matches, id_column, cursor, per_page):
+    """Best first page of `query` joined to `matches`, after `cursor`."""
+    if cursor is not None:
+        score, item_id = cursor
+        query = query.filter(or_(
+            matches.c.score > score,
+            and_(matches.c.score == score, id_column > item_id),
+        ))
+    rows = query.add_columns(matches.c.score).order_by(
+        matches.c.score, id_column).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        item, score = rows[-1]
+        next_cursor = encode_rank_cursor(
+            score, getattr(item, id_column.key))
+    return Page([row[0] for row in rows], next_cursor)
+
+
+def search_tweets(query, cursor=None, per_page=None):
+    terms = words(query)
+    if not terms:
+        return Page([], None)
+    if per_page is None:
+        per_page = app.config['TWEETS_PER_PAGE']
+    matches = tweet_matches(terms).alias('matches')
+    tweets = db.session.query(Tweet).options(
+        db.joinedload(Tweet.poster)
+    ).join(matches, matches.c.id == Tweet.tweet_id)
+    return ranked_page(tweets, matches, Tweet.tweet_id, cursor, per_page)
+
+
+def search_users(query, cursor=None, per_page=None):
+    terms = words(query)
+    if not terms:
+        return Page([], None)
+    if per_page is None:
+        per_page = app.config['TWEETS_PER_PAGE']
+    matches = user_matches(terms).alias('matches')
+    users = db.session.query(User).join(matches, matches.c.id == User.id)
+    return ranked_page(users, matches, User.id, cursor, per_page)
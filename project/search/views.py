@@ -0,0 +1,43 @@
+# imports
+from flask import (abort, render_template, request, session, Blueprint)
+
+from project import search
+from project.models import User
+from project.pagination import decode_rank_cursor
+from project.tweets.views import login_required
+
+# config
+search_blueprint = Blueprint('search', __name__)
+
+# helper functions
+
+def request_rank_cursor():
+    cursor = request.args.get('cursor')
+    if not cursor:
+        return None
+    try:
+        return decode_rank_cursor(cursor)
+    except ValueError:
+        abort(400)
+
+
+# routes
+
+@search_blueprint.route('/search/')
+@login_required
+def search_page():
+    query = request.args.get('q', '')
+    kind = request.args.get('type', 'tweets')
+    if kind == 'users':
+        page = search.search_users(query, request_rank_cursor())
+    else:
+        kind = 'tweets'
+        page = search.search_tweets(query, request_rank_cursor())
+    return render_template(
+        'search.html',
+        query=query,
+        kind=kind,
+        results=page.items,
+        next_cursor=page.next_cursor,
+        following_ids=User.following_ids(session['user_id']),
+    )
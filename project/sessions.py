@@ -0,0 +1,299 @@
+"""Server-side sessions.
+
+The session cookie only carries a random id; the session itself is kept
+by a store picked with SESSION_TYPE. Sessions expire after
+PERMANENT_SESSION_LIFETIME of inactivity: requests push the expiry back,
+but an unchanged session is only written again once SESSION_REFRESH_EACH
+has passed since its last save, so most requests do no session writes at
+all. Every session of a user can be revoked at once, e.g. to sign them
+out everywhere.
+
+The local store lives inside one process, so deployments with several
+workers should use the sql or redis stores.
+"""
+import base64
+import datetime
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import (SessionInterface, SessionMixin,
+    session_json_serializer)
+from sqlalchemy import select
+from werkzeug.datastructures import CallbackDict
+
+SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+
+def new_session_id():
+    return base64.urlsafe_b64encode(os.urandom(32)).decode('ascii')[:43]
+
+
+class LocalSessionStore(object):
+    """Thread safe in-process LRU of sessions."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.pop(sid, None)
+            if entry is None or entry[2] <= time.time():
+                return None
+            self._entries[sid] = entry
+            return entry[0], entry[2]
+
+    def set(self, sid, data, user_id, expires):
+        with self._lock:
+            self._entries.pop(sid, None)
+            self._entries[sid] = (data, user_id, expires)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, sid, expires):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None:
+                self._entries[sid] = (entry[0], entry[1], expires)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            sids = [sid for sid, entry in self._entries.items()
+                    if entry[1] == user_id]
+            for sid in sids:
+                del self._entries[sid]
+        return len(sids)
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            sids = [sid for sid, entry in self._entries.items()
+                    if entry[2] <= now]
+            for sid in sids:
+                del self._entries[sid]
+        return len(sids)
+
+
+class SQLSessionStore(object):
+    """Sessions in the `sessions` table. Runs on its own connections so it
+    never commits or rolls back the request's database session."""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+
+    @property
+    def engine(self):
+        return self.db.engine
+
+    def get(self, sid):
+        sessions = self.table
+        with self.engine.connect() as conn:
+            row = conn.execute(select([
+                sessions.c.data, sessions.c.expires,
+            ]).where(sessions.c.id == sid)).first()
+        if row is None:
+            return None
+        expires = to_timestamp(row.expires)
+        if expires <= time.time():
+            return None
+        return row.data, expires
+
+    def set(self, sid, data, user_id, expires):
+        sessions = self.table
+        values = dict(data=data, user_id=user_id,
+                      expires=to_datetime(expires))
+        with self.engine.begin() as conn:
+            updated = conn.execute(sessions.update().where(
+                sessions.c.id == sid).values(**values)).rowcount
+            if not updated:
+                conn.execute(sessions.insert().values(id=sid, **values))
+
+    def touch(self, sid, expires):
+        sessions = self.table
+        with self.engine.begin() as conn:
+            conn.execute(sessions.update().where(
+                sessions.c.id == sid).values(expires=to_datetime(expires)))
+
+    def delete(self, sid):
+        with self.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.id == sid))
+
+    def delete_user(self, user_id):
+        with self.engine.begin() as conn:
+            return conn.execute(self.table.delete().where(
+                self.table.c.user_id == user_id)).rowcount
+
+    def purge(self):
+        with self.engine.begin() as conn:
+            return conn.execute(self.table.delete().where(
+                self.table.c.expires <= datetime.datetime.utcnow())).rowcount
+
+
+class RedisSessionStore(object):
+    """Store for any client speaking the redis-py API. Redis expires the
+    sessions itself, a set per user lists their session ids."""
+
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+
+    def user_key(self, user_id):
+        return '{0}user:{1}'.format(self.prefix, user_id)
+
+    def load(self, sid):
+        raw = self.client.get(self.prefix + sid)
+        if raw is None:
+            return None
+        if not isinstance(raw, str):
+            raw = raw.decode('utf-8')
+        entry = json.loads(raw)
+        if entry['expires'] <= time.time():
+            return None
+        return entry
+
+    def get(self, sid):
+        entry = self.load(sid)
+        return entry and (entry['data'], entry['expires'])
+
+    def set(self, sid, data, user_id, expires):
+        ttl = max(1, int(expires - time.time()) + 1)
+        self.client.set(self.prefix + sid, json.dumps(dict(
+            data=data, user_id=user_id, expires=expires)), ex=ttl)
+        if user_id is not None:
+            self.client.sadd(self.user_key(user_id), sid)
+            self.client.expire(self.user_key(user_id), ttl)
+
+    def touch(self, sid, expires):
+        entry = self.load(sid)
+        if entry is not None:
+            self.set(sid, entry['data'], entry['user_id'], expires)
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def delete_user(self, user_id):
+        key = self.user_key(user_id)
+        sids = [sid if isinstance(sid, str) else sid.decode('ascii')
+                for sid in self.client.smembers(key)]
+        revoked = 0
+        if sids:
+            revoked = self.client.delete(*[self.prefix + sid for sid in sids])
+        self.client.delete(key)
+        return revoked
+
+    def purge(self):
+        return 0
+
+
+def to_datetime(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp)
+
+
+def to_timestamp(value):
+    return (value - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def make_store(config):
+    kind = config['SESSION_TYPE']
+    if kind == 'local':
+        return LocalSessionStore(config['SESSION_MAX_ENTRIES'])
+    if kind == 'sql':
+        from project import db
+        from project.models import StoredSession
+        return SQLSessionStore(db, StoredSession.__table__)
+    if kind == 'redis':
+        import redis
+        client = redis.StrictRedis.from_url(config['SESSION_REDIS_URL'])
+        return RedisSessionStore(client, config['SESSION_KEY_PREFIX'])
+    raise ValueError('Unknown SESSION_TYPE {0!r}'.format(kind))
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.dropped = []
+        self.modified = False
+
+    def regenerate(self):
+        """Moves the session to a fresh id and drops the old one, call it
+        whenever the user behind the session changes."""
+        if self.sid is not None:
+            self.dropped.append(self.sid)
+        self.sid = None
+        self.modified = True
+
+
+class ServerSessions(SessionInterface):
+
+    def __init__(self, app=None):
+        self.store = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.store = make_store(app.config)
+        app.session_interface = self
+
+    def revoke(self, user_id):
+        """Signs `user_id` out of every session, returns how many."""
+        return self.store.delete_user(user_id)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid and SESSION_ID.match(sid):
+            stored = self.store.get(sid)
+            if stored is not None:
+                data, expires = stored
+                return ServerSession(
+                    session_json_serializer.loads(data), sid, expires)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = app.session_cookie_name
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+        for sid in session.dropped:
+            self.store.delete(sid)
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+            if session.modified:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        refresh = app.config['SESSION_REFRESH_EACH']
+        if session.sid is None:
+            session.sid = new_session_id()
+        elif not session.modified and session.expires - now > lifetime - refresh:
+            return
+        expires = now + lifetime
+        if session.modified:
+            self.store.set(session.sid,
+                           session_json_serializer.dumps(dict(session)),
+                           session.get('user_id'), expires)
+        else:
+            self.store.touch(session.sid, expires)
+        response.set_cookie(
+            name, session.sid, expires=int(expires),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app))
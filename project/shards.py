@@ -0,0 +1,389 @@
+"""A read-side projection of tweets and follow edges over several
+databases, serving home timelines.
+
+This does not partition the data: the main database stays the system of
+record for every table, allocates tweet ids and takes every write, and
+everything but the home timeline (profiles, follower lists, search,
+counters) is read from it. What the shards take off the main database is
+the home timeline read, which otherwise needs an inbox row per follower
+of every tweet.
+
+SHARDS lists the database URLs. A tweet is copied to the shard of its
+author and a follow edge to the shard of the follower, user id modulo the
+number of shards. A home timeline is read scatter-gather: the reader's
+follows come from their own shard, the followed accounts are grouped by
+shard, every shard is asked for its newest page of their tweets at once on
+a pool of SHARD_WORKERS threads, and the pages are merged k-way on
+(posted, tweet_id).
+
+While SHARDS is set each write action queues a shard-sync job in its own
+transaction and runs it right after committing (see project/actions.py),
+so the writer sees their change at once, and the inboxes are no longer
+written. The job makes the shard hold what the main database holds for
+the rows written, so a shard that was down is brought back in line when
+a worker retries it. Run rebuild-timelines before turning SHARDS off.
+
+`reshard` copies every row of one layout onto another, the main database
+onto a first set of shards or N shards onto M, skipping rows the target
+already has, so it can be run again to catch up. `remove_missing` deletes
+the shard rows the main database no longer has, tweets deleted and follows
+undone while a copy ran, and `prune` the rows a shard holds but no longer
+owns.
+"""
+import datetime
+import heapq
+import os
+import threading
+from collections import namedtuple
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+
+from sqlalchemy import (Column, DateTime, Index, Integer, MetaData,
+    PrimaryKeyConstraint, String, Table, and_, bindparam, create_engine, or_,
+    select)
+from sqlalchemy.pool import QueuePool
+
+from project.database import insert_ignore
+from project.pagination import Page, encode_cursor
+
+metadata = MetaData()
+
+tweets = Table(
+    'tweets', metadata,
+    Column('tweet_id', Integer, primary_key=True, autoincrement=False),
+    Column('user_id', Integer, nullable=False),
+    Column('tweet', String, nullable=False),
+    Column('posted', DateTime, nullable=False),
+    Index('ix_tweets_user_id_posted', 'user_id', 'posted', 'tweet_id'),
+)
+
+follower = Table(
+    'follower', metadata,
+    Column('who_id', Integer, nullable=False),
+    Column('whom_id', Integer, nullable=False),
+    PrimaryKeyConstraint('who_id', 'whom_id'),
+    Index('ix_follower_whom_id_who_id', 'whom_id', 'who_id'),
+)
+
+# each table, the user id column it is partitioned by and its key
+PARTITIONS = (
+    (tweets, tweets.c.user_id, (tweets.c.tweet_id,)),
+    (follower, follower.c.who_id, (follower.c.who_id, follower.c.whom_id)),
+)
+
+# ids per IN list, sqlite allows at most 999 parameters a statement
+IN_CHUNK = 500
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# rows of a table looked at and rows inserted or deleted
+Counted = namedtuple('Counted', ['table', 'rows', 'changed'])
+
+
+class ShardTweet(namedtuple('ShardTweet', [
+        'tweet_id', 'user_id', 'tweet', 'posted', 'poster'])):
+    """A tweet read from a shard, with the attributes of Tweet that the
+    timeline templates and JSON views use. `poster` is filled in from the
+    main database by the caller."""
+    __slots__ = ()
+
+    def to_dict(self):
+        return {
+            'tweet_id': self.tweet_id,
+            'user_id': self.user_id,
+            'tweet': self.tweet,
+            'posted': self.posted.isoformat(),
+        }
+
+
+def connect(url):
+    # pool threads take turns with the connections, which sqlite only
+    # allows with check_same_thread off
+    if url.startswith('sqlite'):
+        return create_engine(url, poolclass=QueuePool,
+                             connect_args={'check_same_thread': False})
+    return create_engine(url)
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def newest_key(tweet):
+    # heapq pops the smallest entry, the newest tweet has the smallest key
+    return (EPOCH - tweet.posted, -tweet.tweet_id)
+
+
+def merge_newest(pages):
+    """Merges newest-first lists of tweets into one newest-first iterator,
+    holding one entry per list in a heap."""
+    heap = [(newest_key(page[0]), i, 0) for i, page in enumerate(pages)
+            if page]
+    heapq.heapify(heap)
+    while heap:
+        _, i, j = heap[0]
+        yield pages[i][j]
+        j += 1
+        if j < len(pages[i]):
+            heapq.heapreplace(heap, (newest_key(pages[i][j]), i, j))
+        else:
+            heapq.heappop(heap)
+
+
+def newest_tweets(engine, user_ids, cursor, limit, since=None):
+    """Up to `limit` newest tweets of `user_ids` on one shard, older than
+    the (posted, tweet_id) `cursor` and newer than the one `since`."""
+    query = select([tweets]).where(tweets.c.user_id.in_(user_ids))
+    if since is not None:
+        posted, tweet_id = since
+        if posted is not None:
+            query = query.where(tweets.c.posted >= posted)
+        query = query.where(tweets.c.tweet_id > tweet_id)
+    if cursor is not None:
+        posted, tweet_id = cursor
+        query = query.where(or_(
+            tweets.c.posted < posted,
+            and_(tweets.c.posted == posted, tweets.c.tweet_id < tweet_id),
+        ))
+    query = query.order_by(
+        tweets.c.posted.desc(), tweets.c.tweet_id.desc()).limit(limit)
+    with engine.connect() as conn:
+        return [ShardTweet(row.tweet_id, row.user_id, row.tweet, row.posted,
+                           None) for row in conn.execute(query)]
+
+
+def page_of(rows, per_page):
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].posted, rows[-1].tweet_id)
+    return Page(rows, next_cursor)
+
+
+def call(task):
+    func, args = task[0], task[1:]
+    return func(*args)
+
+
+def after(columns, key):
+    """Rows whose `columns` come after the `key` tuple, in key order."""
+    clause = columns[-1] > key[-1]
+    for column, value in reversed(list(zip(columns[:-1], key[:-1]))):
+        clause = or_(column > value, and_(column == value, clause))
+    return clause
+
+
+def keys_of(engine, columns, size):
+    """Yields the `columns` of every row of their table in key order, in
+    lists of at most `size`, each read with its own statement."""
+    last = None
+    while True:
+        query = select(list(columns)).order_by(*columns).limit(size)
+        if last is not None:
+            query = query.where(after(columns, last))
+        with engine.connect() as conn:
+            keys = [tuple(row) for row in conn.execute(query)]
+        if not keys:
+            return
+        yield keys
+        last = keys[-1]
+
+
+def reshard(sources, targets, chunk_size):
+    """Copies the tweets and follow edges on the `sources` engines onto the
+    `targets` engines, each row to the target its user id maps to, in
+    transactions of at most `chunk_size` rows. Returns a Counted per table."""
+    for target in targets:
+        metadata.create_all(target)
+    copied = []
+    for table, key, _ in PARTITIONS:
+        read = inserted = 0
+        for source in sources:
+            with source.connect() as conn:
+                result = conn.execution_options(stream_results=True).execute(
+                    select(list(table.c)))
+                while True:
+                    rows = result.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    read += len(rows)
+                    placed = {}
+                    for row in rows:
+                        placed.setdefault(row[key.name] % len(targets),
+                                          []).append(dict(row))
+                    for index, chunk in sorted(placed.items()):
+                        target = targets[index]
+                        with target.begin() as target_conn:
+                            inserted += max(target_conn.execute(
+                                insert_ignore(table, target.dialect),
+                                chunk).rowcount, 0)
+        copied.append(Counted(table.name, read, inserted))
+    return copied
+
+
+def remove_missing(source, targets, chunk_size):
+    """Deletes the rows on the `targets` engines that the `source` engine
+    no longer has, looking them up `chunk_size` at a time. Returns a
+    Counted per table."""
+    removed = []
+    for table, _, columns in PARTITIONS:
+        read = deleted = 0
+        # looked up by the first key column, the rest is compared here
+        lookup = select(list(columns))
+        statement = table.delete().where(and_(*[
+            column == bindparam('key_' + column.name) for column in columns]))
+        for target in targets:
+            for keys in keys_of(target, columns, chunk_size):
+                read += len(keys)
+                with source.connect() as conn:
+                    present = set(tuple(row) for row in conn.execute(
+                        lookup.where(columns[0].in_(
+                            sorted(set(key[0] for key in keys))))))
+                missing = [key for key in keys if key not in present]
+                if missing:
+                    with target.begin() as conn:
+                        conn.execute(statement, [
+                            dict(('key_' + column.name, value)
+                                 for column, value in zip(columns, key))
+                            for key in missing])
+                    deleted += len(missing)
+        removed.append(Counted(table.name, read, deleted))
+    return removed
+
+
+def prune(engines):
+    """Deletes the rows each of `engines` holds for users that map to
+    another of them. Returns a Counted per table."""
+    pruned = []
+    for table, key, _ in PARTITIONS:
+        read = deleted = 0
+        for index, engine in enumerate(engines):
+            misplaced = key % len(engines) != index
+            with engine.begin() as conn:
+                read += conn.execute(select([table.count()])).scalar()
+                deleted += conn.execute(
+                    table.delete().where(misplaced)).rowcount
+        pruned.append(Counted(table.name, read, deleted))
+    return pruned
+
+
+class Shards(object):
+
+    def __init__(self, app=None):
+        self.config = {'SHARDS': [], 'SHARD_WORKERS': 1}
+        self._engines = {}
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.config = app.config
+
+    @property
+    def enabled(self):
+        return bool(self.config['SHARDS'])
+
+    @property
+    def pool(self):
+        # created lazily and per process, like the password hashing pool
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPool(self.config['SHARD_WORKERS'])
+                self._pid = os.getpid()
+            return self._pool
+
+    def engines(self):
+        engines = []
+        for url in self.config['SHARDS']:
+            engine = self._engines.get(url)
+            if engine is None:
+                engine = self._engines[url] = connect(url)
+            engines.append(engine)
+        return engines
+
+    def engine_for(self, user_id):
+        engines = self.engines()
+        return engines[user_id % len(engines)]
+
+    def grouped(self, user_ids):
+        """(engine, sorted user ids) for every shard holding one of
+        `user_ids`."""
+        engines = self.engines()
+        groups = {}
+        for user_id in user_ids:
+            groups.setdefault(user_id % len(engines), []).append(user_id)
+        return [(engines[index], sorted(ids))
+                for index, ids in sorted(groups.items())]
+
+    def gather(self, tasks):
+        """Runs the (func, arg, ...) `tasks` at once on the pool and returns
+        their results in order. A single task runs in the calling thread."""
+        if len(tasks) == 1:
+            return [call(tasks[0])]
+        return self.pool.map(call, tasks)
+
+    def create_all(self):
+        for engine in self.engines():
+            metadata.create_all(engine)
+
+    def dispose(self):
+        for engine in self._engines.values():
+            engine.dispose()
+        self._engines.clear()
+
+    # writes
+
+    def sync_tweets(self, user_id, tweet_ids, rows):
+        """Makes the shard of `user_id` hold the tweet `rows`, dicts of the
+        tweets columns, and none of the other `tweet_ids`."""
+        gone = sorted(set(tweet_ids) - set(row['tweet_id'] for row in rows))
+        engine = self.engine_for(user_id)
+        with engine.begin() as conn:
+            if rows:
+                conn.execute(insert_ignore(tweets, engine.dialect), rows)
+            if gone:
+                conn.execute(tweets.delete().where(and_(
+                    tweets.c.user_id == user_id,
+                    tweets.c.tweet_id.in_(gone))))
+
+    def sync_follows(self, who_id, whom_ids, following):
+        """Makes the shard of `who_id` hold their follows of the `following`
+        ids and none of their other follows among `whom_ids`."""
+        gone = sorted(set(whom_ids) - set(following))
+        engine = self.engine_for(who_id)
+        with engine.begin() as conn:
+            if following:
+                conn.execute(insert_ignore(follower, engine.dialect), [
+                    dict(who_id=who_id, whom_id=whom_id)
+                    for whom_id in sorted(following)])
+            if gone:
+                conn.execute(follower.delete().where(and_(
+                    follower.c.who_id == who_id,
+                    follower.c.whom_id.in_(gone))))
+
+    def sync_from(self, source, chunk_size):
+        """Copies every row of the `source` engine onto the shards and
+        deletes the shard rows it no longer has."""
+        engines = self.engines()
+        return (reshard([source], engines, chunk_size) +
+                remove_missing(source, engines, chunk_size))
+
+    # reads
+
+    def home_timeline(self, user_id, cursor, per_page, since=None):
+        """Newest-first page of the tweets of `user_id` and the accounts
+        they follow, read from every shard holding some at once."""
+        with self.engine_for(user_id).connect() as conn:
+            followees = set(row[0] for row in conn.execute(select(
+                [follower.c.whom_id]).where(follower.c.who_id == user_id)))
+        followees.add(user_id)
+        tasks = []
+        for engine, user_ids in self.grouped(followees):
+            for ids in chunks(user_ids, IN_CHUNK):
+                tasks.append((newest_tweets, engine, ids, cursor,
+                              per_page + 1, since))
+        rows = list(islice(merge_newest(self.gather(tasks)), per_page + 1))
+        return page_of(rows, per_page)
@@ -0,0 +1,70 @@
+// Announces tweets pushed over the event stream while the timeline is open.
+(function () {
+  var banner = document.getElementById('new-tweets');
+  if (!banner || !window.EventSource) {
+    return;
+  }
+  var link = banner.getElementsByTagName('a')[0];
+  var seen = {};
+  var count = 0;
+
+  function show(text) {
+    link.textContent = text;
+    banner.className = banner.className.replace(/\s*\bhidden\b/, '');
+  }
+
+  var source = new EventSource(banner.getAttribute('data-stream'));
+  source.addEventListener('tweet', function (event) {
+    var tweet = JSON.parse(event.data);
+    if (seen[tweet.tweet_id]) {
+      return;
+    }
+    seen[tweet.tweet_id] = true;
+    count += 1;
+    show(count === 1 ? '1 new tweet' : count + ' new tweets');
+  });
+  source.addEventListener('reload', function () {
+    show('New tweets');
+  });
+})();
+
+// Shows tweet times relative to now. The markup only carries absolute
+// times, so cached pages never go stale.
+(function () {
+  var MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+                'August', 'September', 'October', 'November', 'December'];
+
+  function pad(number) {
+    return number < 10 ? '0' + number : String(number);
+  }
+
+  // the same steps as Tweet.delta_time
+  function relative(posted, now) {
+    var seconds = Math.floor((now - posted) / 1000);
+    if (seconds >= 24 * 60 * 60) {
+      return pad(posted.getDate()) + ' ' + MONTHS[posted.getMonth()] + ', ' +
+        posted.getFullYear();
+    }
+    if (seconds >= 60 * 60) {
+      return Math.floor(seconds / 3600) + 'h';
+    }
+    if (seconds >= 60) {
+      return Math.floor(seconds / 60) + 'm';
+    }
+    return 'few seconds ago';
+  }
+
+  function update() {
+    var now = new Date();
+    var times = document.querySelectorAll('time.posted');
+    for (var i = 0; i < times.length; i++) {
+      var posted = new Date(times[i].getAttribute('datetime'));
+      if (!isNaN(posted.getTime())) {
+        times[i].textContent = relative(posted, now);
+      }
+    }
+  }
+
+  update();
+  setInterval(update, 60 * 1000);
+})();
@@ -0,0 +1,74 @@
+"""Streamed template rendering.
+
+`stream_template` sends a page while it is rendered, in chunks of about
+STREAM_CHUNK_SIZE characters, so the head of the page and the stylesheets
+it links are on their way before the rest is worked out. Slow parts are
+passed in as `Deferred` values: the stream sends everything before one
+first and only then works it out.
+
+Headers, and so the session cookie, go out before the body is rendered,
+and metrics only time a streamed request up to that point. Whatever the
+templates would write to the session, flashed messages being popped and
+the CSRF token being created, is therefore done up front.
+"""
+from flask import (current_app, get_flashed_messages, render_template,
+    stream_with_context)
+from flask_wtf.csrf import generate_csrf
+
+
+class Deferred(object):
+    """A template value computed by `func(*args)` when the page gets to
+    it. Templates output it like any other value."""
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+        self.marker = u'\x00deferred:{0}\x00'.format(id(self))
+
+    def __html__(self):
+        # stands in for the value until render_stream swaps it
+        return self.marker
+
+    def render(self):
+        return self.func(*self.args)
+
+
+def render_stream(app, template_name, context):
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    deferred = dict((value.marker, value) for value in context.values()
+                    if isinstance(value, Deferred))
+    chunk = []
+    size = 0
+    for piece in template.generate(context):
+        part = deferred.get(piece)
+        if part is not None:
+            if chunk:
+                yield u''.join(chunk)
+                chunk = []
+                size = 0
+            piece = part.render()
+        chunk.append(piece)
+        size += len(piece)
+        if size >= app.config['STREAM_CHUNK_SIZE']:
+            yield u''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield u''.join(chunk)
+
+
+def stream_template(template_name, **context):
+    """A response streaming `template_name`, or rendering it in one go
+    when STREAM_TEMPLATES is off."""
+    app = current_app._get_current_object()
+    if not app.config['STREAM_TEMPLATES']:
+        for name, value in context.items():
+            if isinstance(value, Deferred):
+                context[name] = value.render()
+        return app.response_class(render_template(template_name, **context))
+    get_flashed_messages()
+    if app.config.get('WTF_CSRF_ENABLED', True):
+        generate_csrf()
+    return app.response_class(stream_with_context(
+        render_stream(app, template_name, context)))
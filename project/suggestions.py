@@ -0,0 +1,75 @@
+"""Who to follow suggestions.
+
+A user is suggested the accounts followed by the accounts they follow,
+scored by how many of those follow it. Scoring walks two hops of the
+follow graph, which is too slow to do per request, so `rebuild_all` runs
+offline (see the compute-suggestions command) and stores the best
+SUGGESTIONS_STORED per user in the `suggestions` table. Reads are cached
+and drop accounts the user has followed since the last run.
+"""
+from collections import namedtuple
+
+from sqlalchemy import func, literal, select
+
+from project import app, cache, db
+from project.models import Follower, Suggestion, User
+
+Suggested = namedtuple('Suggested', ['id', 'name', 'score'])
+
+follower = Follower.__table__
+suggestions = Suggestion.__table__
+
+
+def cache_key(user_id):
+    return 'suggestions:{0}'.format(user_id)
+
+
+def rebuild(user_id):
+    """Recomputes the stored suggestions of one user."""
+    mine = follower.alias('mine')
+    theirs = follower.alias('theirs')
+    following = select([follower.c.whom_id]).where(
+        follower.c.who_id == user_id)
+    score = func.count().label('score')
+    best = select([
+        literal(user_id).label('user_id'), theirs.c.whom_id, score,
+    ]).select_from(
+        mine.join(theirs, theirs.c.who_id == mine.c.whom_id)
+    ).where(
+        (mine.c.who_id == user_id) &
+        (theirs.c.whom_id != user_id) &
+        ~theirs.c.whom_id.in_(following)
+    ).group_by(theirs.c.whom_id).order_by(
+        score.desc(), theirs.c.whom_id
+    ).limit(app.config['SUGGESTIONS_STORED'])
+    db.session.execute(suggestions.delete().where(
+        suggestions.c.user_id == user_id))
+    db.session.execute(suggestions.insert().from_select(
+        ['user_id', 'suggested_id', 'score'], best))
+
+
+def rebuild_all():
+    user_ids = [row[0] for row in db.session.query(User.id)]
+    for user_id in user_ids:
+        rebuild(user_id)
+        db.session.commit()
+        cache.delete(cache_key(user_id))
+    return len(user_ids)
+
+
+def suggested_users(user_id, limit=None):
+    def load():
+        rows = db.session.query(
+            User.id, User.name, Suggestion.score
+        ).join(
+            Suggestion, Suggestion.suggested_id == User.id
+        ).filter(
+            Suggestion.user_id == user_id
+        ).order_by(Suggestion.score.desc(), User.id)
+        return tuple(Suggested(*row) for row in rows)
+    if limit is None:
+        limit = app.config['SUGGESTIONS_SHOWN']
+    following = User.following_ids(user_id)
+    fresh = [s for s in cache.get_or_set(cache_key(user_id), load)
+             if s.id not in following]
+    return fresh[:limit]
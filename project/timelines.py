@@ -0,0 +1,248 @@
+"""Materialized home timelines.
+
+Every user has an inbox of (tweet_id, posted) rows in the `timeline` table
+holding their own tweets and those of the accounts they follow, so reading
+a timeline is one range scan on (user_id, posted, tweet_id). Inboxes are
+maintained on write: posting fans the tweet out to the poster's followers,
+following backfills the followee's tweets and unfollowing prunes them. Only
+the poster's own inbox is written in the request, the rest is done by
+background jobs (see project/actions.py), so the writes here are safe to
+repeat.
+
+Accounts with more than TIMELINE_FANOUT_LIMIT followers, going by their
+followers_count, are not fanned out; their tweets are merged into their
+followers' timelines at read time. Follows of such an account skip the
+backfill too, so when an unfollow brings it back down to the limit its
+tweets are fanned out again to every follower (see `refan`).
+
+While SHARDS is set home timelines are read from the shards instead and
+the inboxes are left as they were, see project/shards.py; rebuild them
+with `rebuild_all` before turning SHARDS off.
+
+Rendered pages are cached under keys built from generation tokens of the
+reader's inbox and of every fan-out exempt account they follow. Writes
+drop the tokens of the inboxes they touch, which orphans the old entries.
+"""
+from sqlalchemy import select
+
+from project import app, cache, db, shards
+from project.database import insert_ignore
+from project.models import Follower, TimelineEntry, Tweet, User
+from project.pagination import Page, keyset_page, merge_pages, newer_than
+
+timeline = TimelineEntry.__table__
+
+
+def fanout_limit():
+    return app.config['TIMELINE_FANOUT_LIMIT']
+
+
+def follower_ids(user_id):
+    rows = db.session.query(Follower.who_id).filter_by(whom_id=user_id)
+    return [row[0] for row in rows]
+
+
+def is_fanout_exempt(user_id):
+    limit = fanout_limit()
+    if not limit:
+        return False
+    count = db.session.query(User.followers_count).filter_by(
+        id=user_id).scalar()
+    return (count or 0) > limit
+
+
+def fanout_exempt_followees(user_id):
+    limit = fanout_limit()
+    if not limit:
+        return []
+    rows = db.session.query(Follower.whom_id).join(
+        User, User.id == Follower.whom_id
+    ).filter(Follower.who_id == user_id, User.followers_count > limit)
+    return [row[0] for row in rows]
+
+
+def fell_to_limit(user_ids):
+    """Ids among `user_ids` an unfollow has just brought down to the fan-out
+    limit, i.e. that stopped being exempt. Call it after adjust_counts in
+    the same transaction; the counter update locks the row, so of several
+    concurrent unfollows exactly one sees the crossing."""
+    limit = fanout_limit()
+    if not limit or not user_ids:
+        return []
+    rows = db.session.query(User.id).filter(
+        User.id.in_(user_ids), User.followers_count == limit)
+    return [row[0] for row in rows]
+
+
+def deliver(tweet, user_ids):
+    """Puts a flushed tweet into the inboxes of `user_ids`, skipping those
+    that already hold it."""
+    if not user_ids:
+        return
+    db.session.execute(insert_ignore(timeline, db.engine.dialect), [
+        dict(user_id=user_id, tweet_id=tweet.tweet_id,
+             author_id=tweet.user_id, posted=tweet.posted)
+        for user_id in user_ids
+    ])
+
+
+def fan_out(tweet):
+    """Delivers a tweet to its poster's followers and returns their ids,
+    none for a fan-out exempt poster."""
+    if is_fanout_exempt(tweet.user_id):
+        return []
+    followers = follower_ids(tweet.user_id)
+    deliver(tweet, followers)
+    return followers
+
+
+def refan(author_id):
+    """Copies every tweet of an account that is no longer fan-out exempt
+    into the inboxes of its followers, covering both the tweets it posted
+    and the follows it got while exempt. Returns the followers, none if it
+    is exempt again by now."""
+    if is_fanout_exempt(author_id):
+        return []
+    tweets = select([
+        Follower.who_id, Tweet.tweet_id, Tweet.user_id, Tweet.posted,
+    ]).where((Follower.whom_id == author_id) & (Tweet.user_id == author_id))
+    db.session.execute(insert_ignore(timeline, db.engine.dialect).from_select(
+        ['user_id', 'tweet_id', 'author_id', 'posted'], tweets))
+    return follower_ids(author_id)
+
+
+def remove_tweet(tweet_id):
+    """Drops a tweet from every inbox, returning the owners of those inboxes."""
+    recipients = [row[0] for row in db.session.execute(
+        select([timeline.c.user_id]).where(timeline.c.tweet_id == tweet_id))]
+    db.session.execute(timeline.delete().where(timeline.c.tweet_id == tweet_id))
+    return recipients
+
+
+def backfill(who_id, whom_ids):
+    """Copies the tweets of whom_ids into who_id's inbox after following
+    them, call it once the follows are flushed."""
+    whom_ids = set(whom_ids).difference(fanout_exempt_followees(who_id))
+    if not whom_ids:
+        return
+    tweets = select([
+        db.literal(who_id), Tweet.tweet_id, Tweet.user_id, Tweet.posted,
+    ]).where(Tweet.user_id.in_(whom_ids))
+    db.session.execute(insert_ignore(timeline, db.engine.dialect).from_select(
+        ['user_id', 'tweet_id', 'author_id', 'posted'], tweets))
+
+
+def prune(who_id, whom_ids):
+    """Drops the tweets of whom_ids from who_id's inbox after unfollowing
+    them."""
+    db.session.execute(timeline.delete().where(
+        (timeline.c.user_id == who_id) & timeline.c.author_id.in_(whom_ids)))
+
+
+def rebuild(user_id):
+    """Recomputes one inbox from the follow graph."""
+    db.session.execute(timeline.delete().where(timeline.c.user_id == user_id))
+    sources = db.session.query(Follower.whom_id).filter_by(who_id=user_id)
+    exempt = fanout_exempt_followees(user_id)
+    if exempt:
+        sources = sources.filter(~Follower.whom_id.in_(exempt))
+    tweets = select([
+        db.literal(user_id), Tweet.tweet_id, Tweet.user_id, Tweet.posted,
+    ]).where((Tweet.user_id == user_id) | Tweet.user_id.in_(sources))
+    db.session.execute(timeline.insert().from_select(
+        ['user_id', 'tweet_id', 'author_id', 'posted'], tweets))
+    invalidate([user_id])
+
+
+def rebuild_all():
+    user_ids = [row[0] for row in db.session.query(User.id)]
+    for user_id in user_ids:
+        rebuild(user_id)
+        db.session.commit()
+    return len(user_ids)
+
+
+def home_timeline(user_id, cursor=None, per_page=None, exempt=None,
+                  since_id=None):
+    """Page of the home timeline, read from the shards while SHARDS is set
+    and from the inbox and the fan-out exempt followees otherwise."""
+    if per_page is None:
+        per_page = app.config['TWEETS_PER_PAGE']
+    since = None
+    if since_id is not None:
+        since = (db.session.query(Tweet.posted).filter_by(
+            tweet_id=since_id).scalar(), since_id)
+    if shards.enabled:
+        return sharded_home_timeline(user_id, cursor, per_page, since)
+    inbox = db.session.query(Tweet).options(
+        db.joinedload(Tweet.poster)
+    ).join(
+        TimelineEntry, TimelineEntry.tweet_id == Tweet.tweet_id
+    ).filter(TimelineEntry.user_id == user_id)
+    if since is not None:
+        inbox = newer_than(
+            inbox, TimelineEntry.posted, TimelineEntry.tweet_id, since)
+    page = keyset_page(inbox, TimelineEntry.posted, TimelineEntry.tweet_id,
+                       cursor, per_page, key=lambda t: (t.posted, t.tweet_id))
+    if exempt is None:
+        exempt = fanout_exempt_followees(user_id)
+    if not exempt:
+        return page
+    authored = db.session.query(Tweet).options(
+        db.joinedload(Tweet.poster)
+    ).filter(Tweet.user_id.in_(exempt))
+    if since is not None:
+        authored = newer_than(authored, Tweet.posted, Tweet.tweet_id, since)
+    merged = keyset_page(
+        authored, Tweet.posted, Tweet.tweet_id, cursor, per_page)
+    return merge_pages([page, merged], per_page)
+
+
+def sharded_home_timeline(user_id, cursor, per_page, since=None):
+    """Page of the home timeline read scatter-gather from the shards
+    instead of the inbox, with the posters loaded from the main database."""
+    page = shards.home_timeline(user_id, cursor, per_page, since)
+    author_ids = set(t.user_id for t in page.items)
+    posters = {}
+    if author_ids:
+        posters = dict((user.id, user) for user in db.session.query(User)
+                       .filter(User.id.in_(author_ids)))
+    return Page([t._replace(poster=posters.get(t.user_id))
+                 for t in page.items], page.next_cursor)
+
+
+def user_tweets(user_id, cursor=None, per_page=None):
+    """Page of the tweets `user_id` posted, read from (user_id, posted)."""
+    if per_page is None:
+        per_page = app.config['TWEETS_PER_PAGE']
+    tweets = db.session.query(Tweet).filter(Tweet.user_id == user_id)
+    return keyset_page(tweets, Tweet.posted, Tweet.tweet_id, cursor, per_page)
+
+
+def timeline_version(user_id, exempt):
+    """Digest that changes whenever a write touches the inbox of `user_id`
+    or the tweets of an `exempt` followee, read from the cache alone."""
+    keys = ['timeline-gen:{0}'.format(user_id)]
+    keys.extend('author-gen:{0}'.format(author_id) for author_id in exempt)
+    return cache.generation(keys)
+
+
+def page_cache_key(user_id, cursor, exempt):
+    """Cache key of a rendered page, see timeline_version."""
+    return 'timeline:{0}:{1}:{2}'.format(
+        user_id, timeline_version(user_id, exempt), cursor or '')
+
+
+def author_page_key(author_id, cursor):
+    """Cache key of a rendered page of one author's tweets, changes whenever
+    they post or delete a tweet."""
+    digest = cache.generation(['author-gen:{0}'.format(author_id)])
+    return 'tweets-of:{0}:{1}:{2}'.format(author_id, digest, cursor or '')
+
+
+def invalidate(user_ids, author_id=None):
+    """Drops the cached pages of `user_ids`, call it after committing."""
+    keys = ['timeline-gen:{0}'.format(user_id) for user_id in user_ids]
+    if author_id is not None:
+        keys.append('author-gen:{0}'.format(author_id))
+    cache.delete(*keys)
@@ -1,22 +1,194 @@
 # imports
+from collections import namedtuple
 from functools import wraps
-from flask import (flash, redirect, render_template,
-    request, session, url_for, Blueprint)
+from flask import (abort, flash, g, make_response, redirect,
+    render_template, request, session, url_for, Blueprint, Markup)
 from sqlalchemy.exc import IntegrityError
 
 from .forms import RegisterForm, LoginForm
-from project import db, bcrypt
+from project import (app, cache, db, passwords, search, sessions,
+    suggestions, timelines)
 from project.models import User, Follower
+from project.pagination import Page, decode_cursor, encode_cursor
+from project.streaming import stream_template
+from project.passwords import HashingBusy
 
 # config
 users_blueprint = Blueprint('users', __name__)
 
+# generation token of the cached directory pages, deleting it drops them all.
+# They only hold ids and names, so only a new user changes them; counters
+# are cached per user, see User.counts_of.
+USERS_CACHE_KEY = 'users:generation'
+
+UserName = namedtuple('UserName', ['id', 'name'])
+UserRow = namedtuple('UserRow', ['id', 'name', 'followers_count',
+                                 'following_count', 'tweets_count'])
+CurrentUser = namedtuple('CurrentUser', ['id', 'name', 'role'])
+
 # helper functions
 
+def current_user():
+    """The logged in user, None for anonymous visitors. Loaded once per
+    request, and from the cache on most requests."""
+    if 'current_user' not in g:
+        g.current_user = None
+        user_id = session.get('user_id')
+        if user_id is not None:
+            def load():
+                row = db.session.query(User.id, User.name, User.role).filter(
+                    User.id == user_id).first()
+                return row and CurrentUser(*row)
+            g.current_user = cache.get_or_set(
+                'current-user:{0}'.format(user_id), load)
+    return g.current_user
+
+@users_blueprint.app_context_processor
+def inject_current_user():
+    return dict(current_user=current_user())
+
+def user_page(prefix='', after=None, per_page=None):
+    """Page of user ids and names in name order, optionally only names
+    starting with `prefix`. Both are range conditions on the unique index
+    on name. The counters read along are cached per user, see with_counts."""
+    if per_page is None:
+        per_page = app.config['USERS_PER_PAGE']
+    def load():
+        query = db.session.query(
+            User.id, User.name, User.followers_count, User.following_count,
+            User.tweets_count,
+        )
+        if prefix:
+            query = query.filter(User.name >= prefix,
+                                 User.name < prefix + u'\uffff')
+        if after:
+            query = query.filter(User.name > after)
+        rows = query.order_by(User.name).limit(per_page + 1).all()
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_cursor = rows[-1].name
+        for row in rows:
+            cache.set(User.counts_key(row[0]), tuple(row[2:]))
+        return Page(tuple(UserName(*row[:2]) for row in rows), next_cursor)
+    # names are unicode, a byte string format fails on non-ASCII ones
+    key = u'users:{0}:{1}:{2}:{3}'.format(
+        cache.generation([USERS_CACHE_KEY]), per_page, prefix, after or '')
+    return cache.get_or_set(key, load)
+
+def with_counts(page):
+    """The users of a user_page with their counters, which the writes that
+    change them drop from the cache one user at a time."""
+    counts = User.counts_of([user.id for user in page.items])
+    return Page(tuple(UserRow(user.id, user.name,
+                              *counts.get(user.id, (0, 0, 0)))
+                      for user in page.items), page.next_cursor)
+
+def find_profile(user_id):
+    row = db.session.query(
+        User.id, User.name, User.followers_count, User.following_count,
+        User.tweets_count,
+    ).filter(User.id == user_id).first()
+    if row is None:
+        abort(404)
+    return UserRow(*row)
+
+def request_cursor():
+    cursor = request.args.get('before')
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        abort(400)
+
+def tweets_fragment(user, cursor=None):
+    key = timelines.author_page_key(
+        user.id, cursor and encode_cursor(*cursor))
+    fragment = cache.get(key)
+    if fragment is None:
+        page = timelines.user_tweets(user.id, cursor)
+        fragment = render_template(
+            '_profile_tweets.html',
+            user=user,
+            tweets=page.items,
+            next_cursor=page.next_cursor,
+        )
+        cache.set(key, fragment)
+    return Markup(fragment)
+
+def follow_page(user_id, followers, after=None, per_page=None):
+    """Keyset page of the users following `user_id`, or followed by it,
+    in id order. Walks the (whom_id, who_id) index or the primary key."""
+    if per_page is None:
+        per_page = app.config['TWEETS_PER_PAGE']
+    if followers:
+        mine, other = Follower.whom_id, Follower.who_id
+    else:
+        mine, other = Follower.who_id, Follower.whom_id
+    query = db.session.query(User.id, User.name).join(
+        Follower, other == User.id).filter(mine == user_id)
+    if after is not None:
+        query = query.filter(other > after)
+    rows = query.order_by(other).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = rows[-1].id
+    return Page(rows, next_cursor)
+
+def relationship(user_id):
+    """How the logged in viewer relates to `user_id`, None if anonymous."""
+    if 'user_id' not in session:
+        return None
+    viewer_id = session['user_id']
+    if viewer_id == user_id:
+        return dict(yourself=True, following=False, follows_you=False)
+    return dict(
+        yourself=False,
+        following=user_id in User.following_ids(viewer_id),
+        follows_you=User.is_following(user_id, viewer_id),
+    )
+
+def cacheable(body):
+    """Lets shared caches keep pages rendered for anonymous visitors."""
+    response = make_response(body)
+    if 'user_id' in session:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['PUBLIC_PAGE_MAX_AGE']
+    response.vary.add('Cookie')
+    response.add_etag()
+    return response.make_conditional(request)
+
+def render_follows(user_id, followers):
+    user = find_profile(user_id)
+    page = follow_page(user_id, followers,
+                       request.args.get('after', type=int))
+    following_ids = frozenset()
+    if 'user_id' in session:
+        following_ids = User.following_ids(session['user_id'])
+    return cacheable(render_template(
+        'follows.html',
+        user=user,
+        relationship=relationship(user_id),
+        followers=followers,
+        users=page.items,
+        next_cursor=page.next_cursor,
+        following_ids=following_ids,
+    ))
+
+def busy(template, form):
+    error = 'We are a little busy right now, please try again in a moment.'
+    return (render_template(template, form=form, error=error), 503,
+            {'Retry-After': '1'})
+
 def login_required(test):
     @wraps(test)
     def wrap(*args, **kwargs):
-        if 'logged_in' in session:
+        if 'user_id' in session:
             return test(*args, **kwargs)
         else:
             flash('You need to login first')
@@ -29,13 +201,20 @@ def login_required(test):
 @users_blueprint.route('/logout/')
 @login_required
 def logout():
-    session.pop('logged_in', None)
-    session.pop('user_id', None)
-    session.pop('name', None)
-    session.pop('role', None)
+    session.clear()
+    session.regenerate()
     flash('You have been logged out')
     return redirect(url_for('users.login'))
 
+@users_blueprint.route('/logout/everywhere/')
+@login_required
+def logout_everywhere():
+    sessions.revoke(session['user_id'])
+    session.clear()
+    session.regenerate()
+    flash('You have been logged out on every device')
+    return redirect(url_for('users.login'))
+
 @users_blueprint.route('/', methods=['GET', 'POST'])
 def login():
     error = None
@@ -43,14 +222,23 @@ def login():
     if request.method == 'POST':
         if form.validate_on_submit():
             user = User.query.filter_by(name=request.form['name']).first()
-            if user is not None and bcrypt.check_password_hash(user.password,
-                request.form['password']):
-                    session['logged_in'] = True
-                    session['user_id'] = user.id
-                    session['name'] = user.name
-                    session['role'] = user.role
-                    flash('Welcome')
-                    return redirect(url_for('tweets.tweet'))
+            try:
+                valid = user is not None and passwords.check(
+                    user.password, request.form['password'])
+            except HashingBusy:
+                return busy('index.html', form)
+            if valid:
+                if passwords.needs_rehash(user.password):
+                    try:
+                        user.password = passwords.hash(request.form['password'])
+                        db.session.commit()
+                    except HashingBusy:
+                        # keep the old hash, it is upgraded on a later login
+                        pass
+                session.regenerate()
+                session['user_id'] = user.id
+                flash('Welcome')
+                return redirect(url_for('tweets.tweet'))
             else:
                 error = 'Invalid username or password.'
     return render_template('index.html', form=form, error=error)
@@ -59,21 +247,30 @@ def login():
 def register():
     error = None
     form = RegisterForm(request.form)
-    if 'logged_in' in session:
+    if 'user_id' in session:
         return redirect(url_for('tweets.tweet'))
     if request.method == 'POST':
         if form.validate_on_submit():
+            try:
+                password = passwords.hash(form.password.data)
+            except HashingBusy:
+                return busy('register.html', form)
             new_user = User(
                 form.name.data,
                 form.email.data,
-                bcrypt.generate_password_hash(form.password.data),
+                password,
             )
             try:
                 db.session.add(new_user)
+                db.session.flush()
+                search.index_user(new_user)
                 db.session.commit()
+                cache.delete(USERS_CACHE_KEY)
                 flash('Thanks for registering. Plese login.')
                 return redirect(url_for('users.login'))
             except IntegrityError:
+                # end the failed transaction before the session is saved
+                db.session.rollback()
                 error = 'That username and/or email already exists.'
                 return render_template('register.html', form=form, error=error)
     return render_template('register.html', form=form, error=error)
@@ -81,5 +278,31 @@ def register():
 @users_blueprint.route('/users/')
 @login_required
 def all_users():
-    users = db.session.query(User).all()
-    return render_template('users.html', users=users)
+    prefix = request.args.get('q', '').strip()[:25]
+    page = with_counts(user_page(prefix, request.args.get('after')))
+    return stream_template(
+        'users.html',
+        users=page.items,
+        next_cursor=page.next_cursor,
+        prefix=prefix,
+        following_ids=User.following_ids(session['user_id']),
+        suggested=suggestions.suggested_users(session['user_id']),
+    )
+
+@users_blueprint.route('/users/<int:user_id>/')
+def profile(user_id):
+    user = find_profile(user_id)
+    return cacheable(render_template(
+        'profile.html',
+        user=user,
+        relationship=relationship(user_id),
+        tweets=tweets_fragment(user, request_cursor()),
+    ))
+
+@users_blueprint.route('/users/<int:user_id>/followers/')
+def followers(user_id):
+    return render_follows(user_id, followers=True)
+
+@users_blueprint.route('/users/<int:user_id>/following/')
+def following(user_id):
+    return render_follows(user_id, followers=False)
@@ -0,0 +1,149 @@
+import threading
+from contextlib import contextmanager
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from sqlalchemy import event
+
+from project import db
+
+
+class QueryCounter(object):
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context,
+                 executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    event.listen(db.engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', counter)
+
+
+@contextmanager
+def assert_max_queries(testcase, maximum):
+    with count_queries() as counter:
+        yield counter
+    testcase.assertLessEqual(
+        counter.count, maximum,
+        '{0} queries executed, expected at most {1}:\n{2}'.format(
+            counter.count, maximum, '\n'.join(counter.statements))
+    )
+
+
+class FakeRedis(object):
+    """The slice of the redis-py client API the app uses, kept in a dict."""
+
+    def __init__(self):
+        self.data = {}
+        self.pubsubs = []
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def mget(self, names):
+        return [self.data.get(name) for name in names]
+
+    def set(self, name, value, ex=None):
+        self.data[name] = value
+        return True
+
+    def delete(self, *names):
+        return len([self.data.pop(name) for name in names if name in self.data])
+
+    def expire(self, name, time):
+        return name in self.data
+
+    def sadd(self, name, *values):
+        members = self.data.setdefault(name, set())
+        added = set(values) - members
+        members.update(values)
+        return len(added)
+
+    def smembers(self, name):
+        return set(self.data.get(name, ()))
+
+    def scan_iter(self, match='*'):
+        prefix = match.rstrip('*')
+        return iter([name for name in list(self.data) if name.startswith(prefix)])
+
+    def publish(self, channel, message):
+        receivers = [p for p in self.pubsubs if channel in p.channels]
+        for pubsub in receivers:
+            pubsub.messages.put(dict(type='message', channel=channel,
+                                     data=message))
+        return len(receivers)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        pubsub = FakePubSub()
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+
+class FakePipeline(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def publish(self, channel, message):
+        self.commands.append((channel, message))
+
+    def execute(self):
+        return [self.client.publish(*command) for command in self.commands]
+
+
+class FakePubSub(object):
+    """Records the threads it is used from, and raises IOError from every
+    call once `broken` is set, like a connection redis dropped."""
+
+    def __init__(self):
+        self.channels = set()
+        self.messages = queue.Queue()
+        self.threads = set()
+        self.broken = False
+
+    def used(self):
+        self.threads.add(threading.current_thread().name)
+        if self.broken:
+            raise IOError('Connection closed by server.')
+
+    @property
+    def subscribed(self):
+        return bool(self.channels)
+
+    def subscribe(self, *channels):
+        self.used()
+        self.channels.update(channels)
+
+    def unsubscribe(self, *channels):
+        self.used()
+        self.channels.difference_update(channels)
+
+    def close(self):
+        self.channels = set()
+
+    def get_message(self, timeout=0):
+        self.used()
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
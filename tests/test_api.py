@@ -0,0 +1,175 @@
+import os
+import unittest
+import json
+
+from project import app, cache, db, bcrypt
+from project._config import BASE_DIR
+from project.models import User
+from helpers import assert_max_queries
+
+TEST_DB = 'test.db'
+
+class APITest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+
+    # teardown function
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def post(self, tweet):
+        return self.app.post('/api/v1/tweets', data=json.dumps(
+            dict(tweet=tweet)), content_type='application/json')
+
+    def get_json(self, url, **headers):
+        response = self.app.get(url, headers=headers)
+        return response, json.loads(response.data.decode('utf-8') or 'null')
+
+    # tests
+
+    def test_api_requires_login(self):
+        response, body = self.get_json('/api/v1/timeline')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(body['error'], 'You need to login first')
+
+    def test_post_and_read_timeline(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        response = self.post('Hello from the API')
+        self.assertEqual(response.status_code, 201)
+        response, body = self.get_json('/api/v1/timeline')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([t['tweet'] for t in body['tweets']],
+                         ['Hello from the API'])
+        self.assertEqual(body['tweets'][0]['name'], 'Michael')
+
+    def test_post_validates_tweet(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        response = self.post('hi')
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/api/v1/tweets',
+                                 data=dict(tweet='Hello from a form'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_timeline_returns_304_when_unchanged(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        self.post('First tweet here')
+        response, _ = self.get_json('/api/v1/timeline')
+        etag = response.headers['ETag']
+        with assert_max_queries(self, 1) as queries:
+            response = self.app.get('/api/v1/timeline',
+                                    headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in queries.statements if 'tweets' in q])
+        self.assertEqual(response.data, b'')
+        self.post('Second tweet here')
+        response = self.app.get('/api/v1/timeline',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_since_id_returns_only_newer_tweets(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        first = json.loads(self.post('First tweet here').data.decode('utf-8'))
+        self.post('Second tweet here')
+        self.post('Third tweet here')
+        _, body = self.get_json(
+            '/api/v1/timeline?since_id={0}'.format(first['tweet_id']))
+        self.assertEqual([t['tweet'] for t in body['tweets']],
+                         ['Third tweet here', 'Second tweet here'])
+        newest = body['tweets'][0]['tweet_id']
+        _, body = self.get_json(
+            '/api/v1/timeline?since_id={0}'.format(newest))
+        self.assertEqual(body['tweets'], [])
+
+    def test_bad_cursor_is_rejected(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        response, body = self.get_json('/api/v1/timeline?before=nonsense')
+        self.assertEqual(response.status_code, 400)
+
+    def test_users_etag_tracks_follow_graph(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        self.login('Michael', 'python')
+        response, body = self.get_json('/api/v1/users')
+        self.assertEqual([u['following'] for u in body['users']],
+                         [False, False])
+        etag = response.headers['ETag']
+        response = self.app.get('/api/v1/users',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = self.app.put('/api/v1/following/2')
+        self.assertEqual(response.status_code, 200)
+        response, body = self.get_json('/api/v1/users', **{
+            'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([u['following'] for u in body['users']],
+                         [True, False])
+
+    def test_follow_and_unfollow(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        self.login('Fletcher', 'python101')
+        self.post('Tweet from Fletcher')
+        self.app.get('logout/')
+        self.login('Michael', 'python')
+        self.assertEqual(self.app.put('/api/v1/following/2').status_code, 200)
+        self.assertEqual(self.app.put('/api/v1/following/2').status_code, 409)
+        self.assertEqual(self.app.put('/api/v1/following/1').status_code, 400)
+        self.assertEqual(self.app.put('/api/v1/following/9').status_code, 404)
+        _, body = self.get_json('/api/v1/timeline')
+        self.assertEqual([t['tweet'] for t in body['tweets']],
+                         ['Tweet from Fletcher'])
+        self.assertEqual(
+            self.app.delete('/api/v1/following/2').status_code, 200)
+        self.assertEqual(
+            self.app.delete('/api/v1/following/2').status_code, 409)
+        _, body = self.get_json('/api/v1/timeline')
+        self.assertEqual(body['tweets'], [])
+
+    def test_delete_tweet(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        self.login('Michael', 'python')
+        tweet = json.loads(self.post('Tweet to delete').data.decode('utf-8'))
+        url = '/api/v1/tweets/{0}'.format(tweet['tweet_id'])
+        self.app.get('logout/')
+        self.login('Fletcher', 'python101')
+        self.assertEqual(self.app.delete(url).status_code, 403)
+        self.app.get('logout/')
+        self.login('Michael', 'python')
+        self.assertEqual(self.app.delete(url).status_code, 204)
+        self.assertEqual(self.app.delete(url).status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from project import app, assets
+from project.assets import MANIFEST, build
+
+
+def gunzip(content):
+    return gzip.GzipFile(fileobj=io.BytesIO(content)).read()
+
+
+class AssetsTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['DEBUG'] = False
+        self.assets_dir = app.config['ASSETS_DIR']
+        self.build_dir = tempfile.mkdtemp()
+        app.config['ASSETS_DIR'] = self.build_dir
+        self.manifest = assets.build()
+        self.app = app.test_client()
+
+    # teardown function
+    def tearDown(self):
+        app.config['ASSETS_DIR'] = self.assets_dir
+        assets.load()
+        shutil.rmtree(self.build_dir)
+
+    # helper functions
+
+    def read(self, name):
+        with open(os.path.join(self.build_dir, name), 'rb') as stream:
+            return stream.read()
+
+    # tests
+
+    def test_build_fingerprints_every_static_file(self):
+        hashed = self.manifest['css/main.css']
+        self.assertRegexpMatches(hashed, r'^css/main\.[0-9a-f]{12}\.css$')
+        self.assertIn('fonts/glyphicons-halflings-regular.woff2', self.manifest)
+        with open(os.path.join(self.build_dir, MANIFEST)) as stream:
+            self.assertEqual(json.load(stream), self.manifest)
+        again = tempfile.mkdtemp()
+        try:
+            self.assertEqual(build(app.static_folder, again), self.manifest)
+        finally:
+            shutil.rmtree(again)
+
+    def test_stylesheets_point_at_fingerprinted_fonts(self):
+        css = self.read(self.manifest['css/bootstrap.min.css']).decode('utf-8')
+        eot = self.manifest['fonts/glyphicons-halflings-regular.eot']
+        self.assertIn('url(../{0})'.format(eot), css)
+        self.assertIn('url(../{0}?#iefix)'.format(eot), css)
+        self.assertNotIn('url(../fonts/glyphicons-halflings-regular.eot)', css)
+
+    def test_compressible_files_get_a_gzip_copy(self):
+        js = self.manifest['js/main.js']
+        self.assertEqual(gunzip(self.read(js + '.gz')), self.read(js))
+        woff2 = self.manifest['fonts/glyphicons-halflings-regular.woff2']
+        self.assertFalse(os.path.exists(
+            os.path.join(self.build_dir, woff2 + '.gz')))
+
+    def test_assets_are_served_compressed_and_immutable(self):
+        url = '/assets/' + self.manifest['css/bootstrap.min.css']
+        plain = self.app.get(url)
+        self.assertEqual(plain.status_code, 200)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.mimetype, 'text/css')
+        self.assertIn('immutable', plain.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', plain.headers['Cache-Control'])
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+        compressed = self.app.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed.mimetype, 'text/css')
+        self.assertEqual(gunzip(compressed.data), plain.data)
+
+    def test_only_built_assets_are_served(self):
+        hashed = self.manifest['js/main.js']
+        self.assertEqual(self.app.get('/assets/' + hashed + '.gz').status_code,
+                         404)
+        self.assertEqual(self.app.get('/assets/js/main.js').status_code, 404)
+        self.assertEqual(
+            self.app.get('/assets/../_config.py').status_code, 404)
+
+    def test_pages_link_fingerprinted_assets(self):
+        response = self.app.get('/')
+        self.assertIn('/assets/{0}'.format(
+            self.manifest['js/main.js']).encode('utf-8'), response.data)
+        app.config['ASSETS_DIR'] = os.path.join(self.build_dir, 'missing')
+        assets.load()
+        response = self.app.get('/')
+        self.assertIn(b'/static/js/main.js', response.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
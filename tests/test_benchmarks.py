@@ -0,0 +1,53 @@
+import os
+import unittest
+
+from project import app, cache, db
+from project._config import BASE_DIR
+from project.models import Follower, TimelineEntry, Tweet, User
+from benchmarks.seed import PASSWORD, seed, user_name
+
+TEST_DB = 'test.db'
+
+class SeedTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+        self.app = app.test_client()
+        cache.clear()
+
+    # teardown function
+    def tearDown(self):
+        app.config['BCRYPT_LOG_ROUNDS'] = 12
+        db.session.remove()
+        db.drop_all()
+
+    # tests
+
+    def test_seeded_graph_is_skewed_and_usable(self):
+        summary = seed(users=200, tweets=1000, follows_per_user=10)
+        self.assertEqual(db.session.query(User).count(), 200)
+        self.assertEqual(db.session.query(Tweet).count(), 1000)
+        self.assertEqual(db.session.query(Follower).count(), summary['follows'])
+        counts = sorted(
+            (count for _, count in db.session.query(
+                Follower.whom_id, db.func.count()).group_by(Follower.whom_id)),
+            reverse=True)
+        self.assertGreater(counts[0], 5 * counts[len(counts) // 2])
+        self.assertGreater(db.session.query(TimelineEntry).count(), 1000)
+        response = self.app.post('/', data=dict(
+            name=user_name(1), password=PASSWORD), follow_redirects=True)
+        self.assertIn(b'Welcome', response.data)
+        self.assertIn(b'class="media"', response.data)
+        response = self.app.get('/search/?q=hello')
+        self.assertIn(b'hello', response.data)
+        self.assertIn(b'More results', response.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,223 @@
+import os
+import shutil
+import tempfile
+import unittest
+import json
+
+from project import actions, app, cache, db, bcrypt, bulk, search, timelines
+from project._config import BASE_DIR
+from project.models import User, Tweet, Follower
+
+TEST_DB = 'test.db'
+
+class BatchFollowTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+
+    # teardown function
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def create_users(self, count):
+        for i in range(count):
+            db.session.add(User(
+                'user{0:02d}'.format(i), 'user{0}@example.com'.format(i), 'x'))
+            db.session.flush()
+            db.session.add(Tweet('tweet from user{0:02d}'.format(i),
+                                 db.func.now(), i + 2))
+        db.session.commit()
+
+    def batch(self, method, ids):
+        response = getattr(self.app, method)(
+            '/api/v1/following', data=json.dumps(dict(ids=ids)),
+            content_type='application/json')
+        return response, json.loads(response.data.decode('utf-8'))
+
+    def counts(self, user_id):
+        db.session.expire_all()
+        user = db.session.query(User).get(user_id)
+        return (user.followers_count, user.following_count)
+
+    # tests
+
+    def test_follow_many_in_one_request(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_users(3)
+        self.login('Michael', 'python')
+        self.app.put('/api/v1/following/4')
+        response, body = self.batch('post', [2, 3, 4, 3, 1, 99])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, dict(
+            followed=[2, 3], already_following=[4], not_found=[99]))
+        self.assertEqual(self.counts(1), (0, 3))
+        self.assertEqual(self.counts(2), (1, 0))
+        page = timelines.home_timeline(1)
+        self.assertEqual(len(page.items), 3)
+        _, body = self.batch('post', [2, 3])
+        self.assertEqual(body['followed'], [])
+
+    def test_unfollow_many_in_one_request(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_users(3)
+        self.login('Michael', 'python')
+        self.batch('post', [2, 3, 4])
+        response, body = self.batch('delete', [2, 3, 99])
+        self.assertEqual(body, dict(unfollowed=[2, 3], not_following=[99]))
+        self.assertEqual(self.counts(1), (0, 1))
+        self.assertEqual(self.counts(3), (0, 0))
+        body = json.loads(self.app.get('/api/v1/timeline').data.decode(
+            'utf-8'))
+        self.assertEqual([t['tweet'] for t in body['tweets']],
+                         ['tweet from user02'])
+
+    def test_concurrent_follows_are_not_counted_twice(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_users(3)
+        self.login('Michael', 'python')
+        self.app.put('/api/v1/following/3')
+        self.app.delete('/api/v1/following/4')
+        # as if the follow of 3 committed after the batch looked for it
+        following_among = actions.following_among
+        actions.following_among = lambda who_id, whom_ids: set()
+        try:
+            response, body = self.batch('post', [2, 3, 4])
+        finally:
+            actions.following_among = following_among
+        self.assertEqual(body['followed'], [2, 4])
+        self.assertEqual(body['already_following'], [3])
+        self.assertEqual(self.counts(1), (0, 3))
+        self.assertEqual(self.counts(3), (1, 0))
+        # and the unfollow of 4 after the batch found it
+        db.session.query(Follower).filter_by(who_id=1, whom_id=4).delete()
+        db.session.commit()
+        actions.following_among = lambda who_id, whom_ids: set(whom_ids)
+        try:
+            response, body = self.batch('delete', [2, 4])
+        finally:
+            actions.following_among = following_among
+        self.assertEqual(body['unfollowed'], [2])
+        self.assertEqual(self.counts(1), (0, 2))
+        self.assertEqual(self.counts(2), (0, 0))
+        self.assertEqual(self.counts(4), (1, 0))
+
+    def test_batches_are_validated(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        response, _ = self.batch('post', ['2'])
+        self.assertEqual(response.status_code, 400)
+        app.config['BATCH_FOLLOW_LIMIT'] = 2
+        try:
+            response, body = self.batch('post', [2, 3, 4])
+        finally:
+            app.config['BATCH_FOLLOW_LIMIT'] = 500
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('at most 2', body['error'])
+
+
+class BulkImportTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        db.create_all()
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+
+    # teardown function
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def write(self, name, *lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as stream:
+            stream.write('\n'.join(lines) + '\n')
+        return path
+
+    def files(self):
+        return dict(
+            users=self.write('users.csv', 'id,name,email,password',
+                             '1,michael,michael@example.com,x',
+                             '2,fletcher,fletcher@example.com,x',
+                             '3,"quoted, name",quoted@example.com,x'),
+            tweets=self.write('tweets.csv', 'user_id,tweet,posted',
+                              '2,imported flask tweet,2016-07-07 10:00:00',
+                              '2,"second, with a comma",2016-07-07T11:00:00'),
+            follows=self.write('follows.csv', 'who_id,whom_id',
+                               '1,2', '3,2', '1,1', '1,2'),
+        )
+
+    # tests
+
+    def test_import_loads_and_rebuilds(self):
+        steps = bulk.import_files(chunk_size=2, **self.files())
+        self.assertEqual([(s.name, s.rows, s.inserted) for s in steps[:3]],
+                         [('users', 3, 3), ('tweets', 2, 2),
+                          ('follows', 3, 2)])
+        fletcher = db.session.query(User).get(2)
+        self.assertEqual((fletcher.followers_count, fletcher.tweets_count),
+                         (2, 2))
+        self.assertEqual(len(timelines.home_timeline(1).items), 2)
+        self.assertEqual(len(search.search_tweets('flask').items), 1)
+
+    def test_import_skips_rows_already_present(self):
+        bulk.import_files(**self.files())
+        steps = bulk.import_files(rebuild=False, **self.files())
+        self.assertEqual([s.inserted for s in steps], [0, 2, 0])
+        self.assertEqual(db.session.query(Follower).count(), 2)
+
+    def test_empty_ids_are_assigned_by_the_database(self):
+        users = self.write('users.csv', 'id,name,email,password',
+                           '5,michael,michael@example.com,x',
+                           ',fletcher,fletcher@example.com,x',
+                           '7,rachel,rachel@example.com,x',
+                           ',monica,monica@example.com,x')
+        steps = bulk.import_files(chunk_size=3, rebuild=False, users=users)
+        self.assertEqual([(s.rows, s.inserted) for s in steps], [(4, 4)])
+        ids = dict(db.session.query(User.name, User.id))
+        self.assertEqual((ids['michael'], ids['rachel']), (5, 7))
+        self.assertEqual(len(set(ids.values())), 4)
+
+    def test_command_reports_throughput(self):
+        files = self.files()
+        result = app.test_cli_runner().invoke(args=[
+            'bulk-import', '--users', files['users'],
+            '--follows', files['follows']])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Loaded 3 users, 3 new', result.output)
+        self.assertIn('rows/s', result.output)
+        self.assertIn('Rebuilt 3 timelines', result.output)
+
+
+if __name__ == "__main__":
+    unittest.main()
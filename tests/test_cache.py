@@ -0,0 +1,84 @@
+import unittest
+from datetime import datetime, timedelta
+from freezegun import freeze_time
+
+from project.cache import (Cache, LocalCache, NullCache, RedisCache,
+    make_backend)
+from helpers import FakeRedis
+
+
+class CacheTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.backend = LocalCache(max_entries=3)
+
+    # tests
+
+    def test_cache_counts_hits_and_misses(self):
+        self.assertIsNone(self.cache.get('foo'))
+        self.cache.set('foo', 'bar')
+        self.assertEqual(self.cache.get('foo'), 'bar')
+        self.assertEqual(self.cache.get_many(['foo', 'baz']), ['bar', None])
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 2})
+
+    def test_get_or_set_only_loads_on_a_miss(self):
+        calls = []
+        load = lambda: calls.append(1) or 'value'
+        self.assertEqual(self.cache.get_or_set('foo', load), 'value')
+        self.assertEqual(self.cache.get_or_set('foo', load), 'value')
+        self.assertEqual(len(calls), 1)
+
+    def test_local_cache_evicts_least_recently_used_entries(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, key)
+        self.cache.get('a')
+        self.cache.set('d', 'd')
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c', 'd']),
+                         ['a', None, 'c', 'd'])
+
+    def test_local_cache_entries_expire(self):
+        now = datetime(2016, 7, 7)
+        with freeze_time(now):
+            self.cache.set('foo', 'bar', timeout=60)
+        with freeze_time(now + timedelta(seconds=59)):
+            self.assertEqual(self.cache.get('foo'), 'bar')
+        with freeze_time(now + timedelta(seconds=61)):
+            self.assertIsNone(self.cache.get('foo'))
+
+    def test_delete_and_clear(self):
+        self.cache.set('foo', 'bar')
+        self.cache.set('baz', 'qux')
+        self.cache.delete('foo')
+        self.assertIsNone(self.cache.get('foo'))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('baz'))
+
+    def test_redis_cache_round_trips_values_under_its_prefix(self):
+        client = FakeRedis()
+        client.set('other:key', b'untouched')
+        self.cache.backend = RedisCache(client, 'tweepy:')
+        self.cache.set('foo', frozenset([1, 2]))
+        self.assertEqual(self.cache.get('foo'), frozenset([1, 2]))
+        self.assertIn('tweepy:foo', client.data)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('foo'))
+        self.assertEqual(client.get('other:key'), b'untouched')
+
+    def test_local_cache_is_refused_with_several_workers(self):
+        config = dict(CACHE_TYPE='local', CACHE_MAX_ENTRIES=10,
+                      WEB_CONCURRENCY=1)
+        self.assertIsInstance(make_backend(config), LocalCache)
+        config['WEB_CONCURRENCY'] = 4
+        with self.assertRaises(ValueError):
+            make_backend(config)
+
+    def test_null_cache_never_hits(self):
+        self.cache.backend = NullCache()
+        self.cache.set('foo', 'bar')
+        self.assertIsNone(self.cache.get('foo'))
+
+
+if __name__ == "__main__":
+    unittest.main()
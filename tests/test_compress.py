@@ -0,0 +1,115 @@
+import gzip
+import io
+import os
+import json
+import unittest
+from datetime import datetime, timedelta
+
+from project import app, cache, db, bcrypt, timelines
+from project._config import BASE_DIR
+from project.models import User, Tweet
+
+TEST_DB = 'test.db'
+
+
+def gunzip(content):
+    return gzip.GzipFile(fileobj=io.BytesIO(content)).read()
+
+
+class CompressTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+
+    # teardown function
+    def tearDown(self):
+        app.config['STREAM_TEMPLATES'] = True
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def seed_tweets(self, count, user_id=1):
+        start = datetime(2016, 7, 7)
+        for i in range(count):
+            db.session.add(Tweet(
+                'seeded tweet {0:03d}'.format(i),
+                start + timedelta(minutes=i),
+                user_id
+            ))
+        db.session.commit()
+        timelines.rebuild(user_id)
+        db.session.commit()
+
+    def get(self, url, **headers):
+        response = self.app.get(url, headers=headers)
+        data = response.data
+        response.close()
+        return response, data
+
+    # tests
+
+    def test_streamed_pages_are_gzipped_on_request(self):
+        self.seed_tweets(20)
+        _, plain = self.get('/tweets/')
+        response, data = self.get('/tweets/', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gunzip(data), plain)
+        self.assertLess(len(data), len(plain) // 3)
+
+    def test_buffered_pages_are_gzipped_on_request(self):
+        app.config['STREAM_TEMPLATES'] = False
+        _, plain = self.get('/tweets/')
+        response, data = self.get('/tweets/', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response.headers['Content-Length']), len(data))
+        self.assertEqual(gunzip(data), plain)
+
+    def test_small_responses_are_sent_as_they_are(self):
+        response, data = self.get('/tweets/json/',
+                                  **{'Accept-Encoding': 'gzip'})
+        self.assertLess(len(data), app.config['COMPRESS_MIN_SIZE'])
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(json.loads(data.decode('utf-8'))['tweets'], [])
+
+    def test_compressed_etags_are_weak_and_still_match(self):
+        self.seed_tweets(20)
+        response, data = self.get('/api/v1/timeline',
+                                  **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        response = self.app.get('/api/v1/timeline', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
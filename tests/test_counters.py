@@ -0,0 +1,122 @@
+import os
+import unittest
+
+from project import app, cache, db, counters
+from project._config import BASE_DIR
+from project.models import User, Tweet, Follower, TimelineEntry
+from helpers import assert_max_queries
+
+TEST_DB = 'test.db'
+
+class CountersTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+
+    # teardown function
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def register(self, name, email, password, confirm):
+        return self.app.post('register/', data=dict(
+            name=name, email=email, password=password, confirm=confirm
+        ), follow_redirects=True)
+
+    def logout(self):
+        return self.app.get('logout/', follow_redirects=True)
+
+    def create_tweet(self, tweet):
+        return self.app.post('tweets/post/', data=dict(
+            tweet=tweet
+        ), follow_redirects=True)
+
+    def counts(self, user_id):
+        db.session.expire_all()
+        user = db.session.query(User).get(user_id)
+        return (user.followers_count, user.following_count, user.tweets_count)
+
+    # tests
+
+    def test_writes_keep_counters_in_step(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.register('barfoo', 'barfoo@example.com', 'foobar', 'foobar')
+        self.login('foobar', 'barfoo')
+        self.create_tweet('first tweet from foobar')
+        self.create_tweet('second tweet from foobar')
+        self.app.get('tweets/follow/2/')
+        self.app.get('tweets/follow/2/')
+        self.assertEqual(self.counts(1), (0, 1, 2))
+        self.assertEqual(self.counts(2), (1, 0, 0))
+        self.app.get('tweets/delete/1/')
+        self.app.get('tweets/delete/1/')
+        self.app.get('tweets/unfollow/2/')
+        self.app.get('tweets/unfollow/2/')
+        self.assertEqual(self.counts(1), (0, 0, 1))
+        self.assertEqual(self.counts(2), (0, 0, 0))
+
+    def test_reconcile_repairs_drift(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.register('barfoo', 'barfoo@example.com', 'foobar', 'foobar')
+        db.session.add(Follower(2, 1))
+        db.session.add(Tweet('written around the app', db.func.now(), 2))
+        db.session.commit()
+        self.assertEqual(self.counts(2), (0, 0, 0))
+        self.assertEqual(counters.reconcile(batch=1), 2)
+        self.assertEqual(self.counts(1), (1, 0, 0))
+        self.assertEqual(self.counts(2), (0, 1, 1))
+        self.assertEqual(counters.reconcile(), 0)
+
+    def test_reconcile_fans_out_accounts_it_brings_under_the_limit(self):
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        try:
+            self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+            self.register('barfoo', 'barfoo@example.com', 'foobar', 'foobar')
+            self.register('bazbaz', 'bazbaz@example.com', 'foobar', 'foobar')
+            for name, password in (('foobar', 'barfoo'), ('bazbaz', 'foobar')):
+                self.login(name, password)
+                self.app.get('tweets/follow/2/')
+                self.logout()
+            self.login('barfoo', 'foobar')
+            self.create_tweet('test tweet while exempt')
+            db.session.query(Follower).filter_by(who_id=3).delete()
+            db.session.commit()
+            self.assertEqual(db.session.query(TimelineEntry).filter_by(
+                user_id=1).count(), 0)
+            counters.reconcile()
+            self.assertEqual(db.session.query(TimelineEntry.tweet_id).filter_by(
+                user_id=1).all(), [(1,)])
+        finally:
+            app.config['TIMELINE_FANOUT_LIMIT'] = 10000
+
+    def test_users_page_shows_counters_without_counting(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.register('barfoo', 'barfoo@example.com', 'foobar', 'foobar')
+        self.login('foobar', 'barfoo')
+        self.create_tweet('first tweet from foobar')
+        self.app.get('tweets/follow/2/')
+        with assert_max_queries(self, 3) as queries:
+            response = self.app.get('users/')
+        self.assertNotIn('count(', ' '.join(queries.statements).lower())
+        self.assertIn(b'1 tweets &middot; 1 following &middot; 0 followers',
+                      response.data)
+        self.assertIn(b'0 tweets &middot; 0 following &middot; 1 followers',
+                      response.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
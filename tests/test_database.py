@@ -0,0 +1,34 @@
+import os
+import unittest
+
+from sqlalchemy import create_engine
+
+import project  # registers the sqlite pragmas
+from project._config import BASE_DIR
+
+TEST_DB = 'database_test.db'
+
+class DatabaseTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        self.path = os.path.join(BASE_DIR, TEST_DB)
+        self.engine = create_engine('sqlite:///' + self.path)
+
+    # teardown function
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    # tests
+
+    def test_sqlite_connections_run_in_wal_mode(self):
+        self.assertEqual(
+            self.engine.execute('PRAGMA journal_mode').scalar(), 'wal')
+        # 1 is NORMAL
+        self.assertEqual(
+            self.engine.execute('PRAGMA synchronous').scalar(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import os
+import unittest
+import json
+from datetime import datetime, timedelta
+
+from freezegun import freeze_time
+
+from project import app, cache, db, bcrypt, jobs, timelines
+from project._config import BASE_DIR
+from project.models import User, Job
+
+TEST_DB = 'test.db'
+
+FAILURES = []
+
+
+@jobs.handler('flaky')
+def flaky(times):
+    if len(FAILURES) < times:
+        FAILURES.append(times)
+        raise RuntimeError('not yet')
+
+
+class JobsTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        app.config['JOBS_EAGER'] = False
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+        del FAILURES[:]
+
+    # teardown function
+    def tearDown(self):
+        app.config['JOBS_EAGER'] = True
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def post(self, tweet):
+        return self.app.post('/api/v1/tweets', data=json.dumps(
+            dict(tweet=tweet)), content_type='application/json')
+
+    def timeline(self, user_id):
+        return [t.tweet for t in timelines.home_timeline(user_id).items]
+
+    def queued(self):
+        db.session.expire_all()
+        return db.session.query(Job).order_by(Job.id).all()
+
+    # tests
+
+    def test_fan_out_runs_after_the_post(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        self.login('Fletcher', 'python101')
+        self.app.put('/api/v1/following/1')
+        self.app.get('logout/')
+        self.login('Michael', 'python')
+        self.post('Hello followers')
+        self.assertEqual(self.timeline(1), ['Hello followers'])
+        self.assertEqual(self.timeline(2), [])
+        self.assertEqual([j.kind for j in self.queued()],
+                         ['backfill', 'fan-out'])
+        self.assertEqual(jobs.work('test'), 2)
+        self.assertEqual(self.timeline(2), ['Hello followers'])
+        self.assertEqual(self.queued(), [])
+
+    def test_handlers_recheck_the_follow_graph(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        self.login('Fletcher', 'python101')
+        self.post('Tweet from Fletcher')
+        jobs.work('test')
+        self.app.get('logout/')
+        self.login('Michael', 'python')
+        self.app.put('/api/v1/following/2')
+        self.app.delete('/api/v1/following/2')
+        self.app.put('/api/v1/following/2')
+        jobs.work('test')
+        self.assertEqual(self.timeline(1), ['Tweet from Fletcher'])
+        self.app.delete('/api/v1/following/2')
+        jobs.enqueue('backfill', who_id=1, whom_ids=[2])
+        db.session.commit()
+        jobs.work('test')
+        self.assertEqual(self.timeline(1), [])
+
+    def test_failed_jobs_back_off_then_give_up(self):
+        app.config['JOBS_MAX_ATTEMPTS'] = 2
+        now = datetime(2016, 7, 7, 12)
+        try:
+            with freeze_time(now):
+                jobs.enqueue('flaky', times=5)
+                db.session.commit()
+                self.assertEqual(jobs.work('test'), 1)
+                job, = self.queued()
+                self.assertEqual(job.attempts, 1)
+                self.assertEqual(job.run_at, now + timedelta(seconds=2))
+                self.assertIn('not yet', job.last_error)
+                self.assertEqual(jobs.work('test'), 0)
+            with freeze_time(now + timedelta(seconds=2)):
+                self.assertEqual(jobs.work('test'), 1)
+                job, = self.queued()
+                self.assertIsNone(job.run_at)
+            with freeze_time(now + timedelta(days=1)):
+                self.assertEqual(jobs.work('test'), 0)
+                self.assertEqual(jobs.requeue_failed(), 1)
+                self.assertEqual(jobs.work('test'), 1)
+        finally:
+            app.config['JOBS_MAX_ATTEMPTS'] = 5
+
+    def test_jobs_of_a_dead_worker_run_after_the_lease(self):
+        now = datetime(2016, 7, 7, 12)
+        with freeze_time(now):
+            jobs.enqueue('flaky', times=0)
+            db.session.commit()
+            self.assertEqual(len(jobs.claim('dead', 10)), 1)
+            self.assertEqual(jobs.work('test'), 0)
+        with freeze_time(now + timedelta(seconds=301)):
+            self.assertEqual(jobs.work('test'), 1)
+        self.assertEqual(self.queued(), [])
+
+    def test_worker_command_drains_the_queue(self):
+        jobs.enqueue('flaky', times=0)
+        jobs.enqueue('flaky', times=0)
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=['run-worker', '--burst'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Ran 2 jobs.', result.output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from project import app, error_log
+from project.logs import (Aggregator, BatchFileHandler, JSONFormatter,
+    QueueHandler)
+
+
+class ListTarget(object):
+
+    def __init__(self):
+        self.records = []
+
+    def write_batch(self, records):
+        self.records.extend(records)
+
+    def close(self):
+        pass
+
+
+class LogsTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['DEBUG'] = False
+        self.app = app.test_client()
+        self.dir = tempfile.mkdtemp()
+
+    # teardown function
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    # helper functions
+
+    def record(self, created=1000.0, **extra):
+        record = logging.makeLogRecord(dict(
+            name='tweepy.errors', levelname='WARNING', levelno=30,
+            msg='404 error', created=created, **extra))
+        return record
+
+    # tests
+
+    def test_records_are_formatted_as_json(self):
+        line = JSONFormatter().format(self.record(
+            request_id='abc', status=404, path='/x', latency_ms=1.5))
+        data = json.loads(line)
+        self.assertEqual(data['message'], '404 error')
+        self.assertEqual(data['request_id'], 'abc')
+        self.assertEqual(data['status'], 404)
+        self.assertEqual(data['latency_ms'], 1.5)
+
+    def test_repeats_within_the_window_are_counted(self):
+        aggregator = Aggregator(window=60)
+        key = (404, '/wp-admin')
+        self.assertTrue(aggregator.filter(self.record(1000, aggregate_key=key)))
+        for created in range(1001, 1011):
+            self.assertFalse(
+                aggregator.filter(self.record(created, aggregate_key=key)))
+        self.assertTrue(aggregator.filter(
+            self.record(1000, aggregate_key=(404, '/other'))))
+        record = self.record(1061, aggregate_key=key)
+        self.assertTrue(aggregator.filter(record))
+        self.assertEqual(record.suppressed, 10)
+
+    def test_drain_reports_windows_that_ended(self):
+        aggregator = Aggregator(window=60)
+        key = (404, '/wp-admin')
+        for created in range(1000, 1005):
+            aggregator.filter(self.record(created, aggregate_key=key))
+        self.assertEqual(aggregator.drain(1030), [])
+        summaries = aggregator.drain(1061)
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual(summaries[0].suppressed, 4)
+        self.assertIn('suppressed 4 repeats', summaries[0].getMessage())
+        self.assertEqual(aggregator.drain(1200), [])
+
+    def test_full_queue_drops_records_instead_of_blocking(self):
+        handler = QueueHandler(ListTarget(), capacity=2, batch_size=10,
+                               flush_interval=0.01)
+        handler._pid = os.getpid()
+        for _ in range(5):
+            handler.handle(self.record())
+        self.assertEqual(handler.dropped, 3)
+        handler.write_pending()
+        self.assertEqual(len(handler.target.records), 2)
+
+    def test_batches_are_written_to_rotating_files(self):
+        path = os.path.join(self.dir, 'error.log')
+        target = BatchFileHandler(path, maxBytes=300, backupCount=2, delay=True)
+        target.setFormatter(JSONFormatter())
+        target.write_batch([self.record() for _ in range(10)])
+        target.close()
+        self.assertTrue(os.path.exists(path + '.1'))
+        with open(path) as f:
+            for line in f:
+                self.assertEqual(json.loads(line)['message'], '404 error')
+
+    def test_404s_are_logged_with_the_request_id(self):
+        handler = error_log.handlers[0]
+        path = '/missing-{0}'.format(uuid.uuid4().hex)
+        response = self.app.get(path)
+        self.app.get(path)
+        handler.flush()
+        with open(handler.target.baseFilename) as f:
+            lines = [json.loads(line) for line in f if path in line]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]['request_id'],
+                         response.headers['X-Request-ID'])
+        self.assertEqual(lines[0]['status'], 404)
+        self.assertIn('latency_ms', lines[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
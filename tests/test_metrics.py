@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from project import app, bcrypt, cache, db
+from project._config import BASE_DIR
+from project.metrics import Counter, Histogram, Registry
+from project.models import User
+
+TEST_DB = 'test.db'
+
+class MetricsTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        self.profile_dir = tempfile.mkdtemp()
+        app.config['PROFILE_DIR'] = self.profile_dir
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+
+    # teardown function
+    def tearDown(self):
+        app.config['METRICS_TOKEN'] = None
+        app.config['PROFILE_SAMPLE_RATE'] = 0
+        shutil.rmtree(self.profile_dir)
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        db.session.add(User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password, 4)
+        ))
+        db.session.commit()
+
+    def scrape(self, **kwargs):
+        return self.app.get('metrics', **kwargs).data.decode('utf-8')
+
+    # tests
+
+    def test_histograms_and_counters_render_as_prometheus_text(self):
+        registry = Registry()
+        latency = registry.register(Histogram(
+            'latency_seconds', 'Latency.', ('endpoint',), buckets=(0.1, 1)))
+        hits = registry.register(Counter('hits_total', 'Hits.'))
+        latency.observe(0.05, 'tweets.tweet')
+        latency.observe(0.5, 'tweets.tweet')
+        hits.inc()
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE latency_seconds histogram', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="tweets.tweet",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="tweets.tweet",le="1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="tweets.tweet",le="+Inf"} 2', lines)
+        self.assertIn('latency_seconds_count{endpoint="tweets.tweet"} 2', lines)
+        self.assertIn('hits_total 1', lines)
+
+    def test_requests_are_measured_per_endpoint(self):
+        self.create_user('foobar', 'foobar@example.com', 'barfoo')
+        self.login('foobar', 'barfoo')
+        self.app.get('tweets/')
+        text = self.scrape()
+        self.assertIn('tweepy_request_duration_seconds_count{'
+                      'endpoint="tweets.tweet",method="GET",status="200"}', text)
+        self.assertIn('tweepy_request_sql_queries_count{endpoint="tweets.tweet"}', text)
+        self.assertIn('tweepy_request_sql_seconds_sum{endpoint="tweets.tweet"}', text)
+        self.assertIn('tweepy_request_template_seconds_sum{endpoint="tweets.tweet"}', text)
+        self.assertIn('tweepy_password_hash_seconds_count{operation="check"}', text)
+        self.assertIn('tweepy_cache_misses_total', text)
+
+    def test_metrics_token_is_required_once_set(self):
+        app.config['METRICS_TOKEN'] = 'secret'
+        response = self.app.get('metrics')
+        self.assertEqual(response.status_code, 403)
+        response = self.app.get('metrics', headers={
+            'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_sampled_requests_dump_profiles(self):
+        app.config['PROFILE_SAMPLE_RATE'] = 1
+        app.config['METRICS_TOKEN'] = 'secret'
+        headers = {'Authorization': 'Bearer secret'}
+        self.app.get('register/')
+        self.assertEqual(self.app.get('metrics/profiles/').status_code, 403)
+        listing = json.loads(self.app.get(
+            'metrics/profiles/', headers=headers).data.decode('utf-8'))
+        self.assertEqual(len(listing['profiles']), 1)
+        self.assertTrue(listing['profiles'][0]['name'].startswith('users.register-'))
+        response = self.app.get(listing['profiles'][0]['url'], headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(len(response.data) > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import datetime
+import os
+import unittest
+
+from sqlalchemy import create_engine, inspect
+
+from project import db
+from project._config import BASE_DIR
+from project.migrations import current_version, latest_version, upgrade
+
+TEST_DB = 'migrations_test.db'
+
+class MigrationsTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        self.path = os.path.join(BASE_DIR, TEST_DB)
+        self.engine = create_engine('sqlite:///' + self.path)
+
+    # teardown function
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    # helper functions
+
+    def indexes(self, table):
+        return set(i['name'] for i in inspect(self.engine).get_indexes(table))
+
+    # tests
+
+    def test_upgrade_brings_an_empty_database_to_the_latest_version(self):
+        self.assertEqual(current_version(self.engine), 0)
+        upgrade(self.engine)
+        self.assertEqual(current_version(self.engine), latest_version())
+
+    def test_upgrade_matches_the_models(self):
+        upgrade(self.engine)
+        created = create_engine('sqlite://')
+        db.metadata.create_all(created)
+        tables = set(inspect(self.engine).get_table_names())
+        self.assertEqual(tables - {'schema_version'},
+                         set(inspect(created).get_table_names()))
+        for table in db.metadata.tables.values():
+            self.assertEqual(
+                self.indexes(table.name),
+                set(i.name for i in table.indexes),
+            )
+
+    def test_upgrade_is_idempotent(self):
+        upgrade(self.engine)
+        self.assertEqual(upgrade(self.engine), [])
+
+    def test_upgrade_migrates_existing_data(self):
+        upgrade(self.engine, target=1)
+        posted = datetime.datetime(2016, 7, 7)
+        self.engine.execute(
+            "INSERT INTO users (id, name, email, password) VALUES "
+            "(1, 'foobar', 'foobar@example.com', 'x'), "
+            "(2, 'barfoo', 'barfoo@example.com', 'x')")
+        self.engine.execute(
+            "INSERT INTO tweets (user_id, tweet, posted) VALUES (?, ?, ?)",
+            [(1, 'from foobar', posted), (2, 'from barfoo', posted)])
+        self.engine.execute(
+            "INSERT INTO follower (who_id, whom_id) VALUES (1, 2), (1, 3)")
+        self.assertEqual(upgrade(self.engine), [2, 3, 4, 5, 6, 7, 8, 9])
+        timeline = self.engine.execute(
+            'SELECT user_id, tweet_id FROM timeline ORDER BY user_id, tweet_id')
+        self.assertEqual([tuple(row) for row in timeline],
+                         [(1, 1), (1, 2), (2, 2)])
+        follows = self.engine.execute('SELECT who_id, whom_id FROM follower')
+        self.assertEqual([tuple(row) for row in follows], [(1, 2)])
+        self.assertEqual(
+            len(inspect(self.engine).get_foreign_keys('follower')), 2)
+        self.assertIn('ix_follower_whom_id_who_id', self.indexes('follower'))
+        self.assertIn('ix_tweets_user_id_posted', self.indexes('tweets'))
+        found = self.engine.execute(
+            "SELECT rowid FROM tweets_fts WHERE tweets_fts MATCH 'foobar'")
+        self.assertEqual([tuple(row) for row in found], [(1,)])
+        counts = self.engine.execute(
+            'SELECT followers_count, following_count, tweets_count '
+            'FROM users ORDER BY id')
+        self.assertEqual([tuple(row) for row in counts], [(0, 1, 1), (1, 0, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
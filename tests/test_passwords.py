@@ -0,0 +1,113 @@
+import os
+import threading
+import unittest
+from collections import namedtuple
+
+from project import app, cache, db, passwords
+from project._config import BASE_DIR
+from project.models import User
+from project.passwords import HashingBusy, PasswordHasher
+
+TEST_DB = 'test.db'
+
+FakeApp = namedtuple('FakeApp', ['config'])
+
+class PasswordsTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+
+    # teardown function
+    def tearDown(self):
+        app.config['BCRYPT_LOG_ROUNDS'] = 12
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def register(self, name, email, password, confirm):
+        return self.app.post('register/', data=dict(
+            name=name, email=email, password=password, confirm=confirm
+        ), follow_redirects=True)
+
+    def stored_hash(self):
+        return db.session.query(User.password).filter_by(name='foobar').scalar()
+
+    # tests
+
+    def test_hash_and_check_round_trip(self):
+        pw_hash = passwords.hash('barfoo')
+        self.assertTrue(passwords.check(pw_hash, 'barfoo'))
+        self.assertFalse(passwords.check(pw_hash, 'foobar'))
+
+    def test_hashes_use_the_configured_cost(self):
+        pw_hash = passwords.hash('barfoo')
+        self.assertIn('$04$', str(pw_hash))
+        self.assertFalse(passwords.needs_rehash(pw_hash))
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        self.assertTrue(passwords.needs_rehash(pw_hash))
+
+    def test_login_rehashes_when_the_cost_changes(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.assertIn('$04$', self.stored_hash())
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        response = self.login('foobar', 'barfoo')
+        self.assertIn(b'Welcome', response.data)
+        db.session.remove()
+        self.assertIn('$05$', self.stored_hash())
+        self.app.get('logout/')
+        response = self.login('foobar', 'barfoo')
+        self.assertIn(b'Welcome', response.data)
+
+    def test_hashing_is_refused_when_the_pool_is_full(self):
+        started, release = threading.Event(), threading.Event()
+
+        class SlowBcrypt(object):
+            def generate_password_hash(self, password, rounds):
+                started.set()
+                release.wait(5)
+                return 'hash'
+
+        config = dict(app.config, PASSWORD_HASH_WORKERS=1,
+                      PASSWORD_HASH_QUEUE_SIZE=0)
+        hasher = PasswordHasher(SlowBcrypt(), FakeApp(config))
+        worker = threading.Thread(target=hasher.hash, args=('barfoo',))
+        worker.start()
+        started.wait(5)
+        try:
+            self.assertRaises(HashingBusy, hasher.hash, 'barfoo')
+        finally:
+            release.set()
+            worker.join()
+        self.assertEqual(hasher.hash('barfoo'), 'hash')
+
+    def test_busy_login_answers_503_with_retry_after(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        check = passwords.check
+        def busy(*args):
+            raise HashingBusy()
+        passwords.check = busy
+        try:
+            response = self.login('foobar', 'barfoo')
+        finally:
+            passwords.check = check
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertIn(b'please try again', response.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import unittest
+from datetime import datetime, timedelta
+
+from project import app, cache, db, bcrypt
+from project._config import BASE_DIR
+from project.models import User, Tweet, Follower
+from helpers import assert_max_queries
+
+TEST_DB = 'test.db'
+
+class ProfilesTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+
+    # teardown function
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def create_users(self, count):
+        for i in range(count):
+            db.session.add(User(
+                'user{0:02d}'.format(i), 'user{0}@example.com'.format(i), 'x'))
+        db.session.commit()
+
+    def seed_tweets(self, count, user_id=1):
+        start = datetime(2016, 7, 7)
+        for i in range(count):
+            db.session.add(Tweet(
+                'seeded tweet {0:03d}'.format(i),
+                start + timedelta(minutes=i),
+                user_id
+            ))
+        User.adjust_counts(user_id, tweets_count=count)
+        db.session.commit()
+
+    # tests
+
+    def test_profile_pages_tweet_history(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.seed_tweets(25)
+        response = self.app.get('/users/1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'25 tweets', response.data)
+        self.assertIn(b'seeded tweet 024', response.data)
+        self.assertIn(b'seeded tweet 005', response.data)
+        self.assertNotIn(b'seeded tweet 004', response.data)
+        start = response.data.index(b'/users/1/?before=')
+        end = response.data.index(b'"', start)
+        response = self.app.get(response.data[start:end].decode('ascii'))
+        self.assertIn(b'seeded tweet 004', response.data)
+        self.assertNotIn(b'seeded tweet 005', response.data)
+        self.assertEqual(self.app.get('/users/1/?before=x').status_code, 400)
+
+    def test_unknown_profile_is_not_found(self):
+        response = self.app.get('/users/9/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_anonymous_profiles_are_publicly_cacheable(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        response = self.app.get('/users/1/')
+        self.assertTrue(response.cache_control.public)
+        self.assertEqual(response.cache_control.max_age, 60)
+        self.assertIn('Cookie', response.headers['Vary'])
+        response = self.app.get('/users/1/', headers={
+            'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_logged_in_profiles_show_the_relationship(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        db.session.add(Follower(2, 1))
+        db.session.commit()
+        self.login('Michael', 'python')
+        response = self.app.get('/users/2/')
+        self.assertTrue(response.cache_control.private)
+        self.assertIn(b'Follows you', response.data)
+        self.assertIn(b'>Follow<', response.data)
+        response = self.app.get('/users/1/')
+        self.assertNotIn(b'Follows you', response.data)
+        self.assertNotIn(b'>Follow<', response.data)
+
+    def test_profile_query_count_is_bounded(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        self.seed_tweets(25, user_id=2)
+        self.login('Michael', 'python')
+        with assert_max_queries(self, 4):
+            self.app.get('/users/2/')
+        with assert_max_queries(self, 2):
+            response = self.app.get('/users/2/')
+        self.assertIn(b'seeded tweet 024', response.data)
+
+    def test_profile_cache_follows_new_tweets(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        self.app.get('/users/1/')
+        self.app.post('tweets/post/', data=dict(tweet='a brand new tweet'))
+        response = self.app.get('/users/1/')
+        self.assertIn(b'a brand new tweet', response.data)
+        self.assertIn(b'1 tweets', response.data)
+
+    def test_follower_lists_are_paged_by_id(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_users(25)
+        for who_id in range(2, 27):
+            db.session.add(Follower(who_id, 1))
+            db.session.add(Follower(1, who_id))
+        db.session.commit()
+        for url in ('/users/1/followers/', '/users/1/following/'):
+            response = self.app.get(url)
+            self.assertIn(b'user00', response.data)
+            self.assertIn(b'user19', response.data)
+            self.assertNotIn(b'user20', response.data)
+            response = self.app.get(url + '?after=21')
+            self.assertIn(b'user20', response.data)
+            self.assertIn(b'user24', response.data)
+            self.assertNotIn(b'user19', response.data)
+            self.assertNotIn(b'More', response.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
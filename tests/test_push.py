@@ -0,0 +1,183 @@
+import os
+import time
+import unittest
+import json
+
+from project import app, cache, db, bcrypt, push
+from project._config import BASE_DIR
+from project.models import User
+from project.push import GAP, LocalBroker, RedisBroker
+from helpers import FakeRedis
+
+TEST_DB = 'test.db'
+
+
+class BrokerTest(unittest.TestCase):
+
+    # helper functions
+
+    def wait_until(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                self.fail('timed out waiting for the push listener')
+            time.sleep(0.01)
+
+    # tests
+
+    def test_local_broker_delivers_once_per_subscription(self):
+        broker = LocalBroker(queue_size=10)
+        both = broker.subscribe(['user:1', 'author:2'])
+        other = broker.subscribe(['user:3'])
+        broker.publish(['user:1', 'author:2'], {'tweet_id': 1})
+        self.assertEqual(both.get(0), {'tweet_id': 1})
+        self.assertIsNone(both.get(0))
+        self.assertIsNone(other.get(0))
+        self.assertEqual(broker.delivered, 1)
+
+    def test_local_broker_drops_messages_for_slow_subscribers(self):
+        broker = LocalBroker(queue_size=2)
+        subscription = broker.subscribe(['user:1'])
+        for tweet_id in range(3):
+            broker.publish(['user:1'], {'tweet_id': tweet_id})
+        self.assertEqual(broker.dropped, 1)
+        self.assertEqual(subscription.get(0), {'tweet_id': 0})
+
+    def test_closed_subscriptions_stop_receiving(self):
+        broker = LocalBroker(queue_size=10)
+        subscription = broker.subscribe(['user:1'])
+        subscription.close()
+        broker.publish(['user:1'], {'tweet_id': 1})
+        self.assertIsNone(subscription.get(0))
+        self.assertEqual(broker.delivered, 0)
+
+    def test_redis_broker_relays_through_pubsub(self):
+        client = FakeRedis()
+        publisher = RedisBroker(client, 'push:', queue_size=10)
+        subscriber = RedisBroker(client, 'push:', queue_size=10)
+        subscription = subscriber.subscribe(['user:1'])
+        self.wait_until(lambda: client.pubsubs and
+                        client.pubsubs[0].channels == set(['push:user:1']))
+        publisher.publish(['user:1', 'user:2'], {'tweet_id': 1})
+        self.assertEqual(subscription.get(5), {'tweet_id': 1})
+        subscription.close()
+        self.wait_until(lambda: client.pubsubs[0].channels == set())
+        subscriber.stop()
+        # only the listener thread ever touches the pub/sub connection
+        self.assertEqual(client.pubsubs[0].threads,
+                         set(['tweepy-push-listener']))
+
+    def test_redis_broker_reconnects_and_resubscribes(self):
+        client = FakeRedis()
+        broker = RedisBroker(client, 'push:', queue_size=10)
+        broker.RECONNECT_DELAY = 0.01
+        subscription = broker.subscribe(['user:1'])
+        self.wait_until(lambda: client.pubsubs and
+                        client.pubsubs[0].subscribed)
+        client.pubsubs[0].broken = True
+        self.wait_until(lambda: len(client.pubsubs) == 2 and
+                        client.pubsubs[1].subscribed)
+        self.assertEqual(client.pubsubs[1].channels, set(['push:user:1']))
+        self.assertEqual(subscription.get(5), GAP)
+        broker.publish(['user:1'], {'tweet_id': 1})
+        self.assertEqual(subscription.get(5), {'tweet_id': 1})
+        subscription.close()
+        broker.stop()
+
+
+class StreamTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        app.config['PUSH_HEARTBEAT'] = 0.05
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+
+    # teardown function
+    def tearDown(self):
+        app.config['PUSH_HEARTBEAT'] = 15
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, client, name, password):
+        return client.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def post(self, client, tweet):
+        response = client.post('/api/v1/tweets', data=json.dumps(
+            dict(tweet=tweet)), content_type='application/json')
+        return json.loads(response.data.decode('utf-8'))
+
+    def next_event(self, events):
+        for chunk in events:
+            if not isinstance(chunk, str):
+                chunk = chunk.decode('utf-8')
+            if chunk.startswith('event:'):
+                return chunk
+
+    # tests
+
+    def test_stream_pushes_tweets_to_followers(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        self.login(self.app, 'Michael', 'python')
+        self.app.put('/api/v1/following/2')
+        response = self.app.get('/api/v1/stream', buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = iter(response.response)
+        self.assertEqual(next(events), b'retry: 5000\n\n')
+
+        fletcher = app.test_client()
+        self.login(fletcher, 'Fletcher', 'python101')
+        self.post(fletcher, 'Pushed to Michael')
+        event = self.next_event(events)
+        self.assertIn('event: tweet', event)
+        self.assertIn('"Pushed to Michael"', event)
+        response.close()
+
+    def test_stream_replays_tweets_after_last_event_id(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login(self.app, 'Michael', 'python')
+        first = self.post(self.app, 'First tweet here')
+        self.post(self.app, 'Second tweet here')
+        response = self.app.get('/api/v1/stream', buffered=False, headers={
+            'Last-Event-ID': str(first['tweet_id'])})
+        event = self.next_event(iter(response.response))
+        self.assertIn('"Second tweet here"', event)
+        response.close()
+
+    def test_stream_ends_when_the_broker_lost_messages(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login(self.app, 'Michael', 'python')
+        response = self.app.get('/api/v1/stream', buffered=False)
+        events = iter(response.response)
+        self.assertEqual(next(events), b'retry: 5000\n\n')
+        push.broker.deliver(['user:1'], GAP)
+        self.assertEqual([chunk for chunk in events
+                          if not chunk.startswith(b':')], [])
+        response.close()
+
+    def test_stream_requires_login(self):
+        response = self.app.get('/api/v1/stream')
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import os
+import json
+import unittest
+
+from project import app, cache, db, bcrypt, limiter
+from project._config import BASE_DIR
+from project.models import User, RateLimit
+from project.ratelimit import (LocalRateLimitStore, SQLRateLimitStore,
+    index_rules)
+
+TEST_DB = 'test.db'
+
+
+class StoreContract(object):
+    """Behaviour every rate limit store shares. Buckets here hold 3
+    tokens and refill one every 10 seconds."""
+
+    def hit(self, key, now):
+        return self.store.hit(key, 10.0, 30, now)
+
+    def test_burst_then_refusal(self):
+        self.assertEqual([self.hit('a', 1000) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(self.hit('a', 1000), 10)
+        self.assertAlmostEqual(self.hit('a', 1004), 6)
+        self.assertEqual(self.hit('b', 1004), 0)
+
+    def test_tokens_refill_over_time(self):
+        for _ in range(3):
+            self.hit('a', 1000)
+        self.assertEqual(self.hit('a', 1010), 0)
+        self.assertGreater(self.hit('a', 1010), 0)
+        self.assertEqual([self.hit('a', 1100) for _ in range(3)], [0, 0, 0])
+
+    def test_purge_drops_full_buckets(self):
+        self.hit('a', 1000)
+        self.hit('b', 1000)
+        self.hit('b', 1000)
+        self.assertEqual(self.store.purge(1015), 1)
+        self.assertEqual([self.hit('b', 1015) for _ in range(2)], [0, 0])
+        self.assertGreater(self.hit('b', 1015), 0)
+
+
+class LocalStoreTest(StoreContract, unittest.TestCase):
+
+    def setUp(self):
+        self.store = LocalRateLimitStore(max_entries=10)
+
+    def test_full_buckets_are_swept_as_the_store_grows(self):
+        store = LocalRateLimitStore(max_entries=2)
+        store.hit('a', 10.0, 30, 1000)
+        store.hit('b', 10.0, 30, 1000)
+        store.hit('c', 10.0, 30, 1020)
+        self.assertEqual(sorted(store._full_at), ['c'])
+
+
+class SQLStoreTest(StoreContract, unittest.TestCase):
+
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        db.create_all()
+        self.store = SQLRateLimitStore(db, RateLimit.__table__)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+
+class RulesTest(unittest.TestCase):
+
+    def test_endpoints_map_to_their_rules(self):
+        rules = index_rules({
+            'post': ('user', 2, 60, ('POST tweets.post_tweet',)),
+            'writes': ('ip', 6, 60, ('POST tweets.post_tweet',
+                                     'tweets.follow_user')),
+        })
+        self.assertEqual([r.name for r in rules[('POST', 'tweets.post_tweet')]],
+                         ['post', 'writes'])
+        self.assertEqual(rules['tweets.follow_user'][0].interval, 10.0)
+        self.assertNotIn('tweets.post_tweet', rules)
+
+    def test_unknown_scope_is_rejected(self):
+        with self.assertRaises(ValueError):
+            index_rules({'post': ('session', 2, 60, ('tweets.post_tweet',))})
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        self.limits = app.config['RATE_LIMITS']
+        app.config['RATELIMIT_ENABLED'] = True
+        app.config['RATE_LIMITS'] = {
+            'login': ('ip', 2, 60, ('POST users.login',)),
+            'post': ('user', 2, 60, ('POST tweets.post_tweet',
+                                     'api.post_tweet')),
+        }
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+        limiter.store.clear()
+
+    # teardown function
+    def tearDown(self):
+        app.config['RATELIMIT_ENABLED'] = False
+        app.config['RATE_LIMITS'] = self.limits
+        limiter.store.clear()
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def logout(self):
+        return self.app.get('logout/', follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def create_tweet(self, tweet):
+        return self.app.post('tweets/post/', data=dict(tweet=tweet))
+
+    # tests
+
+    def test_logins_are_limited_per_address(self):
+        self.assertEqual(self.app.post('/', data=dict(
+            name='nobody', password='nothing')).status_code, 200)
+        self.assertEqual(self.app.post('/', data=dict(
+            name='nobody', password='nothing')).status_code, 200)
+        response = self.app.post('/', data=dict(
+            name='nobody', password='nothing'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '30')
+        self.assertIn(b'try again in 30 seconds', response.data)
+        self.assertEqual(self.app.get('/').status_code, 200)
+        response = self.app.post('/', data=dict(
+            name='nobody', password='nothing'),
+            environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_posting_is_limited_per_user(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        self.login('Michael', 'python')
+        self.assertEqual(self.create_tweet('first tweet here').status_code, 302)
+        response = self.app.post('/api/v1/tweets', data=json.dumps(
+            dict(tweet='second tweet here')), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        response = self.create_tweet('third tweet here')
+        self.assertEqual(response.status_code, 429)
+        response = self.app.post('/api/v1/tweets', data=json.dumps(
+            dict(tweet='third tweet here')), content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(json.loads(response.data.decode('utf-8')),
+                         dict(error='Too many requests', retry_after=30))
+        self.assertEqual(response.headers['Retry-After'], '30')
+        self.assertEqual(db.session.query(User).get(1).tweets_count, 2)
+        self.logout()
+        self.login('Fletcher', 'python101')
+        self.assertEqual(self.create_tweet('first from fletcher').status_code,
+                         302)
+
+    def test_disabled_limiter_lets_everything_through(self):
+        app.config['RATELIMIT_ENABLED'] = False
+        for _ in range(4):
+            response = self.app.post('/', data=dict(
+                name='nobody', password='nothing'))
+            self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import json
+import unittest
+from datetime import datetime, timedelta
+from freezegun import freeze_time
+
+from project import app, cache, db, bcrypt
+from project._config import BASE_DIR
+from project.models import User, Tweet, Follower
+
+TEST_DB = 'test.db'
+REPLICA_DB = 'test-replica.db'
+
+
+class ReplicaTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        app.config['SQLALCHEMY_BINDS'] = {
+            'replica': 'sqlite:///' + os.path.join(BASE_DIR, REPLICA_DB)}
+        self.app = app.test_client()
+        db.create_all()
+        self.replica = db.get_engine(app, bind='replica')
+        db.metadata.create_all(self.replica)
+        cache.clear()
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        self.replicate()
+        self.login('Michael', 'python')
+
+    # teardown function
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.replica.dispose()
+        del app.config['SQLALCHEMY_BINDS']
+        os.remove(os.path.join(BASE_DIR, REPLICA_DB))
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def replicate(self):
+        """Brings the replica up to date with the primary."""
+        with self.replica.begin() as connection:
+            for table in reversed(db.metadata.sorted_tables):
+                connection.execute(table.delete())
+            for table in db.metadata.sorted_tables:
+                rows = [dict(row) for row in db.session.execute(table.select())]
+                if rows:
+                    connection.execute(table.insert(), rows)
+        db.session.commit()
+
+    def get(self, url):
+        response = self.app.get(url, follow_redirects=True)
+        data = response.data
+        response.close()
+        return data
+
+    def timeline(self):
+        return json.loads(self.get('/tweets/json/').decode('utf-8'))['tweets']
+
+    def replica_count(self, table):
+        return self.replica.execute(table.count()).scalar()
+
+    # tests
+
+    def test_get_requests_read_the_replica(self):
+        self.create_user('Rachel', 'rachel@realpython.com', 'python')
+        self.assertNotIn(b'Rachel', self.get('/users/'))
+        self.replicate()
+        cache.clear()
+        self.assertIn(b'Rachel', self.get('/users/'))
+
+    def test_writes_go_to_the_primary_and_pin_the_writer_to_it(self):
+        self.app.post('/tweets/post/', data=dict(tweet='a fresh tweet'))
+        self.assertEqual(Tweet.query.count(), 1)
+        self.assertEqual(self.replica_count(Tweet.__table__), 0)
+        self.assertEqual(len(self.timeline()), 1)
+        later = datetime.now() + timedelta(
+            seconds=app.config['REPLICA_PIN_SECONDS'] + 1)
+        with freeze_time(later):
+            self.assertEqual(self.timeline(), [])
+            self.replicate()
+            self.assertEqual(len(self.timeline()), 1)
+
+    def test_get_views_that_write_use_the_primary(self):
+        self.create_user('Rachel', 'rachel@realpython.com', 'python')
+        data = self.get('/tweets/follow/3/')
+        self.assertIn(b'You are now following Rachel', data)
+        self.assertEqual(Follower.query.filter_by(whom_id=3).count(), 1)
+        self.assertEqual(self.replica_count(Follower.__table__), 0)
+
+    def test_pages_cached_from_the_replica_expire_early(self):
+        self.create_user('Rachel', 'rachel@realpython.com', 'python')
+        self.assertNotIn(b'Rachel', self.get('/users/'))
+        self.replicate()
+        self.assertNotIn(b'Rachel', self.get('/users/'))
+        later = datetime.now() + timedelta(
+            seconds=app.config['CACHE_REPLICA_TIMEOUT'] + 1)
+        with freeze_time(later):
+            self.assertIn(b'Rachel', self.get('/users/'))
+
+    def test_requests_without_a_replica_use_the_primary(self):
+        del app.config['SQLALCHEMY_BINDS']
+        self.create_user('Rachel', 'rachel@realpython.com', 'python')
+        self.assertIn(b'Rachel', self.get('/users/'))
+        app.config['SQLALCHEMY_BINDS'] = {}
+
+
+if __name__ == "__main__":
+    unittest.main()
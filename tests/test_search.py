@@ -0,0 +1,155 @@
+import os
+import unittest
+import json
+
+from project import app, cache, db, bcrypt, search
+from project._config import BASE_DIR
+from project.models import User, Tweet
+from helpers import assert_max_queries
+
+TEST_DB = 'test.db'
+
+class SearchTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+
+    # teardown function
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def register(self, name, email, password, confirm):
+        return self.app.post('register/', data=dict(
+            name=name, email=email, password=password, confirm=confirm
+        ), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def post(self, tweet):
+        response = self.app.post('/api/v1/tweets', data=json.dumps(
+            dict(tweet=tweet)), content_type='application/json')
+        return json.loads(response.data.decode('utf-8'))
+
+    def found(self, url):
+        response = self.app.get(url)
+        return json.loads(response.data.decode('utf-8'))
+
+    # tests
+
+    def test_posted_tweets_are_searchable(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        self.post('Deploying the flask app today')
+        self.post('Coffee before anything else')
+        body = self.found('/api/v1/search/tweets?q=deployed+flask')
+        self.assertEqual([t['tweet'] for t in body['results']],
+                         ['Deploying the flask app today'])
+        self.assertEqual(body['results'][0]['name'], 'Michael')
+        self.assertEqual(self.found('/api/v1/search/tweets?q=tea')['results'],
+                         [])
+
+    def test_deleted_tweets_leave_the_index(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        tweet = self.post('Deploying the flask app today')
+        self.app.delete('/api/v1/tweets/{0}'.format(tweet['tweet_id']))
+        body = self.found('/api/v1/search/tweets?q=flask')
+        self.assertEqual(body['results'], [])
+
+    def test_results_are_ranked_and_paged(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        for i in range(25):
+            self.post('flask tweet number {0}'.format(i))
+        best = self.post('flask flask flask all day')
+        body = self.found('/api/v1/search/tweets?q=flask')
+        self.assertEqual(len(body['results']), 20)
+        self.assertEqual(body['results'][0]['tweet_id'], best['tweet_id'])
+        more = self.found('/api/v1/search/tweets?q=flask&cursor={0}'.format(
+            body['next_cursor']))
+        self.assertEqual(len(more['results']), 6)
+        self.assertIsNone(more['next_cursor'])
+        seen = set(t['tweet_id'] for t in body['results'] + more['results'])
+        self.assertEqual(len(seen), 26)
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        self.post('Deploying the flask app today')
+        body = self.found('/api/v1/search/tweets?q=flask"*(')
+        self.assertEqual(len(body['results']), 1)
+        body = self.found('/api/v1/search/tweets?q=NEAR(+OR+-"')
+        self.assertEqual(body['results'], [])
+        self.assertEqual(self.app.get(
+            '/api/v1/search/tweets?q=flask&cursor=x').status_code, 400)
+
+    def test_registered_users_are_found_by_prefix(self):
+        self.register('Fletcher', 'fletcher@realpython.com',
+                      'python101', 'python101')
+        self.register('Michael', 'michael@realpython.com',
+                      'python', 'python')
+        self.login('Michael', 'python')
+        body = self.found('/api/v1/search/users?q=fle')
+        self.assertEqual([u['name'] for u in body['results']], ['Fletcher'])
+        response = self.app.get('/search/?q=fle&type=users')
+        self.assertIn(b'Fletcher', response.data)
+        self.assertIn(b'Follow', response.data)
+
+    def test_accented_words_are_searchable(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        self.post(u'Un \xe9t\xe9 sans flask')
+        self.post('Coffee before anything else')
+        body = self.found(u'/api/v1/search/tweets?q=\xe9t\xe9'.encode('utf-8'))
+        self.assertEqual([t['tweet'] for t in body['results']],
+                         [u'Un \xe9t\xe9 sans flask'])
+        response = self.app.get(u'/search/?q=\xe9t\xe9'.encode('utf-8'))
+        self.assertEqual(response.status_code, 200)
+        response = self.app.get(
+            u'/search/?q=\xe9t&type=users'.encode('utf-8'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_search_is_a_single_query(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        for i in range(5):
+            self.post('flask tweet number {0}'.format(i))
+        with assert_max_queries(self, 1):
+            page = search.search_tweets('flask')
+            [t.poster.name for t in page.items]
+        self.assertEqual(len(page.items), 5)
+
+    def test_reindex_covers_existing_rows(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        db.session.add(Tweet('written around the index', db.func.now(), 1))
+        db.session.commit()
+        self.assertEqual(search.search_tweets('index').items, [])
+        self.assertEqual(search.reindex(), (1, 1))
+        self.assertEqual(len(search.search_tweets('index').items), 1)
+        self.assertEqual(len(search.search_users('mich').items), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,223 @@
+import os
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from freezegun import freeze_time
+
+from project import app, cache, db, bcrypt, sessions
+from project._config import BASE_DIR
+from project.models import User, StoredSession
+from project.sessions import (LocalSessionStore, RedisSessionStore,
+    SQLSessionStore, make_store)
+from helpers import FakeRedis
+
+TEST_DB = 'test.db'
+
+
+class StoreContract(object):
+    """Behaviour every session store shares."""
+
+    def test_set_get_and_delete(self):
+        expires = time.time() + 60
+        self.store.set('a', '{"user_id": 1}', 1, expires)
+        data, stored_expires = self.store.get('a')
+        self.assertEqual(data, '{"user_id": 1}')
+        self.assertAlmostEqual(stored_expires, expires, places=0)
+        self.store.delete('a')
+        self.assertIsNone(self.store.get('a'))
+
+    def test_expired_sessions_are_gone(self):
+        self.store.set('a', '{}', None, time.time() + 60)
+        self.store.touch('a', time.time() - 1)
+        self.assertIsNone(self.store.get('a'))
+
+    def test_revoke_every_session_of_a_user(self):
+        expires = time.time() + 60
+        self.store.set('a', '{}', 1, expires)
+        self.store.set('b', '{}', 1, expires)
+        self.store.set('c', '{}', 2, expires)
+        self.assertEqual(self.store.delete_user(1), 2)
+        self.assertIsNone(self.store.get('a'))
+        self.assertIsNone(self.store.get('b'))
+        self.assertIsNotNone(self.store.get('c'))
+
+
+class LocalStoreTest(StoreContract, unittest.TestCase):
+
+    def setUp(self):
+        self.store = LocalSessionStore(max_entries=10)
+
+    def test_least_recently_used_sessions_are_evicted(self):
+        store = LocalSessionStore(max_entries=2)
+        expires = time.time() + 60
+        store.set('a', '{}', None, expires)
+        store.set('b', '{}', None, expires)
+        store.get('a')
+        store.set('c', '{}', None, expires)
+        self.assertIsNone(store.get('b'))
+        self.assertIsNotNone(store.get('a'))
+
+
+class SQLStoreTest(StoreContract, unittest.TestCase):
+
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        db.create_all()
+        self.store = SQLSessionStore(db, StoredSession.__table__)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+
+class RedisStoreTest(StoreContract, unittest.TestCase):
+
+    def setUp(self):
+        self.store = RedisSessionStore(FakeRedis(), 'session:')
+
+    def test_expired_sessions_are_gone(self):
+        # redis drops them itself
+        pass
+
+
+class SessionsTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+
+    # teardown function
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, client, name, password):
+        return client.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def session_id(self, client):
+        ids = [c.value for c in client.cookie_jar if c.name == 'sid']
+        return ids[0] if ids else None
+
+    # tests
+
+    def test_cookie_only_holds_a_session_id(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.app.get('/')
+        anonymous = self.session_id(self.app)
+        response = self.login(self.app, 'Michael', 'python')
+        self.assertIn(b'Michael', response.data)
+        sid = self.session_id(self.app)
+        self.assertEqual(len(sid), 43)
+        self.assertNotEqual(sid, anonymous)
+        self.assertIsNone(sessions.store.get(anonymous))
+
+    def test_unchanged_sessions_are_not_saved_again(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        now = datetime(2016, 7, 7, 12)
+        with freeze_time(now):
+            self.login(self.app, 'Michael', 'python')
+            response = self.app.get('/tweets/')
+            self.assertNotIn('Set-Cookie', response.headers)
+            response.close()
+        with freeze_time(now + timedelta(hours=2)):
+            response = self.app.get('/tweets/')
+            self.assertIn('Set-Cookie', response.headers)
+            response.close()
+
+    def test_sessions_expire_when_idle(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        now = datetime(2016, 7, 7, 12)
+        with freeze_time(now):
+            self.login(self.app, 'Michael', 'python')
+        with freeze_time(now + timedelta(days=13)):
+            response = self.app.get('/tweets/')
+            self.assertEqual(response.status_code, 200)
+            response.close()
+        with freeze_time(now + timedelta(days=26)):
+            response = self.app.get('/tweets/')
+            self.assertEqual(response.status_code, 200)
+            response.close()
+        with freeze_time(now + timedelta(days=41)):
+            response = self.app.get('/tweets/')
+            self.assertEqual(response.status_code, 302)
+
+    def test_logout_everywhere_revokes_other_sessions(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        laptop = app.test_client()
+        self.login(self.app, 'Michael', 'python')
+        self.login(laptop, 'Michael', 'python')
+        response = self.app.get('/logout/everywhere/', follow_redirects=True)
+        self.assertIn(b'logged out on every device', response.data)
+        self.assertEqual(laptop.get('/tweets/').status_code, 302)
+
+    def test_sql_store_saves_after_a_refused_follow(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        local, sessions.store = sessions.store, SQLSessionStore(
+            db, StoredSession.__table__)
+        try:
+            self.login(self.app, 'Michael', 'python')
+            self.app.get('/tweets/follow/2/')
+            response = self.app.get('/tweets/follow/2/',
+                                    follow_redirects=True)
+            self.assertIn(b'You are already following Fletcher',
+                          response.data)
+        finally:
+            sessions.store = local
+
+    def test_sql_store_saves_after_a_duplicate_registration(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        app.config['SESSION_TYPE'] = 'sql'
+        local, sessions.store = sessions.store, make_store(app.config)
+        try:
+            # leaves a flashed message in the session for the next request
+            self.app.post('/register/', data=dict(
+                name='Fletcher', email='fletcher@realpython.com',
+                password='python101', confirm='python101'))
+            response = self.app.post('/register/', data=dict(
+                name='Michael', email='michael@realpython.com',
+                password='python', confirm='python'))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'That username and/or email already exists.',
+                          response.data)
+            self.assertIn(b'Thanks for registering', response.data)
+            # the flash was taken out of the stored session
+            response = self.app.get('/register/')
+            self.assertNotIn(b'Thanks for registering', response.data)
+        finally:
+            app.config['SESSION_TYPE'] = 'local'
+            sessions.store = local
+
+    def test_current_user_is_cached_between_requests(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login(self.app, 'Michael', 'python')
+        db.session.query(User).filter_by(id=1).update(dict(role='admin'))
+        db.session.commit()
+        self.assertEqual(self.app.get('/metrics/profiles/').status_code, 403)
+        cache.clear()
+        self.assertEqual(self.app.get('/metrics/profiles/').status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,290 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from freezegun import freeze_time
+
+from project import app, cache, db, bcrypt, bulk, push, shards, timelines
+from project._config import BASE_DIR
+from project.models import Follower, Job, TimelineEntry, User, Tweet
+from project.shards import (ShardTweet, connect, follower, merge_newest,
+    tweets)
+
+TEST_DB = 'test.db'
+SHARD_DB = 'test-shard-{0}.db'
+
+
+def shard_url(index):
+    return 'sqlite:///' + os.path.join(BASE_DIR, SHARD_DB.format(index))
+
+
+class ShardTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        app.config['SHARDS'] = [shard_url(i) for i in range(3)]
+        self.app = app.test_client()
+        db.create_all()
+        shards.create_all()
+        cache.clear()
+        for name in ('Michael', 'Fletcher', 'Rachel', 'Monica'):
+            self.create_user(name, name.lower() + '@realpython.com', 'python')
+        self.login('Michael', 'python')
+
+    # teardown function
+    def tearDown(self):
+        app.config['SHARDS'] = []
+        db.session.remove()
+        db.drop_all()
+        shards.dispose()
+        for name in os.listdir(BASE_DIR):
+            if name.startswith('test-shard-'):
+                os.remove(os.path.join(BASE_DIR, name))
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def seed_tweets(self, count, user_ids):
+        """Tweets of `user_ids` in turn, a minute apart with every third
+        one at the same time as the one before, written to both sides."""
+        start = datetime(2016, 7, 7)
+        for i in range(count):
+            db.session.add(Tweet('seeded tweet {0:03d}'.format(i),
+                                 start + timedelta(minutes=i - i % 3 // 2),
+                                 user_ids[i % len(user_ids)]))
+        db.session.commit()
+        shards.sync_from(db.engine, 100)
+        timelines.rebuild(1)
+        db.session.commit()
+
+    def shard_rows(self, index, table):
+        engine = shards.engines()[index]
+        return [tuple(row) for row in engine.execute(table.select())]
+
+    def timeline(self, before=None):
+        url = '/tweets/json/' + ('?before=' + before if before else '')
+        return json.loads(self.app.get(url).data.decode('utf-8'))
+
+    def api_timeline(self, since_id):
+        response = self.app.get(
+            '/api/v1/timeline?since_id={0}'.format(since_id))
+        return [t['tweet_id'] for t in
+                json.loads(response.data.decode('utf-8'))['tweets']]
+
+    def all_pages(self):
+        items, page = [], self.timeline()
+        items.extend(page['tweets'])
+        while page['next_cursor']:
+            page = self.timeline(page['next_cursor'])
+            items.extend(page['tweets'])
+        return items
+
+    # tests
+
+    def test_rows_live_on_the_shard_of_their_user(self):
+        self.app.post('/tweets/post/', data=dict(tweet='on shard one'))
+        self.app.get('/tweets/follow/3/')
+        self.assertEqual([row[:3] for row in self.shard_rows(1, tweets)],
+                         [(1, 1, 'on shard one')])
+        self.assertEqual(self.shard_rows(1, follower), [(1, 3)])
+        self.assertEqual(self.shard_rows(0, tweets), [])
+        self.app.get('/tweets/unfollow/3/')
+        self.app.get('/tweets/delete/1/')
+        self.assertEqual(self.shard_rows(1, tweets), [])
+        self.assertEqual(self.shard_rows(1, follower), [])
+
+    def test_timeline_is_gathered_from_every_shard(self):
+        for whom_id in (2, 3, 4):
+            self.app.get('/tweets/follow/{0}/'.format(whom_id))
+        self.seed_tweets(50, [1, 2, 3, 4])
+        sharded = self.all_pages()
+        app.config['SHARDS'] = []
+        self.assertEqual(sharded, self.all_pages())
+        self.assertEqual(len(sharded), 50)
+
+    def test_timeline_html_names_the_posters(self):
+        self.app.get('/tweets/follow/3/')
+        self.seed_tweets(2, [3])
+        response = self.app.get('/tweets/')
+        self.assertIn(b'seeded tweet 000', response.data)
+        self.assertIn(b'Rachel', response.data)
+
+    def test_inboxes_are_not_written_while_sharded(self):
+        self.app.get('/tweets/follow/3/')
+        self.app.post('/tweets/post/', data=dict(tweet='on shard one'))
+        self.login('Rachel', 'python')
+        self.app.post('/tweets/post/', data=dict(tweet='on shard zero'))
+        self.app.get('/tweets/unfollow/1/')
+        self.assertEqual(TimelineEntry.query.count(), 0)
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_own_writes_show_before_the_worker_runs(self):
+        app.config['JOBS_EAGER'] = False
+        try:
+            self.app.post('/tweets/post/', data=dict(tweet='on shard one'))
+            self.app.get('/tweets/follow/3/')
+            self.assertEqual([t['tweet'] for t in self.timeline()['tweets']],
+                             ['on shard one'])
+            self.assertEqual(self.shard_rows(1, follower), [(1, 3)])
+            self.assertEqual(Job.query.count(), 0)
+        finally:
+            app.config['JOBS_EAGER'] = True
+
+    def test_followers_are_pushed_tweets_synced_to_the_shards(self):
+        self.app.get('/tweets/follow/3/')
+        subscription = push.subscribe(1)
+        try:
+            self.login('Rachel', 'python')
+            self.app.post('/tweets/post/', data=dict(tweet='on shard zero'))
+            self.assertEqual(subscription.get(5)['tweet'], 'on shard zero')
+        finally:
+            subscription.close()
+
+    def test_merge_breaks_ties_on_tweet_id(self):
+        posted = datetime(2016, 7, 7)
+        pages = [
+            [ShardTweet(5, 1, 'a', posted, None),
+             ShardTweet(1, 1, 'b', posted - timedelta(1), None)],
+            [],
+            [ShardTweet(4, 2, 'c', posted, None),
+             ShardTweet(3, 2, 'd', posted, None)],
+        ]
+        self.assertEqual([t.tweet_id for t in merge_newest(pages)],
+                         [5, 4, 3, 1])
+
+    def test_reshard_moves_rows_onto_a_new_layout(self):
+        for whom_id in (2, 3, 4):
+            self.app.get('/tweets/follow/{0}/'.format(whom_id))
+        self.seed_tweets(20, [1, 2, 3, 4])
+        before = self.all_pages()
+        urls = [shard_url(i) for i in range(3, 5)]
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['reshard'] + urls)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Copied 20 of 20 tweets rows onto 2 shards.',
+                      result.output)
+        result = runner.invoke(args=['reshard'] + urls)
+        self.assertIn('Copied 0 of 20 tweets rows', result.output)
+        app.config['SHARDS'] = urls
+        cache.clear()
+        self.assertEqual(self.all_pages(), before)
+        self.assertEqual(self.shard_rows(0, follower), [])
+        self.assertEqual(sorted(self.shard_rows(1, follower)),
+                         [(1, 2), (1, 3), (1, 4)])
+        for index in range(2):
+            users = set(row[1] for row in self.shard_rows(index, tweets))
+            self.assertEqual(set(u % 2 for u in users), set([index]))
+
+    def test_prune_drops_rows_a_shard_does_not_own(self):
+        self.seed_tweets(8, [1, 2])
+        misplaced = connect(shard_url(0))
+        misplaced.execute(tweets.insert(), dict(
+            tweet_id=100, user_id=1, tweet='lost', posted=datetime.now()))
+        misplaced.dispose()
+        result = app.test_cli_runner().invoke(args=['prune-shards'])
+        self.assertIn('Deleted 1 of 9 tweets rows.', result.output)
+        self.assertEqual(len(self.shard_rows(1, tweets)), 4)
+        self.assertEqual(self.shard_rows(0, tweets), [])
+
+    def test_nothing_is_written_to_shards_when_off(self):
+        app.config['SHARDS'] = []
+        self.app.post('/tweets/post/', data=dict(tweet='main only'))
+        app.config['SHARDS'] = [shard_url(i) for i in range(3)]
+        self.assertEqual(self.shard_rows(1, tweets), [])
+        self.assertEqual(Tweet.query.count(), 1)
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_failed_shard_writes_are_retried_by_the_worker(self):
+        urls = list(app.config['SHARDS'])
+        app.config['SHARDS'][1] = 'sqlite:///' + os.path.join(
+            BASE_DIR, 'test-shard-missing', 'shard.db')
+        response = self.app.post('/tweets/post/', data=dict(
+            tweet='while shard one is down'), follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        # ends the streamed page's request context now, the CLI runner
+        # below keeps this frame alive until the garbage collector runs
+        response.close()
+        self.assertEqual(Tweet.query.count(), 1)
+        job, = Job.query.all()
+        self.assertEqual(job.kind, 'shard-sync')
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('OperationalError', job.last_error)
+        app.config['SHARDS'] = urls
+        self.assertEqual(self.shard_rows(1, tweets), [])
+        with freeze_time(datetime.now() + timedelta(minutes=1)):
+            result = app.test_cli_runner().invoke(
+                args=['run-worker', '--burst'])
+        self.assertIn('Ran 1 jobs.', result.output)
+        self.assertEqual([row[:3] for row in self.shard_rows(1, tweets)],
+                         [(1, 1, 'while shard one is down')])
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_api_and_pages_read_the_shards(self):
+        self.app.get('/tweets/follow/2/')
+        self.seed_tweets(10, [1, 2, 3])
+        since_id = Tweet.query.filter_by(tweet='seeded tweet 004').one().tweet_id
+        expected = self.api_timeline(since_id)
+        self.assertEqual(len(expected), 3)
+        # with the inboxes gone only the shards can answer
+        TimelineEntry.query.delete()
+        db.session.commit()
+        cache.clear()
+        self.assertEqual(self.api_timeline(since_id), expected)
+        self.assertEqual(len(self.all_pages()), 7)
+
+    def test_reshard_from_main_deletes_rows_main_no_longer_has(self):
+        self.app.get('/tweets/follow/3/')
+        self.app.get('/tweets/follow/4/')
+        self.seed_tweets(20, [1, 3, 4])
+        Tweet.query.filter_by(tweet='seeded tweet 000').delete()
+        Follower.query.filter_by(who_id=1, whom_id=3).delete()
+        db.session.commit()
+        result = app.test_cli_runner().invoke(
+            args=['reshard', '--from-main'] + app.config['SHARDS'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Deleted 1 of 20 tweets rows gone from the main '
+                      'database.', result.output)
+        self.assertIn('Deleted 1 of 2 follower rows', result.output)
+        self.assertEqual(self.shard_rows(1, follower), [(1, 4)])
+        self.assertNotIn('seeded tweet 000',
+                         [row[2] for row in self.shard_rows(1, tweets)])
+
+    def test_bulk_import_syncs_the_shards(self):
+        stale = connect(shard_url(2))
+        stale.execute(tweets.insert(), dict(
+            tweet_id=100, user_id=2, tweet='gone', posted=datetime.now()))
+        stale.dispose()
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'tweets.csv')
+            with open(path, 'w') as f:
+                f.write('user_id,tweet,posted\n'
+                        '2,imported tweet,2016-07-07 12:00:00\n')
+            bulk.import_files(tweets=path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual([row[1:3] for row in self.shard_rows(2, tweets)],
+                         [(2, 'imported tweet')])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import re
+import unittest
+from datetime import datetime, timedelta
+
+from project import app, cache, db, bcrypt, timelines
+from project._config import BASE_DIR
+from project.models import User, Tweet
+from helpers import count_queries
+
+TEST_DB = 'test.db'
+
+class StreamingTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+
+    # teardown function
+    def tearDown(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['STREAM_TEMPLATES'] = True
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def create_user(self, name, email, password):
+        new_user = User(
+            name=name,
+            email=email,
+            password=bcrypt.generate_password_hash(password)
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+    def seed_tweets(self, count, user_id=1):
+        start = datetime(2016, 7, 7)
+        for i in range(count):
+            db.session.add(Tweet(
+                'seeded tweet {0:03d}'.format(i),
+                start + timedelta(minutes=i),
+                user_id
+            ))
+        db.session.commit()
+        timelines.rebuild(user_id)
+        db.session.commit()
+
+    # tests
+
+    def test_timeline_head_is_sent_before_the_timeline_is_read(self):
+        self.seed_tweets(3)
+        response = self.app.get('/tweets/')
+        self.assertNotIn('Content-Length', response.headers)
+        chunks = iter(response.response)
+        with count_queries() as queries:
+            head = next(chunks)
+        self.assertEqual(queries.count, 0)
+        self.assertIn(b'<form action="/tweets/post/"', head)
+        self.assertNotIn(b'seeded tweet', head)
+        rest = b''.join(chunks)
+        response.close()
+        self.assertIn(b'seeded tweet 002', rest)
+        app.config['STREAM_TEMPLATES'] = False
+        cache.clear()
+        rendered = self.app.get('/tweets/')
+        self.assertIn('Content-Length', rendered.headers)
+        self.assertEqual(rendered.data, head + rest)
+
+    def test_flashed_messages_are_shown_once(self):
+        response = self.app.post('/tweets/post/', data=dict(
+            tweet='a tweet to flash about'), follow_redirects=True)
+        self.assertIn(b'New tweet has been posted.', response.data)
+        response = self.app.get('/tweets/')
+        self.assertNotIn(b'New tweet has been posted.', response.data)
+
+    def test_csrf_token_of_a_streamed_form_is_kept(self):
+        app.config['WTF_CSRF_ENABLED'] = True
+        page = self.app.get('/tweets/').data
+        token = re.search(b'name="csrf_token" type="hidden" value="([^"]+)"',
+                          page).group(1)
+        response = self.app.post('/tweets/post/', data=dict(
+            tweet='a tweet with a token', csrf_token=token))
+        self.assertEqual(response.status_code, 302)
+
+    def test_user_list_is_streamed(self):
+        self.create_user('Fletcher', 'fletcher@realpython.com', 'python101')
+        response = self.app.get('/users/')
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertIn(b'Fletcher', response.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
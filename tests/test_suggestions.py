@@ -0,0 +1,125 @@
+import os
+import unittest
+
+from project import app, cache, db, suggestions
+from project._config import BASE_DIR
+from project.models import User, Follower
+from helpers import assert_max_queries
+
+TEST_DB = 'test.db'
+
+class SuggestionsTest(unittest.TestCase):
+
+    # setup function
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(BASE_DIR, TEST_DB)
+        self.app = app.test_client()
+        db.create_all()
+        cache.clear()
+
+    # teardown function
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # helper functions
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+            name=name, password=password), follow_redirects=True)
+
+    def register(self, name, email, password, confirm):
+        return self.app.post('register/', data=dict(
+            name=name, email=email, password=password, confirm=confirm
+        ), follow_redirects=True)
+
+    def create_users(self, *names):
+        for name in names:
+            db.session.add(User(name, '{0}@example.com'.format(name), 'x'))
+        db.session.commit()
+
+    def follow(self, *edges):
+        for who_id, whom_id in edges:
+            db.session.add(Follower(who_id, whom_id))
+        db.session.commit()
+
+    # tests
+
+    def test_friends_of_friends_are_scored(self):
+        self.create_users('ann', 'bob', 'cat', 'dan', 'eve')
+        # ann follows bob and cat; both follow dan, only cat follows eve
+        self.follow((1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (2, 1))
+        suggestions.rebuild_all()
+        self.assertEqual(suggestions.suggested_users(1), [
+            suggestions.Suggested(4, 'dan', 2),
+            suggestions.Suggested(5, 'eve', 1),
+        ])
+
+    def test_followed_accounts_are_not_suggested(self):
+        self.create_users('ann', 'bob', 'cat', 'dan')
+        self.follow((1, 2), (1, 3), (2, 3), (2, 4))
+        suggestions.rebuild(1)
+        db.session.commit()
+        self.assertEqual([s.name for s in suggestions.suggested_users(1)],
+                         ['dan'])
+        self.follow((1, 4))
+        cache.delete(User.following_key(1))
+        self.assertEqual(suggestions.suggested_users(1), [])
+
+    def test_users_page_shows_who_to_follow(self):
+        self.register('foobar', 'foobar@example.com', 'barfoo', 'barfoo')
+        self.create_users('bob', 'dan')
+        self.follow((1, 2), (2, 3))
+        suggestions.rebuild_all()
+        self.login('foobar', 'barfoo')
+        response = self.app.get('users/')
+        self.assertIn(b'Who to follow', response.data)
+        self.assertIn(b'followed by 1 you follow', response.data)
+        with assert_max_queries(self, 2):
+            self.app.get('users/')
+
+    def test_users_page_filters_and_pages_by_name(self):
+        app.config['USERS_PER_PAGE'] = 2
+        try:
+            self.register('robert', 'robert@example.com', 'barfoo', 'barfoo')
+            self.create_users('alice', 'alfred', 'albert')
+            self.login('robert', 'barfoo')
+            response = self.app.get('users/?q=al')
+            self.assertIn(b'albert', response.data)
+            self.assertIn(b'alfred', response.data)
+            self.assertNotIn(b'alice', response.data)
+            self.assertNotIn(b'/tweets/follow/1/', response.data)
+            response = self.app.get('users/?q=al&after=alfred')
+            self.assertIn(b'alice', response.data)
+            self.assertNotIn(b'albert', response.data)
+            self.assertNotIn(b'More', response.data)
+        finally:
+            app.config['USERS_PER_PAGE'] = 50
+
+    def test_users_page_filters_by_a_non_ascii_prefix(self):
+        app.config['USERS_PER_PAGE'] = 1
+        try:
+            self.register('robert', 'robert@example.com', 'barfoo', 'barfoo')
+            for i, name in enumerate((u'\xe9lodie', u'\xe9mile', u'eric')):
+                db.session.add(User(name, 'user{0}@example.com'.format(i), 'x'))
+            db.session.commit()
+            self.login('robert', 'barfoo')
+            response = self.app.get(u'users/?q=\xe9'.encode('utf-8'))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(u'\xe9lodie'.encode('utf-8'), response.data)
+            self.assertNotIn(b'eric', response.data)
+            response = self.app.get(
+                u'users/?q=\xe9&after=\xe9lodie'.encode('utf-8'))
+            self.assertIn(u'\xe9mile'.encode('utf-8'), response.data)
+            response = self.app.get(u'api/v1/users?q=\xe9'.encode('utf-8'))
+            self.assertEqual(response.status_code, 200)
+        finally:
+            app.config['USERS_PER_PAGE'] = 50
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,13 @@
 import os
 import unittest
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
 from freezegun import freeze_time
 
-from project import app, db, bcrypt
+from project import app, cache, db, bcrypt, timelines
 from project._config import BASE_DIR
-from project.models import User, Tweet
+from project.models import User, Tweet, TimelineEntry, Follower
+from helpers import assert_max_queries
 
 TEST_DB = 'test.db'
 
@@ -20,6 +22,7 @@ class MainTest(unittest.TestCase):
             os.path.join(BASE_DIR, TEST_DB)
         self.app = app.test_client()
         db.create_all()
+        cache.clear()
 
         self.assertEquals(app.debug, False)
 
@@ -56,6 +59,18 @@ class MainTest(unittest.TestCase):
             tweet=tweet
         ), follow_redirects=True)
 
+    def seed_tweets(self, count, user_id=1):
+        start = datetime(2016, 7, 7)
+        for i in range(count):
+            db.session.add(Tweet(
+                'seeded tweet {0:03d}'.format(i),
+                start + timedelta(minutes=i),
+                user_id
+            ))
+        db.session.commit()
+        timelines.rebuild(user_id)
+        db.session.commit()
+
     # tests
     def test_logged_in_users_can_access_tweets_page(self):
         self.register(
@@ -206,6 +221,20 @@ class MainTest(unittest.TestCase):
         with freeze_time(few_days_ahead) as frozen_time:
             self.assertEqual('07 July, 2016', Tweet.delta_time(tweet.posted))
 
+    def test_timeline_fragment_does_not_depend_on_the_clock(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.login('foobar', 'barfoo')
+        self.seed_tweets(1)
+        with freeze_time(datetime(2016, 7, 7, 0, 5)):
+            first = self.app.get('tweets/').data
+        cache.clear()
+        with freeze_time(datetime(2016, 7, 9, 12, 0)):
+            second = self.app.get('tweets/').data
+        self.assertIn(b'<time class="posted" datetime="2016-07-07T', first)
+        self.assertIn(b'>07 July, 2016</time>', first)
+        self.assertNotIn(b'few seconds ago', first)
+        self.assertEqual(first, second)
+
     def test_string_representation_of_tweets(self):
         db.session.add(
             Tweet(
@@ -220,6 +249,215 @@ class MainTest(unittest.TestCase):
             self.assertEqual(str(tweet), '<Id {0} - {1}>'.format(tweet.tweet_id, tweet.tweet))
 
 
+    def test_timeline_is_paginated(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.login('foobar', 'barfoo')
+        self.seed_tweets(app.config['TWEETS_PER_PAGE'] + 5)
+        response = self.app.get('tweets/')
+        self.assertIn(b'seeded tweet 024', response.data)
+        self.assertIn(b'seeded tweet 005', response.data)
+        self.assertNotIn(b'seeded tweet 004', response.data)
+        self.assertIn(b'Older tweets', response.data)
+
+    def test_older_tweets_cursor_continues_the_timeline(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.login('foobar', 'barfoo')
+        self.seed_tweets(app.config['TWEETS_PER_PAGE'] + 5)
+        first = json.loads(self.app.get('tweets/json/').data.decode('utf-8'))
+        self.assertEqual(len(first['tweets']), app.config['TWEETS_PER_PAGE'])
+        self.assertEqual(first['tweets'][0]['tweet'], 'seeded tweet 024')
+        response = self.app.get('tweets/?before=' + first['next_cursor'])
+        self.assertIn(b'seeded tweet 004', response.data)
+        self.assertIn(b'seeded tweet 000', response.data)
+        self.assertNotIn(b'seeded tweet 005', response.data)
+        self.assertNotIn(b'Older tweets', response.data)
+
+    def test_timeline_cursor_breaks_ties_on_tweet_id(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.login('foobar', 'barfoo')
+        posted = datetime(2016, 7, 7)
+        for i in range(app.config['TWEETS_PER_PAGE'] + 1):
+            db.session.add(Tweet('same instant', posted, 1))
+        db.session.commit()
+        timelines.rebuild(1)
+        db.session.commit()
+        first = json.loads(self.app.get('tweets/json/').data.decode('utf-8'))
+        second = json.loads(self.app.get(
+            'tweets/json/?before=' + first['next_cursor']).data.decode('utf-8'))
+        self.assertEqual([t['tweet_id'] for t in second['tweets']], [1])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_invalid_timeline_cursor_is_rejected(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.login('foobar', 'barfoo')
+        response = self.app.get('tweets/?before=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+    def timeline_of(self, user_id):
+        entries = db.session.query(TimelineEntry.tweet_id).filter_by(
+            user_id=user_id).order_by(TimelineEntry.tweet_id)
+        return [entry[0] for entry in entries]
+
+    def test_posted_tweets_are_fanned_out_to_followers(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.register('barfoo', 'barfoo@example.com', 'foobar', 'foobar')
+        self.login('foobar', 'barfoo')
+        self.app.get('tweets/follow/2/')
+        self.logout()
+        self.login('barfoo', 'foobar')
+        self.create_tweet('test tweet from barfoo')
+        self.assertEqual(self.timeline_of(1), [1])
+        self.assertEqual(self.timeline_of(2), [1])
+        self.logout()
+        self.login('foobar', 'barfoo')
+        response = self.app.get('tweets/')
+        self.assertIn(b'test tweet from barfoo', response.data)
+
+    def test_follow_backfills_and_unfollow_prunes_the_timeline(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.register('barfoo', 'barfoo@example.com', 'foobar', 'foobar')
+        self.login('barfoo', 'foobar')
+        self.create_tweet('test tweet from barfoo')
+        self.logout()
+        self.login('foobar', 'barfoo')
+        self.create_tweet('test tweet from foobar')
+        self.app.get('tweets/follow/2/')
+        self.assertEqual(self.timeline_of(1), [1, 2])
+        self.app.get('tweets/unfollow/2/')
+        self.assertEqual(self.timeline_of(1), [2])
+
+    def test_deleted_tweets_leave_every_timeline(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.register('barfoo', 'barfoo@example.com', 'foobar', 'foobar')
+        self.login('foobar', 'barfoo')
+        self.app.get('tweets/follow/2/')
+        self.logout()
+        self.login('barfoo', 'foobar')
+        self.create_tweet('test tweet from barfoo')
+        self.app.get('tweets/delete/1/')
+        self.assertEqual(db.session.query(TimelineEntry).count(), 0)
+
+    def test_popular_accounts_are_merged_at_read_time(self):
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        try:
+            self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+            self.register('barfoo', 'barfoo@example.com', 'foobar', 'foobar')
+            self.register('bazbaz', 'bazbaz@example.com', 'foobar', 'foobar')
+            for name, password in (('foobar', 'barfoo'), ('bazbaz', 'foobar')):
+                self.login(name, password)
+                self.app.get('tweets/follow/2/')
+                self.logout()
+            self.login('barfoo', 'foobar')
+            self.create_tweet('test tweet from barfoo')
+            self.assertEqual(self.timeline_of(1), [])
+            self.logout()
+            self.login('foobar', 'barfoo')
+            self.create_tweet('test tweet from foobar')
+            response = self.app.get('tweets/')
+            self.assertIn(b'test tweet from barfoo', response.data)
+            self.assertIn(b'test tweet from foobar', response.data)
+        finally:
+            app.config['TIMELINE_FANOUT_LIMIT'] = 10000
+
+    def test_accounts_falling_under_the_limit_are_fanned_out_again(self):
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        try:
+            self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+            self.register('barfoo', 'barfoo@example.com', 'foobar', 'foobar')
+            self.register('bazbaz', 'bazbaz@example.com', 'foobar', 'foobar')
+            self.login('bazbaz', 'foobar')
+            self.app.get('tweets/follow/2/')
+            self.logout()
+            self.login('barfoo', 'foobar')
+            self.create_tweet('test tweet before the limit')
+            self.logout()
+            # the second follower makes barfoo exempt, so neither the
+            # backfill nor the next tweet reach foobar's inbox
+            self.login('foobar', 'barfoo')
+            self.app.get('tweets/follow/2/')
+            self.logout()
+            self.login('barfoo', 'foobar')
+            self.create_tweet('test tweet while exempt')
+            self.logout()
+            self.assertEqual(self.timeline_of(1), [])
+            self.assertEqual(self.timeline_of(3), [1])
+            self.login('foobar', 'barfoo')
+            response = self.app.get('tweets/')
+            self.assertIn(b'test tweet while exempt', response.data)
+            self.logout()
+            self.login('bazbaz', 'foobar')
+            self.app.get('tweets/unfollow/2/')
+            self.logout()
+            self.assertEqual(self.timeline_of(1), [1, 2])
+            self.assertEqual(self.timeline_of(3), [])
+            self.login('foobar', 'barfoo')
+            response = self.app.get('tweets/')
+            self.assertIn(b'test tweet before the limit', response.data)
+            self.assertIn(b'test tweet while exempt', response.data)
+        finally:
+            app.config['TIMELINE_FANOUT_LIMIT'] = 10000
+
+    def test_timeline_query_count_does_not_grow_with_posters(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        for i in range(5):
+            db.session.add(User(
+                'user{0}'.format(i), 'user{0}@example.com'.format(i), 'x'))
+            db.session.add(Follower(1, i + 2))
+        db.session.commit()
+        for user_id in range(1, 7):
+            self.seed_tweets(2, user_id)
+        timelines.rebuild(1)
+        db.session.commit()
+        self.login('foobar', 'barfoo')
+        with assert_max_queries(self, 2):
+            response = self.app.get('tweets/')
+        self.assertIn(b'user4', response.data)
+        self.assertIn(b'foobar', response.data)
+
+    def test_timeline_pages_are_served_from_the_cache(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.login('foobar', 'barfoo')
+        self.seed_tweets(3)
+        self.app.get('tweets/')
+        with assert_max_queries(self, 1):
+            response = self.app.get('tweets/')
+        self.assertIn(b'seeded tweet 002', response.data)
+
+    def test_posting_invalidates_followers_cached_timelines(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.register('barfoo', 'barfoo@example.com', 'foobar', 'foobar')
+        self.login('foobar', 'barfoo')
+        self.app.get('tweets/follow/2/')
+        self.app.get('tweets/')
+        self.logout()
+        self.login('barfoo', 'foobar')
+        self.create_tweet('test tweet from barfoo')
+        self.logout()
+        self.login('foobar', 'barfoo')
+        response = self.app.get('tweets/')
+        self.assertIn(b'test tweet from barfoo', response.data)
+        self.logout()
+        self.login('barfoo', 'foobar')
+        self.app.get('tweets/delete/1/')
+        self.logout()
+        self.login('foobar', 'barfoo')
+        response = self.app.get('tweets/')
+        self.assertNotIn(b'test tweet from barfoo', response.data)
+
+    def test_unfollowing_invalidates_the_cached_timeline(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.register('barfoo', 'barfoo@example.com', 'foobar', 'foobar')
+        self.login('barfoo', 'foobar')
+        self.create_tweet('test tweet from barfoo')
+        self.logout()
+        self.login('foobar', 'barfoo')
+        self.app.get('tweets/follow/2/')
+        response = self.app.get('tweets/')
+        self.assertIn(b'test tweet from barfoo', response.data)
+        self.app.get('tweets/unfollow/2/')
+        response = self.app.get('tweets/')
+        self.assertNotIn(b'test tweet from barfoo', response.data)
+
 
 if __name__ == "__main__":
     unittest.main()
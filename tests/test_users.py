@@ -1,9 +1,10 @@
 import os
 import unittest
 
-from project import app, db
+from project import app, cache, db
 from project._config import BASE_DIR
 from project.models import User, Follower
+from helpers import assert_max_queries
 
 TEST_DB = 'test.db'
 
@@ -18,6 +19,7 @@ class MainTest(unittest.TestCase):
             os.path.join(BASE_DIR, TEST_DB)
         self.app = app.test_client()
         db.create_all()
+        cache.clear()
 
         self.assertEquals(app.debug, False)
 
@@ -146,6 +148,56 @@ class MainTest(unittest.TestCase):
         follower = db.session.query(Follower).first()
         self.assertEqual(str(follower), '<User {0} follows {1}>'.format('1', '2'))
 
+    def test_users_page_query_count_does_not_grow_with_users(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        for i in range(10):
+            db.session.add(User(
+                'user{0}'.format(i), 'user{0}@example.com'.format(i), 'x'))
+        db.session.commit()
+        for whom_id in range(2, 8):
+            db.session.add(Follower(1, whom_id))
+        db.session.commit()
+        self.login('foobar', 'barfoo')
+        with assert_max_queries(self, 3):
+            response = self.app.get('users/')
+        self.assertEqual(response.data.count(b'>Unfollow<'), 6)
+        self.assertEqual(response.data.count(b'>Follow<'), 4)
+
+    def test_posting_only_reloads_the_counters_of_the_poster(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.register('barfoo', 'barfoo@example.com','foobar', 'foobar')
+        self.login('foobar', 'barfoo')
+        self.app.get('users/')
+        self.app.post('tweets/post/', data=dict(tweet='counted'))
+        with assert_max_queries(self, 1) as queries:
+            response = self.app.get('users/')
+        self.assertIn('users.id IN (?)', queries.statements[0])
+        self.assertIn(b'1 tweets &middot; 0 following', response.data)
+
+    def test_users_page_is_served_from_the_cache(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.login('foobar', 'barfoo')
+        self.app.get('users/')
+        with assert_max_queries(self, 0):
+            self.app.get('users/')
+        self.logout()
+        self.register('barfoo', 'barfoo@example.com','foobar', 'foobar')
+        self.login('foobar', 'barfoo')
+        response = self.app.get('users/')
+        self.assertIn(b'barfoo', response.data)
+
+    def test_following_invalidates_the_cached_follow_set(self):
+        self.register('foobar', 'foobar@example.com','barfoo', 'barfoo')
+        self.register('barfoo', 'barfoo@example.com','foobar', 'foobar')
+        self.login('foobar', 'barfoo')
+        self.app.get('users/')
+        self.app.get('tweets/follow/2/')
+        response = self.app.get('users/')
+        self.assertIn(b'>Unfollow<', response.data)
+        self.app.get('tweets/unfollow/2/')
+        response = self.app.get('users/')
+        self.assertNotIn(b'>Unfollow<', response.data)
+
 
 if __name__ == "__main__":
     unittest.main()